@@ -1,15 +1,100 @@
-from flask import Flask, request, jsonify, abort, g, Response
+from flask import Flask, request, jsonify, abort, g, Response, stream_with_context
 from flask_httpauth import HTTPBasicAuth
 from flask_sqlalchemy import SQLAlchemy
-from passlib.apps import custom_app_context as pwd_context
-import os, random
+from sqlalchemy import and_, or_, event
+from sqlalchemy.orm import joinedload
+from itsdangerous import URLSafeTimedSerializer as Serializer, BadSignature, SignatureExpired
+from credential_cache import CredentialCache
+from password_hashing import PasswordHasher
+from migrations import run_migrations, pending_migrations
+from jobs import JobManager
+from analytics import marks_columns, subject_statistics
+from standings import IN_BATCH_SIZE, add_results, rerank, check_standings, rebuild_standings
+from response_cache import ResponseCache, MemoryBackend
+from instrumentation import Metrics
+from search import has_search_index, search_terms, search_ids
+from course_catalog import CourseCatalog
+from result_generator import generate_results
+from result_import import parse_line, read_records
+from result_export import export_chunks
+from serializers import ModelFields, json_encoder
+from database import database_uri, engine_options, sqlite_pragmas, apply_sqlite_pragmas
+import argparse, multiprocessing, os, time
+import click
 import datetime
+import base64, hashlib, hmac, json
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/test.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(os.environ)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], os.environ)
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLITE_PRAGMAS'] = sqlite_pragmas(os.environ)  # see database.py for the settings read from env
+# signs the auth tokens and keys the credential cache. Without SECRET_KEY a random key is drawn when app.py is
+# imported: tokens stop working when the server restarts, and processes that import app.py separately (serve.py
+# workers without preloading, CLI commands) don't accept each other's tokens
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    app.logger.warning('SECRET_KEY is not set, using a random key: auth tokens will not survive a restart and '
+                       'are only accepted by this process')
+    app.config['SECRET_KEY'] = os.urandom(32)
+app.config['CREDENTIAL_CACHE_SIZE'] = int(os.environ.get('CREDENTIAL_CACHE_SIZE', 1024))  # 0 disables the cache
+app.config['CREDENTIAL_CACHE_TTL'] = int(os.environ.get('CREDENTIAL_CACHE_TTL', 300))  # seconds
+app.config['AUTH_TOKEN_EXPIRATION'] = int(os.environ.get('AUTH_TOKEN_EXPIRATION', 3600))  # seconds
+app.config['RESULT_INSERT_CHUNK_SIZE'] = int(os.environ.get('RESULT_INSERT_CHUNK_SIZE', 1000))
+app.config['RESULT_MAX_MARK'] = float(os.environ.get('RESULT_MAX_MARK', 100))  # lines with other marks are rejected
+# processes parsing large result files and the size of the pieces they get, see result_import.py
+app.config['RESULT_IMPORT_PROCESSES'] = int(os.environ.get('RESULT_IMPORT_PROCESSES', multiprocessing.cpu_count()))
+app.config['RESULT_IMPORT_CHUNK_BYTES'] = int(os.environ.get('RESULT_IMPORT_CHUNK_BYTES', 1024 * 1024))
+# processes generating the semesters of random results in parallel, see result_generator.py
+app.config['RESULT_GENERATOR_PROCESSES'] = int(os.environ.get('RESULT_GENERATOR_PROCESSES', multiprocessing.cpu_count()))
+# directory of the branch files (CS, EC, ME) with the subject codes of every semester, see course_catalog.py
+app.config['CATALOG_DIR'] = os.environ.get('CATALOG_DIR', '.')
+app.config['CATALOG_CHECK_SECONDS'] = float(os.environ.get('CATALOG_CHECK_SECONDS', 2))  # between mtime checks
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# seconds, bounds how stale a worker process can be after another process changed the notices
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+# see password_hashing.py, unset means all cores and the passlib work factor
+app.config['PASSWORD_HASH_PROCESSES'] = int(os.environ['PASSWORD_HASH_PROCESSES']) \
+    if os.environ.get('PASSWORD_HASH_PROCESSES') else None
+app.config['PASSWORD_HASH_ROUNDS'] = int(os.environ['PASSWORD_HASH_ROUNDS']) if os.environ.get('PASSWORD_HASH_ROUNDS') else None
+app.config['PASSWORD_HASH_PENDING'] = int(os.environ['PASSWORD_HASH_PENDING']) if os.environ.get('PASSWORD_HASH_PENDING') else None
+app.config['MAX_BULK_USERS'] = 5000  # users accepted by one bulk_create_users call
+app.config['MAX_PROCESS_REQUESTS'] = 5000  # requests changed by one process_requests call
+# per-request SQL, password and serialization timings on /metrics and in a Server-Timing header, off by default
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # threads running background jobs
+app.config['DEFAULT_PAGE_SIZE'] = 50  # page size of the list endpoints when the client sends no limit
+app.config['MAX_PAGE_SIZE'] = 500
+app.config['STREAM_BATCH_SIZE'] = 1000  # rows loaded at a time by streamed list responses
+# library writing the list responses: orjson, ujson, json, or auto for the fastest installed, see serializers.py
+app.config['JSON_ENCODER'] = os.environ.get('JSON_ENCODER', 'auto')
+# /api/sync sends the rows of the last seconds again on the next poll, rows of transactions that were
+# still running when a poll ran carry a time before it
+app.config['SYNC_OVERLAP_SECONDS'] = float(os.environ.get('SYNC_OVERLAP_SECONDS', 5))
+app.config['SYNC_TOMBSTONE_DAYS'] = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))  # older "since" means resync
+# searches matching more rows than this are sorted newest first instead of by relevance, see search.py
+app.config['SEARCH_MAX_RANKED'] = int(os.environ.get('SEARCH_MAX_RANKED', 10000))
+# a database without the full text index is searched with LIKE and checked for it again after this long,
+# `flask migrate` may build it while the server runs
+app.config['SEARCH_INDEX_CHECK_SECONDS'] = float(os.environ.get('SEARCH_INDEX_CHECK_SECONDS', 60))
 db = SQLAlchemy(app)
+with app.app_context():
+    apply_sqlite_pragmas(db.engine, app.config)
 auth = HTTPBasicAuth()
+credential_cache = CredentialCache(app.config['SECRET_KEY'], max_size=app.config['CREDENTIAL_CACHE_SIZE'],
+                                   ttl=app.config['CREDENTIAL_CACHE_TTL'])
+password_hasher = PasswordHasher(processes=app.config['PASSWORD_HASH_PROCESSES'],
+                                 rounds=app.config['PASSWORD_HASH_ROUNDS'],
+                                 max_pending=app.config['PASSWORD_HASH_PENDING'])
+metrics = Metrics()
+metrics.register(app)  # hooks that do nothing until install()
+if app.config['METRICS_ENABLED']:
+    metrics.install(app)
+job_manager = JobManager(workers=app.config['JOB_WORKERS'])
+response_cache = ResponseCache(MemoryBackend(max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES']),
+                               ttl=app.config['RESPONSE_CACHE_TTL'])
+catalog = CourseCatalog(app.config['CATALOG_DIR'], check_interval=app.config['CATALOG_CHECK_SECONDS'])
+encode_json = json_encoder(app.config['JSON_ENCODER'])
 
 
 class User(db.Model):
@@ -33,9 +118,13 @@ class User(db.Model):
 
     # 1 for student, 2 for COE department, 3 for admin, 4 for branch department, 5 HOD
 
-    def __init__(self, username, password, email, name, rollno, user_access_level=1):
+    def __init__(self, username, password, email, name, rollno, user_access_level=1, password_hash=None):
         self.username = username
-        self.password_hash = pwd_context.hash(password)
+        # a hash computed beforehand (e.g. by a bulk loader hashing in parallel) skips hashing here
+        if password_hash is None:
+            with metrics.timed('password_seconds'):
+                password_hash = password_hasher.hash(password)
+        self.password_hash = password_hash
         self.email = email
         if user_access_level > 5 or user_access_level < 1:
             user_access_level = 1
@@ -44,7 +133,34 @@ class User(db.Model):
         self.roll_number = rollno
 
     def verify_password(self, password):
-        return pwd_context.verify(password, self.password_hash)
+        with metrics.timed('password_seconds'):
+            return password_hasher.verify(password, self.password_hash)
+
+    def generate_auth_token(self):
+        # a digest of the password hash is signed along so that changing the password revokes old tokens,
+        # the token is only signed, so it must not carry any of the hash itself
+        s = Serializer(app.config['SECRET_KEY'])
+        return s.dumps({'id': self.id, 'pw': self.password_digest()})
+
+    def password_digest(self):
+        secret_key = app.config['SECRET_KEY']
+        if not isinstance(secret_key, bytes):
+            secret_key = secret_key.encode('utf-8')
+        return hmac.new(secret_key, self.password_hash.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+    @staticmethod
+    def verify_auth_token(token):
+        s = Serializer(app.config['SECRET_KEY'])
+        try:
+            data = s.loads(token, max_age=app.config['AUTH_TOKEN_EXPIRATION'])
+        except SignatureExpired:
+            return None  # valid token, but expired
+        except BadSignature:
+            return None  # invalid token
+        user = User.query.get(data['id'])
+        if user is None or not hmac.compare_digest(user.password_digest(), str(data.get('pw'))):
+            return None
+        return user
 
     def get_json(self):
         return {
@@ -68,13 +184,16 @@ class User(db.Model):
 
 class Notice(db.Model):
     __tablename__ = "Notices"
+    __table_args__ = (db.Index('ix_notices_branch_date_created', 'branch', 'date_created'),
+                      db.Index('ix_notices_branch_date_modified', 'branch', 'date_modified'))
     id = db.Column(db.Integer, primary_key=True)
-    date_created = db.Column(db.DateTime, default=datetime.datetime.now())
+    # the function, not its value, so that every row gets the time it is written
+    date_created = db.Column(db.DateTime, default=datetime.datetime.now)
     title = db.Column(db.String(250))
     content = db.Column(db.String(1000))
     branch = db.Column(db.String(20))
     created_by = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
-    date_modified = db.Column(db.DateTime, default=datetime.datetime.now())
+    date_modified = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     attachment_url = db.Column(db.String(250))
 
     def __init__(self, title, content, branch, user, attachment_url):
@@ -94,6 +213,7 @@ class Notice(db.Model):
             'branch': self.branch,
             'attachment_url': self.attachment_url,
             'date_time': self.date_created,
+            'date_modified': self.date_modified
         }
 
     def __repr__(self):
@@ -102,6 +222,7 @@ class Notice(db.Model):
 
 class Result(db.Model):
     __tablename__ = "Result"
+    __table_args__ = (db.Index('ux_result_user_id_semester', 'user_id', 'semester', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     semester = db.Column(db.Integer, nullable=False)
@@ -114,11 +235,8 @@ class Result(db.Model):
         self.semester = semester
         self.marks = marks
         self.subjects = subjects
-        temp = 0
-        for x in self.marks.split(','):
-            temp += float(x)
-
-        self.total = temp / len(self.marks.split(','))
+        marks_list = [float(x) for x in self.marks.split(',')]
+        self.total = sum(marks_list) / len(marks_list)
 
     def get_json(self):
         return {
@@ -136,68 +254,292 @@ class Result(db.Model):
             self.total) + "\n"
 
 
-def insert_result(semester):  # insert the result present in semester.txt file in the database
-    f = open(semester + ".txt", "r")
-    user_id = ''
-    for line in f:
-        line = line.split("\n")[0]
-        x = line.split(',')
-        user_id = x[0]
-        user = User.query.filter_by(id=user_id).first()
-        print user.id
-        branch = user.branch
-        if branch is 'admin' or branch is 'COE' or user.user_access_level > 1:
-            continue
-        codes = open(branch, 'r')
-        lines = codes.readlines()
-        curr_sem_codes = lines[int(semester) - 1].split("\n")[0]
-        codes.close()
-        marks = ''
-        for i in range(1, len(x) - 1):
-            marks += x[i] + ','
-        marks += x[len(x) - 1]
-        result = Result(user_id, marks, semester, curr_sem_codes)
-        already_present = Result.query.filter_by(user_id=user_id, semester=semester).first()
-        if already_present is not None:  # will not insert the result if the result for a user for a particular semester is already present
-            continue
-        try:
-            db.session.add(result)
-            db.session.commit()
-            print(result)
-        except Exception as e:
-            print e.__str__()
+class ResultMarks(db.Model):
+    # one row per subject of a Result, so per-subject questions don't have to split Result.marks
+    __tablename__ = "ResultMarks"
+    __table_args__ = (db.Index('ix_result_marks_branch_semester', 'branch', 'semester'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
+    semester = db.Column(db.Integer, nullable=False)
+    branch = db.Column(db.String(20), nullable=False)
+    subject = db.Column(db.String(20), nullable=False)
+    marks = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return "User id: " + str(self.user_id) + "\nSemester: " + str(self.semester) + "\nSubject: " + \
+               self.subject + "\nMarks: " + str(self.marks) + "\n"
+
+
+class SemesterRank(db.Model):
+    # rank of a Result among the results of the branch in that semester, maintained by standings.py
+    __tablename__ = "SemesterRanks"
+    __table_args__ = (db.Index('ux_semester_ranks_user_id_semester', 'user_id', 'semester', unique=True),
+                      db.Index('ix_semester_ranks_branch_semester_class_rank', 'branch', 'semester', 'class_rank'))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
+    branch = db.Column(db.String(20), nullable=False)
+    semester = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    class_rank = db.Column(db.Integer)
+
+    def get_json(self):
+        return {
+            'user_id': self.user_id,
+            'branch': self.branch,
+            'semester': self.semester,
+            'total': self.total,
+            'rank': self.class_rank
+        }
 
 
-    f.close()
-    return
+class StudentStanding(db.Model):
+    # cumulative average of the semester totals of a student and its rank in the branch, see standings.py
+    __tablename__ = "StudentStandings"
+    __table_args__ = (db.Index('ix_student_standings_branch_class_rank', 'branch', 'class_rank'),)
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), primary_key=True, autoincrement=False)
+    branch = db.Column(db.String(20), nullable=False)
+    semesters = db.Column(db.Integer, nullable=False)
+    total_sum = db.Column(db.Float, nullable=False)
+    cumulative_average = db.Column(db.Float, nullable=False)
+    class_rank = db.Column(db.Integer)
+
+    def get_json(self):
+        return {
+            'user_id': self.user_id,
+            'branch': self.branch,
+            'semesters': self.semesters,
+            'cumulative_average': self.cumulative_average,
+            'rank': self.class_rank
+        }
 
 
-def generate_random_result(semester, num):  # generates random result for 100 users and saves it in semester.txt file
-    f = open(semester + ".txt", 'w+')
-    for user in range(1, num+1):
-        f.write("%d," % user)
-        for number in range(1, 10):
-            rand = random.randint(1, 101)
-            f.write("%d," % rand)
-        rand = random.randint(1, 101)
-        f.write("%d\n" % rand)
+def parse_result_lines(lines):
+    # (line number, user id, marks as written, [marks]) of 'user_id,mark,...' lines, or
+    # (line number, None, reason, None) for a line that can't be read, see result_import.parse_line
+    for line_number, line in enumerate(lines, 1):
+        parsed = parse_line(line.split("\n")[0], app.config['RESULT_MAX_MARK'])
+        if isinstance(parsed, tuple):
+            yield (line_number,) + parsed
+        else:
+            yield line_number, None, parsed, None
 
-    f.close()
+
+def insert_result(semester, chunk_size=None, job=None):  # insert the result present in semester.txt file in the database
+    with open(semester + ".txt", "r") as f:
+        return insert_result_records(semester, parse_result_lines(f), chunk_size=chunk_size, job=job)
+
+
+def import_result_file(path, semester, processes=None, chunk_bytes=None, reject_path=None, job=None):
+    # A result file of any size, parsed by a pool of processes while the chunks already parsed are
+    # written, see result_import.py. Rejected lines go to reject_path when given.
+    stats = {}
+    start = time.time()
+    records = read_records(path, processes=app.config['RESULT_IMPORT_PROCESSES'] if processes is None else processes,
+                           chunk_bytes=chunk_bytes or app.config['RESULT_IMPORT_CHUNK_BYTES'],
+                           max_mark=app.config['RESULT_MAX_MARK'], stats=stats)
+    rejects = open(reject_path, 'w') if reject_path else None
+    try:
+        report = insert_result_records(semester, records, job=job, rejects=rejects)
+    finally:
+        if rejects is not None:
+            rejects.close()
+    elapsed = time.time() - start
+    report.update({
+        'lines': stats['lines'],
+        'bytes': stats['bytes'],
+        'lines_per_sec': stats['lines'] / elapsed if elapsed else 0.0,
+        'mb_per_sec': stats['bytes'] / 1048576.0 / elapsed if elapsed else 0.0
+    })
+    return report
+
+
+def insert_result_records(semester, records, chunk_size=None, job=None, rejects=None):
+    # Writes (line number, user id, marks as written, [marks]) records of one semester, see parse_result_lines.
+    # The report keeps the first 100 rejected lines only, rejected_count is the number of all of them; with
+    # `rejects`, a file, every rejected line is also written to it as 'line number,reason'.
+    # Users and the results already present are loaded once, subject codes come from the catalog. New rows are written
+    # with one executemany INSERT per chunk so the write lock is released between chunks.
+    # When run by a background job its progress is updated and cancellation checked after every chunk.
+    # Every chunk also adds its rows to the rank tables, the touched ranks are recomputed once at the end.
+    chunk_size = chunk_size or app.config['RESULT_INSERT_CHUNK_SIZE']
+    start = time.time()
+    users = dict((user_id, (branch, access_level)) for user_id, branch, access_level in
+                 db.session.query(User.id, User.branch, User.user_access_level))
+    # will not insert the result if the result for a user for a particular semester is already present
+    present = set(user_id for (user_id,) in db.session.query(Result.user_id).filter_by(semester=int(semester)))
+    subject_codes = {}  # branch -> (codes, codes joined), one catalog lookup per branch
+    rows = []
+    marks_rows = []
+    rank_rows = []
+    report = {'semester': int(semester), 'inserted': 0, 'skipped': 0, 'rejected': [], 'rejected_count': 0}
+
+    def reject(line_number, reason):
+        report['rejected_count'] += 1
+        if rejects is not None:
+            rejects.write('%d,%s\n' % (line_number, reason))
+        if len(report['rejected']) < 100:  # a bad file of millions of lines mustn't be kept in memory
+            report['rejected'].append((line_number, reason))
+
+    def flush():
+        if rows:
+            db.session.execute(Result.__table__.insert(), rows)
+            db.session.execute(ResultMarks.__table__.insert(), marks_rows)
+            add_results(db.session.connection(), rank_rows)
+            db.session.commit()
+            report['inserted'] += len(rows)
+            if job is not None:
+                job.add_rows(len(rows))
+            del rows[:]
+            del marks_rows[:]
+            del rank_rows[:]
+            if job is not None:
+                job.check_cancelled()
+
+    ranked_branches = set()
+    try:
+        for line_number, user_id, marks_text, marks in records:
+            if user_id is None:
+                reject(line_number, marks_text)
+                continue
+            if user_id not in users:
+                reject(line_number, 'Unknown user %d' % user_id)
+                continue
+            branch, access_level = users[user_id]
+            if branch in ('admin', 'COE') or access_level > 1 or user_id in present:
+                report['skipped'] += 1
+                continue
+            if branch not in subject_codes:
+                codes = catalog.subjects(branch, int(semester))
+                subject_codes[branch] = (codes, ','.join(codes)) if codes else None
+            if subject_codes[branch] is None:
+                reject(line_number, 'No subject codes for %s semester %s' % (branch, semester))
+                continue
+            subjects, joined_subjects = subject_codes[branch]
+            if len(subjects) != len(marks):
+                reject(line_number, 'Expected %d marks, got %d' % (len(subjects), len(marks)))
+                continue
+            present.add(user_id)
+            rows.append({
+                'user_id': user_id,
+                'semester': int(semester),
+                'marks': marks_text,
+                'subjects': joined_subjects,
+                'total': sum(marks) / len(marks)
+            })
+            marks_rows.extend({
+                'user_id': user_id,
+                'semester': int(semester),
+                'branch': branch,
+                'subject': subject,
+                'marks': mark
+            } for subject, mark in zip(subjects, marks))
+            rank_rows.append({
+                'user_id': user_id,
+                'semester': int(semester),
+                'branch': branch,
+                'total': rows[-1]['total']
+            })
+            ranked_branches.add(branch)
+            if len(rows) >= chunk_size:
+                flush()
+        flush()
+    finally:  # a cancelled job still ranks the chunks it committed
+        db.session.rollback()  # drops a chunk that failed to commit
+        for branch in ranked_branches:
+            rerank(db.session.connection(), branch, int(semester))
+            rerank(db.session.connection(), branch)
+        db.session.commit()
+
+    if job is not None:
+        job.add_errors(['Semester %s line %d: %s' % (semester, line_number, reason)
+                        for line_number, reason in report['rejected']])
+    elapsed = time.time() - start
+    report['seconds'] = elapsed
+    report['rows_per_sec'] = report['inserted'] / elapsed if elapsed else 0.0
+    app.logger.info('Semester %s: %d inserted, %d skipped, %d rejected, %.0f rows/sec', semester, report['inserted'],
+                    report['skipped'], report['rejected_count'], report['rows_per_sec'])
+    return report
+
+
+def student_groups(semesters):
+    # {semester: [(student ids, number of subjects)]} of the students whose branch has codes for the semester
+    students = {}
+    for user_id, branch in db.session.query(User.id, User.branch).filter(User.user_access_level == 1) \
+            .order_by(User.id):
+        if branch not in ('admin', 'COE'):
+            students.setdefault(branch, []).append(user_id)
+    groups = {}
+    for semester in semesters:
+        sizes = {}
+        for branch, user_ids in sorted(students.items()):
+            codes = catalog.subjects(branch, semester)
+            if codes:
+                sizes.setdefault(len(codes), []).extend(user_ids)
+        groups[semester] = [(user_ids, subjects) for subjects, user_ids in sorted(sizes.items())]
+    return groups
+
+
+def generated_records(groups):
+    # the records of insert_result_records for the arrays of generate_results
+    line_number = 0
+    for user_ids, marks in groups:
+        marks_format = ','.join(['%d'] * marks.shape[1])
+        for user_id, row in zip(user_ids, marks.tolist()):
+            line_number += 1
+            yield line_number, user_id, marks_format % tuple(row), [float(mark) for mark in row]
+
+
+def generate_random_result(semesters, seed=None, write_files=False, processes=None, job=None):
+    # Random marks of every student for semesters 1 to `semesters`, the same for the same seed.
+    # Written straight to the database, or with write_files to <semester>.txt for insert_result.
+    if processes is None:
+        processes = app.config['RESULT_GENERATOR_PROCESSES']
+    numbers = range(1, semesters + 1)
+    reports = []
+    for semester, result in generate_results(numbers, student_groups(numbers), seed=seed, processes=processes,
+                                             path_format='%s.txt' if write_files else None):
+        if job is not None:
+            job.check_cancelled()
+        if write_files:
+            reports.append({'semester': semester, 'written': result})
+        else:
+            reports.append(insert_result_records(str(semester), generated_records(result), job=job))
+        if job is not None:
+            job.step()
+    return reports
+
+
+def random_result_job(job, semesters, seed):  # runs on a job_manager thread, one step per semester
+    with app.app_context():
+        generate_random_result(semesters, seed=seed, job=job)
 
 
 @app.route('/api/results/create_random_result', methods=['POST'])
 @auth.login_required
 def create_random_result(semesters=8):
+    # overwrites the results of the whole campus, for the examination department and admins only
+    if g.user.user_access_level not in (2, 3):
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
     try:
-        num = len(User.query.all())
-        print str(num)+"\n"
-        for i in range(1, semesters + 1):
-            generate_random_result(str(i), num)
-            insert_result(str(i))
-
+        data = request.get_json(silent=True) or {}
+        semesters = int(data.get('semesters', semesters))
+        seed = int(data['seed']) if data.get('seed') is not None else None
+        # a second job would insert the same semesters as the running one
+        job, started = job_manager.submit_unique('create_random_result', g.user.id, semesters, random_result_job,
+                                                 semesters, seed)
+        if not started:
+            return jsonify({
+                'code': 409,
+                'content': 'Result generation is already running',
+                'job_id': job.id
+            })
         return jsonify({
-            'code': 200,
-            'content': 'Result inserted successfully'
+            'code': 202,
+            'content': 'Result generation started',
+            'job_id': job.id
         })
     except Exception as e:
         return jsonify({
@@ -207,25 +549,479 @@ def create_random_result(semesters=8):
         })
 
 
+def find_job():  # the job named in the request if the current user may see it
+    data = request.get_json(silent=True) or {}
+    job = job_manager.get(data.get('id'))
+    if job is None or (job.owner != g.user.id and g.user.user_access_level != 3):
+        return None
+    return job
+
+
+@app.route('/api/jobs/status', methods=['POST'])
+@auth.login_required
+def job_status():
+    job = find_job()
+    if job is None:
+        return jsonify({
+            'code': 404,
+            'content': 'Job not found'
+        })
+    return jsonify({
+        'code': 200,
+        'job': job.get_json()
+    })
+
+
+@app.route('/api/jobs/cancel', methods=['POST'])
+@auth.login_required
+def cancel_job():
+    job = find_job()
+    if job is None:
+        return jsonify({
+            'code': 404,
+            'content': 'Job not found'
+        })
+    if not job_manager.cancel(job.id):
+        return jsonify({
+            'code': 400,
+            'content': 'Job has already finished',
+            'job': job.get_json()
+        })
+    return jsonify({
+        'code': 200,
+        'content': 'Cancellation requested',
+        'job': job.get_json()
+    })
+
+
+@app.route('/api/results/analytics', methods=['POST'])
+@auth.login_required
+def result_analytics():
+    if g.user.user_access_level < 2:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    try:
+        data = request.get_json(silent=True) or {}
+        branch = data.get('branch')
+        semester = data.get('semester')
+        if branch is None or semester is None:
+            return jsonify({
+                'code': 400,
+                'content': 'Branch and semester are required'
+            })
+        percentiles = [float(p) for p in data.get('percentiles', [25, 75, 90]) if 0 <= float(p) <= 100]
+        bins = max(1, min(int(data.get('bins', 10)), 100))
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
+    try:
+        query = db.select([ResultMarks.subject, ResultMarks.marks, ResultMarks.user_id]) \
+            .where(ResultMarks.branch == branch).where(ResultMarks.semester == int(semester))
+        # plain DB-API tuples, building a result row object per mark costs more than the statistics
+        subjects, marks, user_ids = marks_columns(db.session.execute(query).cursor.fetchall())
+        statistics = subject_statistics(subjects, marks, user_ids, percentiles=percentiles, bins=bins,
+                                        max_mark=app.config['RESULT_MAX_MARK'])
+        # in the order of the curriculum, subjects no longer in the catalog last
+        order = dict((code, i) for i, code in enumerate(catalog.subjects(branch, int(semester)) or ()))
+        statistics.sort(key=lambda subject: (order.get(subject['subject'], len(order)), subject['subject']))
+        return jsonify({
+            'code': 200,
+            'branch': branch,
+            'semester': int(semester),
+            'subjects': statistics
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 500,
+            'content': 'Unable to process your request',
+            'exception': e.__str__()
+        })
+
+
+def export_request(data):
+    # (branch, first semester, last semester, format) of an export, "semester" or "from" and "to"
+    branch = data.get('branch')
+    if branch is None:
+        raise ValueError('Branch is required')
+    if data.get('semester') is not None:
+        first = last = int(data['semester'])
+    else:
+        first, last = int(data.get('from', 1)), int(data.get('to', 8))
+    export_format = data.get('format') or ('ndjson' if 'application/x-ndjson' in request.headers.get('Accept', '')
+                                           else 'csv')
+    if export_format not in ('csv', 'ndjson') or first > last:
+        raise ValueError('format must be csv or ndjson and "from" not after "to"')
+    return branch, first, last, export_format
+
+
+def subject_columns(branch, first, last):
+    # the subject codes of the semesters in the catalog's order, the CSV columns of an export
+    columns = []
+    for semester in range(first, last + 1):
+        columns.extend(code for code in catalog.subjects(branch, semester) or () if code not in columns)
+    return columns
+
+
+@app.route('/api/results/export', methods=['POST'])
+@auth.login_required
+def export_results():
+    # every result of a branch for a semester range, streamed as it is read, see result_export.py
+    if g.user.user_access_level < 2:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    try:
+        branch, first, last, export_format = export_request(request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
+    columns = subject_columns(branch, first, last)
+
+    def generate():
+        connection = db.engine.connect()
+        try:
+            for chunk, rows in export_chunks(connection, branch, first, last, export_format, columns,
+                                             batch_size=app.config['STREAM_BATCH_SIZE']):
+                metrics.add_rows(rows)
+                metrics.add_bytes(len(chunk))
+                yield chunk
+        finally:
+            connection.close()
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="results-%s-%d-%d.%s"' % (
+        branch, first, last, export_format)
+    return response
+
+
+@app.route('/api/catalog', methods=['POST'])
+@auth.login_required
+def view_catalog():
+    # the subject codes of every branch, of one "branch" (and "semester"), or the semesters offering a "code"
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('code') is not None:
+            offered = catalog.lookup(data['code'])
+            if not offered:
+                return jsonify({
+                    'code': 404,
+                    'content': 'Subject not found'
+                })
+            return jsonify({
+                'code': 200,
+                'subject': data['code'],
+                'offered': [{'branch': branch, 'semester': semester} for branch, semester in offered]
+            })
+        branch = data.get('branch')
+        if branch is not None and data.get('semester') is not None:
+            subjects = catalog.subjects(branch, int(data['semester']))
+            if subjects is None:
+                return jsonify({
+                    'code': 404,
+                    'content': 'No subject codes for %s semester %s' % (branch, data['semester'])
+                })
+            return jsonify({
+                'code': 200,
+                'branch': branch,
+                'semester': int(data['semester']),
+                'subjects': list(subjects)
+            })
+        branches = catalog.get_json(branch)
+        if branch is not None and not branches:
+            return jsonify({
+                'code': 404,
+                'content': 'Branch not found'
+            })
+        return jsonify({
+            'code': 200,
+            'branches': branches
+        })
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
+
+
+def ranked_students(branch, semester, first, last):
+    # students ranked first to last in a branch, in a semester or cumulatively, from the rank tables
+    if semester is None:
+        table, score = StudentStanding, StudentStanding.cumulative_average
+        query = db.session.query(StudentStanding, User.username, User.name).filter(StudentStanding.branch == branch)
+    else:
+        table, score = SemesterRank, SemesterRank.total
+        query = db.session.query(SemesterRank, User.username, User.name) \
+            .filter(SemesterRank.branch == branch, SemesterRank.semester == semester)
+    rows = query.join(User, User.id == table.user_id) \
+        .filter(table.class_rank >= first, table.class_rank <= last) \
+        .order_by(table.class_rank, table.user_id).limit(app.config['MAX_PAGE_SIZE']).all()
+    students = []
+    for standing, username, name in rows:
+        student = standing.get_json()
+        student['username'] = username
+        student['name'] = name
+        students.append(student)
+    return students
+
+
+def rank_request():
+    # (branch, semester or None, first, last) of a top or rank_range request the current user may see
+    data = request.get_json(silent=True) or {}
+    branch = data.get('branch') or g.user.branch
+    if g.user.user_access_level == 1 and branch != g.user.branch:
+        raise ValueError('Students can only see the ranks of their own branch')
+    semester = int(data['semester']) if data.get('semester') is not None else None
+    if 'limit' in data:
+        first, last = 1, int(data['limit'])
+    else:
+        first, last = int(data.get('from', 1)), int(data.get('to', 10))
+    if first < 1 or last < first or last - first >= app.config['MAX_PAGE_SIZE']:
+        raise ValueError('Ranks must be between 1 and at most %d apart' % app.config['MAX_PAGE_SIZE'])
+    return branch, semester, first, last
+
+
+@app.route('/api/results/rank', methods=['POST'])
+@auth.login_required
+def my_rank():
+    # the rank of the current student in every semester and cumulatively, out of the students ranked
+    user = g.user
+    try:
+        semesters = [rank.get_json() for rank in
+                     SemesterRank.query.filter_by(user_id=user.id).order_by(SemesterRank.semester)]
+        if semesters:  # counted on the (branch, semester, class_rank) index
+            out_of = dict(db.session.query(SemesterRank.semester, db.func.count(SemesterRank.semester))
+                          .filter(SemesterRank.branch == semesters[0]['branch'],
+                                  SemesterRank.semester.in_([semester['semester'] for semester in semesters]))
+                          .group_by(SemesterRank.semester))
+            for semester in semesters:
+                semester['out_of'] = out_of[semester['semester']]
+        standing = StudentStanding.query.get(user.id)
+        cumulative = None
+        if standing is not None:
+            cumulative = standing.get_json()
+            cumulative['out_of'] = db.session.query(db.func.count(StudentStanding.branch)) \
+                .filter(StudentStanding.branch == standing.branch).scalar()
+        return jsonify({
+            'code': 200,
+            'semesters': semesters,
+            'cumulative': cumulative
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 500,
+            'content': 'Unable to process your request',
+            'exception': e.__str__()
+        })
+
+
+@app.route('/api/results/top', methods=['POST'])
+@auth.login_required
+def top_students():
+    # the first "limit" ranks (default 10) of a branch, in a semester or cumulatively; tied students are all listed
+    try:
+        branch, semester, first, last = rank_request()
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
+    return jsonify({
+        'code': 200,
+        'branch': branch,
+        'semester': semester,
+        'students': ranked_students(branch, semester, first, last)
+    })
+
+
+@app.route('/api/results/rank_range', methods=['POST'])
+@auth.login_required
+def rank_range():
+    # ranks "from" to "to" of a branch, in a semester or cumulatively
+    return top_students()
+
+
+@app.route('/api/results/check_standings', methods=['POST'])
+@auth.login_required
+def check_result_standings():
+    # recomputes the rank tables from Result and compares, {"rebuild": true} replaces them when they differ
+    if g.user.user_access_level != 3:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    data = request.get_json(silent=True) or {}
+    report = check_standings(db.session.connection())
+    if report['mismatches'] and data.get('rebuild'):
+        report['rebuilt'] = rebuild_standings(db.session.connection())
+        db.session.commit()
+    return jsonify({
+        'code': 200,
+        'content': report
+    })
+
+
+CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime.datetime):
+        value = value.strftime(CURSOR_DATE_FORMAT)
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort_column):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+        if isinstance(sort_column.type, db.DateTime):
+            value = datetime.datetime.strptime(value, CURSOR_DATE_FORMAT)
+        return value, int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_query(query, sort_column, id_column, descending=True):
+    # orders the query by (sort_column, id) in SQL and skips the rows up to the `after` cursor sent by the client
+    data = request.get_json(silent=True) or {}
+    cursor = data.get('after')
+
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor, sort_column)
+        if descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < last_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > last_id)))
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    return query
+
+
+def keyset_page(query, sort_column, id_column, descending=True):
+    # the page after the `after` cursor, with the cursor of the next page or None on the last page
+    data = request.get_json(silent=True) or {}
+    limit = int(data.get('limit') or app.config['DEFAULT_PAGE_SIZE'])
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+    query = keyset_query(query, sort_column, id_column, descending)
+    rows = query.limit(limit + 1).all()  # one extra row tells whether there is a next page
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], sort_column.key), rows[-1].id)
+    metrics.add_rows(len(rows))
+    return rows, next_cursor
+
+
+def stream_format():
+    # 'ndjson' or 'json' when the client asks for a streamed list, with "stream" or an Accept header
+    data = request.get_json(silent=True) or {}
+    stream = data.get('stream')
+    if stream is None and 'application/x-ndjson' in request.headers.get('Accept', ''):
+        stream = 'ndjson'
+    if stream is None or stream is False:
+        return None
+    return 'ndjson' if stream == 'ndjson' else 'json'
+
+
+def stream_response(query, key, stream, code=200, serialize=None):
+    # Sends the rows of the query as they are loaded instead of building the whole list first.
+    # Rows are fetched and sent `STREAM_BATCH_SIZE` at a time, so memory doesn't grow with the number of rows.
+    # serialize turns a row into its dict, row.get_json() when the query loads model objects.
+    batch_size = app.config['STREAM_BATCH_SIZE']
+    serialize = serialize or (lambda row: row.get_json())
+
+    def batches():
+        batch = []
+        for row in query.yield_per(batch_size):
+            batch.append(encode_json(serialize(row)))
+            if len(batch) == batch_size:
+                metrics.add_rows(len(batch))
+                yield batch
+                batch = []
+        if batch:
+            metrics.add_rows(len(batch))
+            yield batch
+
+    def generate_ndjson():
+        for batch in batches():
+            chunk = '\n'.join(batch) + '\n'
+            metrics.add_bytes(len(chunk))
+            yield chunk
+
+    def generate_json():
+        yield '{"code": %d, "%s": [' % (code, key)
+        separator = ''
+        for batch in batches():
+            chunk = separator + ', '.join(batch)
+            metrics.add_bytes(len(chunk))
+            yield chunk
+            separator = ', '
+        yield ']}'
+
+    if stream == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
+def list_serializer(model_fields):
+    # the serializer of the fields= of the request, every field of get_json when there is none
+    return model_fields.serializer((request.get_json(silent=True) or {}).get('fields'))
+
+
+def json_response(body):
+    # jsonify through the encoder of JSON_ENCODER, for list bodies built by the serializers
+    return Response(encode_json(body), mimetype='application/json')
+
+
+RESULT_FIELDS = ModelFields([('id', Result.id), ('user_id', Result.user_id), ('marks', Result.marks),
+                             ('subjects', Result.subjects), ('total', Result.total), ('semester', Result.semester)],
+                            keys=(Result.semester, Result.id))
+
+
 @app.route('/api/results/view_result', methods=['POST'])
 @auth.login_required
 def view_result():
     user = g.user
 
     try:
-        results = Result.query.filter_by(user_id=user.id)
+        try:
+            serialize = list_serializer(RESULT_FIELDS)
+        except ValueError as e:
+            return jsonify({
+                'code': 400,
+                'content': 'Bad request',
+                'exception': e.__str__()
+            })
+        results = serialize.select(Result.query.filter_by(user_id=user.id))
+        stream = stream_format()
+        if stream is not None:
+            return stream_response(keyset_query(results, Result.semester, Result.id, descending=False), 'results',
+                                   stream, serialize=serialize)
+        results, next_cursor = keyset_page(results, Result.semester, Result.id, descending=False)
         new_results = []
 
         try:
             for result in results:
-                new_result = result.get_json()
+                new_result = serialize(result)
                 new_results.append(new_result)
 
-            sorted(new_results, key=lambda new_result: new_result['semester'])
-
-            return jsonify({
+            return json_response({
                 'code': 200,
-                'results': new_results
+                'results': new_results,
+                'next_cursor': next_cursor
             })
 
         except Exception as e:
@@ -245,13 +1041,19 @@ def view_result():
 
 class ApplicationRequests(db.Model):
     __tablename__ = "Requests"
+    __table_args__ = (db.Index('ix_requests_access_level_time_modified', 'access_level', 'time_modified'),
+                      db.Index('ix_requests_request_from_time_modified', 'request_from', 'time_modified'))
     id = db.Column(db.Integer, primary_key=True)
     request_from = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     request_type = db.Column(db.Integer, nullable=False)
-    time_created = db.Column(db.DateTime, default=datetime.datetime.now(), nullable=False)
-    time_modified = db.Column(db.DateTime, default=datetime.datetime.now(), nullable=False)
+    time_created = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    time_modified = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now,
+                              nullable=False)
     time_completed = db.Column(db.DateTime)
     state = db.Column(db.Integer, default=0)  # 0: Received, 1:Read, 3: Processing 4: Rejected, 5:Completed
+    # the states a request can be moved to from each state, rejected and completed requests stay as they are
+    TRANSITIONS = {0: (1, 3, 4, 5), 1: (3, 4, 5), 3: (4, 5), 4: (), 5: ()}
+    FINISHED_STATES = (4, 5)  # time_completed is set when a request enters one of these
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.String(1000))
     access_level = db.Column(db.Integer, nullable=False)
@@ -283,7 +1085,8 @@ class ApplicationRequests(db.Model):
             'content': self.content,
             'state': self.state,
             'time_modified': self.time_modified,
-            'request_from': User.query.filter_by(id=self.request_from).first().get_json(),
+            'time_completed': self.time_completed,
+            'request_from': self.Users.get_json(),  # load with joinedload(ApplicationRequests.Users) for lists
             'attachment_url': self.attachment_url
         }
 
@@ -291,6 +1094,15 @@ class ApplicationRequests(db.Model):
         return "Request id: " + self.request_id + "\nTitle: " + self.title + "\nRequest from: " + self.request_from + "\nRequest type: " + self.request_type + "\n"
 
 
+USER_FIELDS = ModelFields([(name, getattr(User, name)) for name in (
+    'username', 'name', 'email', 'roll_number', 'branch', 'course', 'user_access_level', 'id_card_url', 'lib_card_url',
+    'aadhar_card_url', 'hostel_id_card_url', 'id')])
+REQUEST_FIELDS = ModelFields([(name, getattr(ApplicationRequests, name)) for name in (
+    'id', 'request_type', 'title', 'content', 'state', 'time_modified', 'time_completed', 'attachment_url')],
+    keys=(ApplicationRequests.time_modified, ApplicationRequests.id),
+    nested={'request_from': (USER_FIELDS, User, User.id == ApplicationRequests.request_from)})
+
+
 @app.route('/api/requests/create_request', methods=['POST'])
 @auth.login_required
 def create_request():
@@ -339,6 +1151,37 @@ def create_request():
         })
 
 
+class Tombstone(db.Model):
+    # a deleted notice or request, kept SYNC_TOMBSTONE_DAYS so that /api/sync clients drop their copy
+    __tablename__ = "Tombstones"
+    __table_args__ = (db.Index('ix_tombstones_kind_deleted_at', 'kind', 'deleted_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # notices or requests
+    row_id = db.Column(db.Integer, nullable=False)
+    branch = db.Column(db.String(20))
+    access_level = db.Column(db.Integer)
+    request_from = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+
+
+@event.listens_for(Notice, 'after_delete')
+def notice_tombstone(mapper, connection, target):  # runs for ORM deletes, not for query.delete()
+    connection.execute(Tombstone.__table__.insert(), kind='notices', row_id=target.id, branch=target.branch,
+                       deleted_at=datetime.datetime.now())
+
+
+@event.listens_for(ApplicationRequests, 'after_delete')
+def request_tombstone(mapper, connection, target):
+    connection.execute(Tombstone.__table__.insert(), kind='requests', row_id=target.id,
+                       access_level=target.access_level, request_from=target.request_from,
+                       deleted_at=datetime.datetime.now())
+
+
+def prune_tombstones(kind):
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=app.config['SYNC_TOMBSTONE_DAYS'])
+    Tombstone.query.filter(Tombstone.kind == kind, Tombstone.deleted_at < cutoff).delete(synchronize_session=False)
+
+
 @app.route('/api/requests/view_request', methods=['POST'])
 @auth.login_required
 def view_request():
@@ -347,18 +1190,25 @@ def view_request():
         if curr_user.user_access_level > 1 and curr_user.user_access_level < 5:
             access_level = curr_user.user_access_level
             try:
-                requests = ApplicationRequests.query.filter_by(access_level=access_level)
+                serialize = list_serializer(REQUEST_FIELDS)
+                requests = serialize.select(ApplicationRequests.query.filter_by(access_level=access_level))
+                stream = stream_format()
+                if stream is not None:
+                    return stream_response(keyset_query(requests, ApplicationRequests.time_modified,
+                                                        ApplicationRequests.id), 'requests', stream,
+                                           serialize=serialize)
+                requests, next_cursor = keyset_page(requests, ApplicationRequests.time_modified,
+                                                    ApplicationRequests.id)
                 new_requests = []
 
                 for request_ in requests:
-                    new_request = request_.get_json()
+                    new_request = serialize(request_)
                     new_requests.append(new_request)
 
-                sorted(new_requests, key=lambda newrequest: newrequest['time_modified'], reverse=True)
-
-                return jsonify({
+                return json_response({
                     'code': 200,
-                    'requests': new_requests
+                    'requests': new_requests,
+                    'next_cursor': next_cursor
                 })
             except Exception as e:
                 return jsonify({
@@ -369,18 +1219,25 @@ def view_request():
 
         else:
             try:
-                requests = ApplicationRequests.query.filter_by(request_from=curr_user.id)
+                serialize = list_serializer(REQUEST_FIELDS)
+                requests = serialize.select(ApplicationRequests.query.filter_by(request_from=curr_user.id))
+                stream = stream_format()
+                if stream is not None:
+                    return stream_response(keyset_query(requests, ApplicationRequests.time_modified,
+                                                        ApplicationRequests.id), 'requests', stream,
+                                           serialize=serialize)
+                requests, next_cursor = keyset_page(requests, ApplicationRequests.time_modified,
+                                                    ApplicationRequests.id)
                 new_requests = []
 
                 for request_ in requests:
-                    new_request = request_.get_json()
+                    new_request = serialize(request_)
                     new_requests.append(new_request)
 
-                sorted(new_requests, key=lambda newrequest: newrequest['time_modified'], reverse=True)
-
-                return jsonify({
+                return json_response({
                     'code': 200,
-                    'requests': new_requests
+                    'requests': new_requests,
+                    'next_cursor': next_cursor
                 })
             except Exception as e:
                 return jsonify({
@@ -415,7 +1272,12 @@ def update_request():
             })
 
         try:
-            curr_request = ApplicationRequests.query.filter_by(id=request_id)
+            curr_request = ApplicationRequests.query.filter_by(id=request_id).first()
+            if curr_request is None:
+                return jsonify({
+                    'code': 404,
+                    'content': 'Request not found'
+                })
             if curr_request.request_from == curr_user.id:
                 try:
                     curr_request.title = request_title
@@ -455,8 +1317,139 @@ def update_request():
         })
 
 
-def process_request():
-    pass
+@app.route('/api/requests/delete_request', methods=['POST'])
+@auth.login_required
+def delete_request():
+    curr_user = g.user
+    try:
+        request_id = request.json.get('id')
+        if request_id is None:
+            return jsonify({
+                'code': 400,
+                'content': 'Request id is required'
+            })
+
+        curr_request = ApplicationRequests.query.filter_by(id=request_id).first()
+        if curr_request is None:
+            return jsonify({
+                'code': 404,
+                'content': 'Request not found'
+            })
+        if curr_request.request_from != curr_user.id:
+            return jsonify({
+                'code': 400,
+                'content': 'Permission Denied'
+            })
+        db.session.delete(curr_request)  # leaves a tombstone for /api/sync
+        prune_tombstones('requests')
+        db.session.commit()
+        return jsonify({
+            'code': 200,
+            'content': 'Request deleted'
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'code': 400,
+            'content': 'Unable to delete request',
+            'exception': e.__str__()
+        })
+
+
+def process_request(user, request_ids, state):
+    # Moves the requests addressed to the user's access level to `state` in one transaction, with one
+    # UPDATE per IN_BATCH_SIZE ids. Returns [{'id', 'outcome'}] in the order of request_ids, the outcome is
+    # updated, not_found, permission_denied or invalid_transition (from the current state).
+    # Raises RuntimeError, with nothing changed, when a request is changed by someone else meanwhile.
+    table = ApplicationRequests.__table__
+    sources = [source for source, targets in ApplicationRequests.TRANSITIONS.items() if state in targets]
+    found = {}
+    for start in range(0, len(request_ids), IN_BATCH_SIZE):
+        batch = request_ids[start:start + IN_BATCH_SIZE]
+        for row_id, access_level, current in db.session.execute(
+                db.select([table.c.id, table.c.access_level, table.c.state]).where(table.c.id.in_(batch))):
+            found[row_id] = (access_level, current)
+
+    outcomes = []
+    eligible = []
+    for request_id in request_ids:
+        if request_id not in found:
+            outcome = 'not_found'
+        elif found[request_id][0] != user.user_access_level:
+            outcome = 'permission_denied'
+        elif found[request_id][1] not in sources:
+            outcome = 'invalid_transition'
+        else:
+            outcome = 'updated'
+            eligible.append(request_id)
+        outcomes.append({'id': request_id, 'outcome': outcome})
+
+    now = datetime.datetime.now()
+    values = {'state': state, 'time_modified': now}
+    if state in ApplicationRequests.FINISHED_STATES:
+        values['time_completed'] = now
+    try:
+        for start in range(0, len(eligible), IN_BATCH_SIZE):
+            batch = eligible[start:start + IN_BATCH_SIZE]
+            # the conditions checked above are repeated so that a concurrent change isn't overwritten
+            changed = db.session.execute(table.update().where(and_(
+                table.c.id.in_(batch), table.c.access_level == user.user_access_level,
+                table.c.state.in_(sources))).values(**values)).rowcount
+            if changed != len(batch):
+                raise RuntimeError('Some requests were changed while processing, try again')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return outcomes
+
+
+@app.route('/api/requests/process_requests', methods=['POST'])
+@auth.login_required
+def process_requests():
+    # COE, admin and department users move many requests of their access level to a new state at once
+    curr_user = g.user
+    if not 1 < curr_user.user_access_level < 5:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission Denied'
+        })
+    data = request.get_json(silent=True) or {}
+    request_ids = data.get('ids')
+    state = data.get('state')
+    valid_states = set(target for targets in ApplicationRequests.TRANSITIONS.values() for target in targets)
+    if state not in valid_states or not isinstance(request_ids, list) \
+            or not 0 < len(request_ids) <= app.config['MAX_PROCESS_REQUESTS']:
+        return jsonify({
+            'code': 400,
+            'content': 'Send a state (one of %s) and a list of at most %d request ids' % (
+                sorted(valid_states), app.config['MAX_PROCESS_REQUESTS'])
+        })
+    try:
+        request_ids = [int(request_id) for request_id in request_ids]
+    except (TypeError, ValueError):
+        return jsonify({
+            'code': 400,
+            'content': 'Request ids must be numbers'
+        })
+    seen = set()
+    request_ids = [request_id for request_id in request_ids if not (request_id in seen or seen.add(request_id))]
+
+    try:
+        outcomes = process_request(curr_user, request_ids, state)
+    except Exception as e:
+        return jsonify({
+            'code': 409,
+            'content': 'Unable to process requests',
+            'exception': e.__str__()
+        })
+    return jsonify({
+        'code': 200,
+        'content': {
+            'updated': sum(1 for outcome in outcomes if outcome['outcome'] == 'updated'),
+            'results': outcomes
+        }
+    })
 
 
 @app.route('/api/notice/create_notice', methods=['POST'])
@@ -470,10 +1463,6 @@ def create_notice():
             content = request.json.get('content')
             attachment_url = request.json.get('attachment_url')
 
-            print(title)
-            print(branch)
-            print(content)
-
             if title is None or branch is None or content is None:
                 return jsonify({
                     'code': 400,
@@ -485,7 +1474,8 @@ def create_notice():
             try:
                 db.session.add(new_notice)
                 db.session.commit()
-                print("Notice created successfully")
+                response_cache.invalidate('notices:' + branch)
+                app.logger.info('Notice %d created in %s', new_notice.id, branch)
                 # g.notice = new_notice  Don't know it's use yet
                 return jsonify({
                     'code': 201,
@@ -511,6 +1501,39 @@ def create_notice():
         })
 
 
+NOTICE_FIELDS = ModelFields([('id', Notice.id), ('title', Notice.title), ('content', Notice.content),
+                             ('branch', Notice.branch), ('attachment_url', Notice.attachment_url),
+                             ('date_time', Notice.date_created), ('date_modified', Notice.date_modified)],
+                            keys=(Notice.date_created, Notice.id))
+
+
+def notices_page_body(branch, serialize):
+    notices, next_cursor = keyset_page(serialize.select(Notice.query.filter_by(branch=branch)), Notice.date_created,
+                                       Notice.id)
+    new_notices = []
+
+    for notice_ in notices:
+        new_notice = serialize(notice_)
+        new_notices.append(new_notice)
+
+    return encode_json({
+        'code': 201,
+        'notices': new_notices,
+        'next_cursor': next_cursor
+    }).encode('utf-8')
+
+
+def etag_response(body, etag):
+    # an empty 304 when the client already holds this version of the body
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/api/notice/view_notices', methods=['POST'])
 @auth.login_required
 def view_notices():
@@ -522,27 +1545,33 @@ def view_notices():
                 'content': 'Branch is required'
             })
         try:
-            notices = Notice.query.filter_by(branch=branch)
+            serialize = list_serializer(NOTICE_FIELDS)
+            stream = stream_format()
+            if stream is not None:
+                return stream_response(keyset_query(serialize.select(Notice.query.filter_by(branch=branch)),
+                                                    Notice.date_created, Notice.id), 'notices', stream, code=201,
+                                       serialize=serialize)
+            # pages are cached until create_notice or update_notice changes the branch
+            key = 'notices:%s:%s:%s:%s' % (branch, request.json.get('limit'), request.json.get('after'),
+                                           ','.join(serialize.names))
+            body, etag = response_cache.get_or_build(key, 'notices:' + branch,
+                                                     lambda: notices_page_body(branch, serialize))
+        except ValueError as e:
+            return jsonify({
+                'code': 400,
+                'content': 'Bad request',
+                'exception': e.__str__()
+            })
         except Exception as e:
             return jsonify({
                 'code': 503,
                 'content': 'Unable to access database',
                 'exception': e.__str__()
             })
-        new_notices = []
-
-        for notice_ in notices:
-            new_notice = notice_.get_json()
-            # new_notice = [notice_.id, notice_.title, notice_.content, notice_.date_time]
-            new_notices.append(new_notice)
-        sorted(new_notices, key=lambda new_notice: new_notice['date_time'], reverse=True)
 
-        return jsonify({
-            'code': 201,
-            'notices': new_notices
-        })
+        return etag_response(body, etag)
     except Exception as e:
-        print(e)
+        app.logger.warning('view_notices: %s', e)
         return jsonify({
             'code': 400,
             'content': 'Bad request'
@@ -581,6 +1610,7 @@ def update_notice():
                     notice.attachment_url = attachment_url
                 try:
                     db.session.commit()
+                    response_cache.invalidate('notices:' + notice.branch)
                     return jsonify({
                         'code': 201,
                         'content': 'Changes made successfully'
@@ -609,11 +1639,193 @@ def update_notice():
         })
 
 
+@app.route('/api/notice/delete_notice', methods=['POST'])
+@auth.login_required
+def delete_notice():
+    user_current = g.user
+    if user_current.user_access_level < 2:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    try:
+        notice_id = request.json.get('id')
+        if notice_id is None:
+            return jsonify({
+                'code': 400,
+                'content': 'Notice id is required'
+            })
+
+        notice = Notice.query.filter_by(id=notice_id).first()
+        if notice is None:
+            return jsonify({
+                'code': 404,
+                'content': 'Notice not found'
+            })
+        if notice.created_by != user_current.id:
+            return jsonify({
+                'code': 400,
+                'content': 'You have not created this notice'
+            })
+        branch = notice.branch
+        db.session.delete(notice)  # leaves a tombstone for /api/sync
+        prune_tombstones('notices')
+        db.session.commit()
+        response_cache.invalidate('notices:' + branch)
+        return jsonify({
+            'code': 201,
+            'content': 'Notice deleted'
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'code': 503,
+            'content': 'Unable to delete notice',
+            'exception': e.__str__()
+        })
+
+
+def encode_sync_token(modified, row_id, synced, deleted_at, tombstone_id):
+    # the (modified, id) position of the client in the list, the time its copy was last complete and its
+    # (deleted_at, id) position in the tombstones
+    return base64.urlsafe_b64encode(json.dumps([
+        modified.strftime(CURSOR_DATE_FORMAT), row_id, synced.strftime(CURSOR_DATE_FORMAT),
+        deleted_at.strftime(CURSOR_DATE_FORMAT), tombstone_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_sync_token(token):
+    # (modified, id, synced, deleted_at, tombstone id), tokens without a tombstone position read the
+    # tombstones from the modified time on, as they used to
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(token)).decode('utf-8'))
+        if len(values) == 3:
+            values = values + [values[0], 0]
+        modified, row_id, synced, deleted_at, tombstone_id = values
+        return (datetime.datetime.strptime(modified, CURSOR_DATE_FORMAT), int(row_id),
+                datetime.datetime.strptime(synced, CURSOR_DATE_FORMAT),
+                datetime.datetime.strptime(deleted_at, CURSOR_DATE_FORMAT), int(tombstone_id))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid since token')
+
+
+def sync_scope(kind, user, branch):
+    # (model, modified column, row filters, tombstone filters) of what the user sees in view_notices
+    # or view_request
+    if kind == 'notices':
+        return Notice, Notice.date_modified, [Notice.branch == branch], [Tombstone.branch == branch]
+    if 1 < user.user_access_level < 5:
+        return (ApplicationRequests, ApplicationRequests.time_modified,
+                [ApplicationRequests.access_level == user.user_access_level],
+                [Tombstone.access_level == user.user_access_level])
+    return (ApplicationRequests, ApplicationRequests.time_modified,
+            [ApplicationRequests.request_from == user.id], [Tombstone.request_from == user.id])
+
+
+@app.route('/api/sync', methods=['POST'])
+@auth.login_required
+def sync():
+    # Rows created or changed after the `since` token of the previous poll, oldest first, and the ids of
+    # the rows deleted since then, paged separately with the same limit. Without a token, or with one older
+    # than the tombstones are kept, the whole list is sent with "reset": true and the client replaces its
+    # copy. Tokens of a page followed by more ("has_more": true) keep the time of the first page, so a long
+    # resync isn't restarted.
+    # Read by (branch, date_modified) or (access_level / request_from, time_modified) index ranges.
+    try:
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind')
+        branch = data.get('branch')
+        since = data.get('since')
+        if kind not in ('notices', 'requests') or (kind == 'notices' and branch is None):
+            return jsonify({
+                'code': 400,
+                'content': 'kind must be notices or requests, notices need a branch'
+            })
+        limit = int(data.get('limit') or app.config['MAX_PAGE_SIZE'])
+        limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+        model, modified, filters, tombstone_filters = sync_scope(kind, g.user, branch)
+
+        now = datetime.datetime.now()
+        # rows written by transactions still open now may carry an older time, a poll that reached the end
+        # of the list reads the last seconds again next time
+        overlap = now - datetime.timedelta(seconds=app.config['SYNC_OVERLAP_SECONDS'])
+        if since is not None:
+            since_time, since_id, synced, deleted_time, deleted_id = decode_sync_token(since)
+        # a copy older than the oldest tombstone could still hold deleted rows
+        reset = since is None or synced < now - datetime.timedelta(days=app.config['SYNC_TOMBSTONE_DAYS'])
+        if reset:
+            # the rows deleted before now are left out of the new copy, the later ones are sent
+            since_time, since_id, synced, deleted_time, deleted_id = datetime.datetime.min, 0, now, overlap, 0
+        query = model.query.filter(*filters)
+        if kind == 'requests':
+            query = query.options(joinedload(ApplicationRequests.Users))
+        query = query.filter(or_(modified > since_time, and_(modified == since_time, model.id > since_id)))
+        rows = query.order_by(modified.asc(), model.id.asc()).limit(limit + 1).all()
+
+        tombstones = []
+        if not reset:
+            tombstones = db.session.query(Tombstone.id, Tombstone.row_id, Tombstone.deleted_at).filter(
+                Tombstone.kind == kind, *tombstone_filters).filter(or_(
+                    Tombstone.deleted_at > deleted_time,
+                    and_(Tombstone.deleted_at == deleted_time, Tombstone.id > deleted_id))) \
+                .order_by(Tombstone.deleted_at.asc(), Tombstone.id.asc()).limit(limit + 1).all()
+
+        more_rows = len(rows) > limit
+        more_tombstones = len(tombstones) > limit
+        rows = rows[:limit]
+        tombstones = tombstones[:limit]
+        if more_rows:
+            since_time, since_id = getattr(rows[-1], modified.key), rows[-1].id
+        else:
+            since_time, since_id = max((overlap, 0), (since_time, since_id))
+        if more_tombstones:
+            deleted_time, deleted_id = tombstones[-1].deleted_at, tombstones[-1].id
+        else:
+            deleted_time, deleted_id = max((overlap, 0), (deleted_time, deleted_id))
+        has_more = more_rows or more_tombstones
+        # a complete copy is as recent as the first page of the poll that made it
+        next_since = encode_sync_token(since_time, since_id, synced if has_more else now, deleted_time, deleted_id)
+
+        metrics.add_rows(len(rows) + len(tombstones))
+        return jsonify({
+            'code': 200,
+            kind: [row.get_json() for row in rows],
+            'deleted': [tombstone.row_id for tombstone in tombstones],
+            'since': next_since,
+            'has_more': has_more,
+            'reset': reset
+        })
+    except ValueError as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 503,
+            'content': 'Unable to access database',
+            'exception': e.__str__()
+        })
+
+
 @auth.verify_password
-def verify_password(username, password):
-    user = User.query.filter_by(username=username).first()
-    if not user or not user.verify_password(password):
-        return False
+def verify_password(username_or_token, password):
+    # first try to authenticate by token, then by a previously verified password, then by hashing
+    user = User.verify_auth_token(username_or_token)
+    if not user:
+        cached = credential_cache.get(username_or_token, password)
+        if cached is not None:
+            # the cache only skips the hash, the user is still loaded by primary key: g.user must be a
+            # row of this session with the current access level, and a deleted user must fail
+            user = User.query.get(cached[0])
+            if user is None or user.password_hash != cached[1]:  # password changed by another process
+                credential_cache.invalidate(username_or_token)
+                user = None
+        if not user:
+            user = User.query.filter_by(username=username_or_token).first()
+            if not user or not user.verify_password(password):
+                return False
+            credential_cache.put(username_or_token, password, user.id, user.password_hash)
     # g is a thread local Ref - https://stackoverflow.com/questions/13617231/how-to-use-g-user-global-in-flask
     g.user = user
     return True
@@ -647,6 +1859,81 @@ def new_user():
     })
 
 
+@app.route('/api/students/bulk_create_users', methods=['POST'])
+@auth.login_required
+def bulk_create_users():
+    # creates a JSON array of users (the fields of create_users) with their passwords hashed on every core
+    if g.user.user_access_level != 3:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    rows = request.json.get('users') if isinstance(request.json, dict) else request.json
+    if not isinstance(rows, list) or len(rows) > app.config['MAX_BULK_USERS']:
+        return jsonify({
+            'code': 400,
+            'content': 'Send a list of at most %d users' % app.config['MAX_BULK_USERS']
+        })
+    start = time.time()
+    usernames = set(row.get('username') for row in rows if isinstance(row, dict))
+    emails = set(row.get('email') for row in rows if isinstance(row, dict))
+    taken_usernames = set(username for (username,) in
+                          db.session.query(User.username).filter(User.username.in_(usernames)))
+    taken_emails = set(email for (email,) in db.session.query(User.email).filter(User.email.in_(emails)))
+    accepted, skipped, rejected = [], [], []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            rejected.append({'index': index, 'reason': 'Not a user'})
+            continue
+        try:
+            user_access_level = int(row.get('user_access_level'))
+        except (TypeError, ValueError):
+            rejected.append({'index': index, 'reason': 'user_access_level must be a number'})
+            continue
+        if row.get('username') is None or row.get('password') is None or row.get('name') is None \
+                or row.get('branch') is None or row.get('email') is None:
+            rejected.append({'index': index, 'reason': 'Some fields may be blank'})
+        elif user_access_level > 5 or user_access_level < 1:
+            rejected.append({'index': index, 'reason': 'user_access_level must be between 1 and 5'})
+        elif row['username'] in taken_usernames or row['email'] in taken_emails:
+            skipped.append(row['username'])
+        else:
+            taken_usernames.add(row['username'])
+            taken_emails.add(row['email'])
+            accepted.append((row, user_access_level))
+
+    try:
+        with metrics.timed('password_seconds'):
+            hashes = password_hasher.hash_many([row['password'] for row, user_access_level in accepted])
+        users = []
+        for (row, user_access_level), password_hash in zip(accepted, hashes):
+            user = User(username=row['username'], password=None, email=row['email'], name=row['name'],
+                        rollno=row.get('roll_number'), user_access_level=user_access_level,
+                        password_hash=password_hash)
+            user.branch = row['branch']
+            users.append(user)
+        db.session.bulk_save_objects(users)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'code': 400,
+            'content': 'Users could not be created',
+            'exception': e.__str__()
+        })
+    seconds = time.time() - start
+    return jsonify({
+        'code': 200,
+        'content': {
+            'created': [user.username for user in users],
+            'skipped': skipped,
+            'rejected': rejected,
+            'seconds': seconds,
+            'accounts_per_sec': len(users) / seconds if seconds else 0.0
+        }
+    })
+
+
 @app.route('/api/students/change_password', methods=['POST'])
 @auth.login_required
 def change_password():
@@ -666,24 +1953,23 @@ def change_password():
             'content': 'Passwords are not same'
         })
 
-    # old_password_hash = pwd_context.encrypt(old_password)
-    new_password_hash = pwd_context.encrypt(new_password)
     curr_user = g.user
-    # print (old_password_hash+"\n")
-    # print (curr_user.password_hash)
     if not curr_user.verify_password(old_password):
         return jsonify({
             'code': 400,
             'content': 'The password entered doesn\'t match the old password'
         })
-    if curr_user.verify_password(new_password):
+    if new_password == old_password:  # the old password just matched, no need to hash the new one against it
         return jsonify({
             'code': 400,
             'content': "New password cannot be same as old password"
         })
+    with metrics.timed('password_seconds'):
+        new_password_hash = password_hasher.hash(new_password)  # only once the request is known to be valid
     try:
         curr_user.password_hash = new_password_hash
         db.session.commit()
+        credential_cache.invalidate(curr_user.username)
         return jsonify({
             'code': 200,
             'content': 'Password changed successfully'
@@ -714,22 +2000,19 @@ def update_profile():
         try:
             if id_card_url is not None:
                 user.id_card_url = id_card_url
-                print(id_card_url + "\n")
             if lib_card_url is not None:
                 user.lib_card_url = lib_card_url
-                print(lib_card_url + "\n")
             if hostel_id_card_url is not None:
                 user.hostel_id_card_url = hostel_id_card_url
-                print(hostel_id_card_url + "\n")
             if aadhar_card_url is not None:
                 user.aadhar_card_url = aadhar_card_url
-                print(aadhar_card_url + "\n")
             if email is not None:
                 user.email = email
             if name is not None:
                 user.name = name
 
             db.session.commit()
+            credential_cache.invalidate(user.username)
             return jsonify({
                 'code': 200,
                 'content': '%s data changed successfully' % user.username
@@ -771,30 +2054,236 @@ def index():
 def login():
     if g.user is None:
         abort(400)
-    return jsonify(g.user.get_json())
+    user_json = g.user.get_json()
+    data = request.get_json(silent=True) or {}
+    if data.get('token'):  # opt-in signed token, send it as the username in later calls
+        user_json['token'] = g.user.generate_auth_token()
+        user_json['duration'] = app.config['AUTH_TOKEN_EXPIRATION']
+    return jsonify(user_json)
+
+
+def like_search(model, terms, filters, limit, after_id=None):
+    # [(row id, score)] newest first after the row `after_id`, for databases without a search index
+    query = db.session.query(model.id)
+    if after_id is not None:
+        query = query.filter(model.id < after_id)
+    for word, prefix in terms:
+        # % and _ in the word are matched as themselves
+        pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(or_(model.title.ilike(pattern, escape='\\'),
+                                 model.content.ilike(pattern, escape='\\')))
+    for column, value in filters:
+        query = query.filter(getattr(model, column) == value)
+    return [(row_id, 0.0) for (row_id,) in query.order_by(model.id.desc()).limit(limit)]
+
+
+def decode_search_cursor(cursor):
+    # (ranking, score, row id) of the last row of a search page, see search_ids
+    value, row_id = decode_cursor(cursor, Notice.id)
+    if not isinstance(value, list) or len(value) != 2 or value[0] not in ('relevance', 'newest') \
+            or not isinstance(value[1], (int, float)):
+        raise ValueError('Invalid cursor')
+    return value[0], float(value[1]), row_id
+
+
+@app.route('/api/search', methods=['POST'])
+@auth.login_required
+def search():
+    # notices or requests containing every word of "q", best match first or newest first for very common
+    # words, see "ranking" in the response. "kind" is "notices" (default),
+    # optionally of one "branch", or "requests", which shows the requests view_request would show.
+    curr_user = g.user
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind', 'notices')
+    terms = search_terms(data.get('q') or '')
+    if kind not in ('notices', 'requests') or not terms:
+        return jsonify({
+            'code': 400,
+            'content': 'A query "q" and a kind of notices or requests are required'
+        })
+    try:
+        limit = int(data.get('limit') or app.config['DEFAULT_PAGE_SIZE'])
+        limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+        after = decode_search_cursor(data['after']) if data.get('after') else None
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'code': 400,
+            'content': 'Bad request',
+            'exception': e.__str__()
+        })
 
+    if kind == 'notices':
+        model, index, query = Notice, 'notices_fts', Notice.query
+        filters = [('branch', data['branch'])] if data.get('branch') else []
+    else:
+        model, index = ApplicationRequests, 'requests_fts'
+        query = ApplicationRequests.query.options(joinedload(ApplicationRequests.Users))
+        if 1 < curr_user.user_access_level < 5:
+            filters = [('access_level', curr_user.user_access_level)]
+        else:
+            filters = [('request_from', curr_user.id)]
+    try:
+        if search_index_ready():
+            matches, ranking = search_ids(db.session.connection(), index, terms, filters, limit + 1, after,
+                                          max_ranked=app.config['SEARCH_MAX_RANKED'])
+        else:
+            matches, ranking = like_search(model, terms, filters, limit + 1, after[2] if after else None), 'newest'
+        next_cursor = None
+        if len(matches) > limit:  # the position of the last row sent, in the order of this search
+            next_cursor = encode_cursor([ranking, matches[limit - 1][1]], matches[limit - 1][0])
+        matches = matches[:limit]
+        rows = dict((row.id, row) for row in query.filter(model.id.in_([row_id for row_id, score in matches])))
+        results = []
+        for row_id, score in matches:
+            if row_id in rows:
+                result = rows[row_id].get_json()
+                result['score'] = 0.0 - score  # bm25 is lower for better matches
+                results.append(result)
+        metrics.add_rows(len(results))
+        return jsonify({
+            'code': 200,
+            kind: results,
+            'ranking': ranking,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 500,
+            'content': 'Unable to search',
+            'exception': e.__str__()
+        })
 
-# creating dummy user
-db.create_all()
+
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def prometheus_metrics():
+    # admins only, the scraper logs in with basic auth; plain HTTP errors, Prometheus reads no JSON
+    if not metrics.enabled:
+        abort(404)
+    if g.user.user_access_level != 3:
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/auth/cache_stats', methods=['POST'])
+@auth.login_required
+def credential_cache_stats():
+    if g.user.user_access_level != 3:
+        return jsonify({
+            'code': 400,
+            'content': 'Permission denied'
+        })
+    return jsonify({
+        'code': 200,
+        'credential_cache': credential_cache.stats(),
+        'response_cache': response_cache.stats()
+    })
+
+
+search_indexes = {}  # engine -> (whether it has the full text index, time of the check)
+
+
+def search_index_ready():
+    # full text index, or LIKE without FTS5. An index found stays, a missing one is looked for again
+    # every SEARCH_INDEX_CHECK_SECONDS
+    ready, checked_at = search_indexes.get(db.engine, (False, None))
+    if not ready and (checked_at is None or time.time() - checked_at >= app.config['SEARCH_INDEX_CHECK_SECONDS']):
+        ready = has_search_index(db.session.connection())
+        search_indexes[db.engine] = (ready, time.time())
+    return ready
+
+
+# Importing this module only sets up the app, it doesn't touch the database. The schema is created and
+# migrated by `FLASK_APP=app.py flask migrate`, once per deploy, and the servers only check that it's current.
+
+@app.cli.command('migrate')
+def migrate_command():
+    # creates missing tables and brings an existing database up to date, see migrations.py
+    applied = run_migrations(db)
+    for version in applied:
+        print('Applied migration %d' % version)
+    print('Database is up to date' + ('' if applied else ', nothing to apply'))
+
+
+@app.cli.command('generate-results')
+@click.option('--semesters', default=8, help='semesters 1 to N, default 8')
+@click.option('--seed', type=int, default=None, help='the same seed gives the same marks')
+@click.option('--files', is_flag=True, help='write <semester>.txt for insert_result instead of the database')
+@click.option('--processes', type=int, default=None, help='generating processes, default RESULT_GENERATOR_PROCESSES')
+def generate_results_command(semesters, seed, files, processes):
+    # random results of every student, for load tests
+    start = time.time()
+    reports = generate_random_result(semesters, seed=seed, write_files=files, processes=processes)
+    rows = sum(report['written'] if files else report['inserted'] for report in reports)
+    print('%d student semesters in %.1f s' % (rows, time.time() - start))
+
+
+@app.cli.command('import-results')
+@click.argument('path')
+@click.option('--semester', type=int, required=True, help='semester of the results in the file')
+@click.option('--processes', type=int, default=None, help='parsing processes, default RESULT_IMPORT_PROCESSES')
+@click.option('--chunk-mb', type=float, default=None, help='megabytes per parsed piece, default RESULT_IMPORT_CHUNK_BYTES')
+@click.option('--rejects', default=None, help='file receiving the rejected lines as "line number,reason"')
+def import_results_command(path, semester, processes, chunk_mb, rejects):
+    # a result file ('user_id,mark,...' lines) of one semester, for files too large for insert_result
+    report = import_result_file(path, str(semester), processes=processes,
+                                chunk_bytes=int(chunk_mb * 1048576) if chunk_mb else None, reject_path=rejects)
+    print('%d lines, %.1f MB/s, %.0f lines/s, %d inserted, %d skipped, %d rejected' % (
+        report['lines'], report['mb_per_sec'], report['lines_per_sec'], report['inserted'], report['skipped'],
+        report['rejected_count']))
+    for line_number, reason in report['rejected'][:10]:
+        print('  line %d: %s' % (line_number, reason))
+
+
+@app.cli.command('export-results')
+@click.option('--branch', required=True)
+@click.option('--semesters', default='1-8', help='one semester or a range like 1-8, default 1-8')
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--output', type=click.File('wb'), default='-', help='file to write, default standard output')
+def export_results_command(branch, semesters, export_format, output):
+    # the results of a branch as CSV or NDJSON, like /api/results/export
+    first, _, last = semesters.partition('-')
+    first, last = int(first), int(last or first)
+    with db.engine.connect() as connection:
+        for chunk, rows in export_chunks(connection, branch, first, last, export_format,
+                                         subject_columns(branch, first, last), app.config['STREAM_BATCH_SIZE']):
+            output.write(chunk.encode('utf-8'))
+
+
+def check_schema():
+    # one query at startup, so a server doesn't answer from a database it can't use
+    pending = pending_migrations(db)
+    if pending:
+        raise SystemExit('The database is missing migrations %s, run FLASK_APP=app.py flask migrate'
+                         % ', '.join(str(version) for version in pending))
 
 ## sudo ufw disable  -> To disable firewall in ubuntu to access flask server from Mobile
 
 if __name__ == '__main__':
-    for user in User.query.all():
-        print(user)
-    for notice in Notice.query.all():
-        print(notice)
-
-    '''
-    Remove the comment in next line after creating users to generate and insert result.
-    '''
-    # create_random_result(3, 3) # number of semesters for which the random result has to be created
-    for result in Result.query.all():
-        print(result)
+    parser = argparse.ArgumentParser(description='Development server, run serve.py in production')
+    parser.add_argument('--dump', action='store_true', help='print every user, notice and result before serving')
+    args = parser.parse_args()
+    check_schema()
+    if args.dump:
+        for user in User.query.all():
+            print(user)
+        for notice in Notice.query.all():
+            print(notice)
+
+        '''
+        Remove the comment in next line after creating users to generate and insert result.
+        '''
+        # generate_random_result(3)  # random results of every student for semesters 1 to 3
+        for result in Result.query.all():
+            print(result)
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
+    app.run(host='0.0.0.0', port=port)  # development server, run serve.py in production
 
 """
+create or update the database (before the first start and after every upgrade) : FLASK_APP=app.py flask migrate
+development server : python app.py (add --dump to print every user, notice and result first)
+production server : WEB_THREADS=32 python serve.py (gunicorn with WEB_WORKERS processes when installed, see serve.py)
+
 curl -i -X POST -H "Content-Type: application/json" -d '{"username":"priya","password":"priya","email":"priya","user_access_level":"1","branch":"EC"}' http://0.0.0.0:5000/api/students/create_users
 
 curl -i -X POST -H "Content-Type: application/json" -d '{"username":"admin","password":"admin","email":"admin","user_access_level":"3","branch":"admin"}' http://0.0.0.0:5000/api/students/create_users
@@ -805,6 +2294,8 @@ curl -i -X POST -H "Content-Type: application/json" -d '{"username":"coe","passw
 
 curl -i -X POST -H "Content-Type: application/json" -d '{"username":"jiten","password":"jiten803","email":"jitensardana@gmail.com","branch":"EC","user_access_level":"4"}' http://0.0.0.0:5000/api/students/create_users
 
+many users at once (admin) : curl -u admin:admin -i -X POST -H "Content-Type: application/json" -d '{"users":[{"username":"a","password":"a","email":"a","name":"a","user_access_level":"1","branch":"EC"}, {"username":"b","password":"b","email":"b","name":"b","user_access_level":"1","branch":"EC"}]}' http://0.0.0.0:5000/api/students/bulk_create_users
+
 
 view notices : curl -u miguel:python -i -X GET -H "Content-Type: application/json" -d '{"branch":"EC"}' http://0.0.0.0:5000/api/notice/view_notices
 
@@ -816,6 +2307,40 @@ create request : curl -u jiten:jiten -i -X POST -H "Content-Type: application/js
 
 
 view request : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{}' http://0.0.0.0:5000/api/requests/view_request
+some fields only (view_request, view_notices, view_result) : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"fields":"id,title,state,request_from.name"}' http://0.0.0.0:5000/api/requests/view_request
+
+login with token : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"token":true}' http://0.0.0.0:5000/login
+use the token : curl -u <token>:unused -i -X POST -H "Content-Type: application/json" -d '{}' http://0.0.0.0:5000/api/requests/view_request
+
+next page : add "limit" (default 50, at most 500) and the "next_cursor" of the previous page as "after"
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "limit":20, "after":"<next_cursor>"}' http://0.0.0.0:5000/api/notice/view_notices
+every row at once : add "stream":"json" for one streamed JSON document or "stream":"ndjson" (or the header Accept: application/x-ndjson) for one JSON object per line
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -H "Accept: application/x-ndjson" -d '{"branch":"EC"}' http://0.0.0.0:5000/api/notice/view_notices
+unchanged feed : send the ETag of the last response back, the answer is an empty 304 until a notice of the branch changes
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -H 'If-None-Match: "<etag>"' -d '{"branch":"EC"}' http://0.0.0.0:5000/api/notice/view_notices
+
+metrics (start the server with METRICS_ENABLED=1) : curl -u admin:admin http://0.0.0.0:5000/metrics
+every response then carries a header like Server-Timing: db;dur=1.2;desc="3 statements", password;dur=0.0, total;dur=4.5
+
+my rank : curl -u priya:priya -i -X POST -H "Content-Type: application/json" -d '{}' http://0.0.0.0:5000/api/results/rank
+top 10 of a semester (leave out "semester" for the cumulative ranks) : curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "semester":3, "limit":10}' http://0.0.0.0:5000/api/results/top
+ranks 11 to 20 : curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "from":11, "to":20}' http://0.0.0.0:5000/api/results/rank_range
+compare the rank tables with Result (admin) : curl -u admin:admin -i -X POST -H "Content-Type: application/json" -d '{"rebuild":true}' http://0.0.0.0:5000/api/results/check_standings
+
+search : "q" finds the notices (or with "kind":"requests" the requests) containing every word, best match first, "branch" is optional, end a word with * to match every word starting with it
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"q":"exam schedule", "branch":"EC", "limit":20}' http://0.0.0.0:5000/api/search
+
+delta sync : the notices of a branch (or with "kind":"requests" the requests) changed since the last poll and the ids of the deleted ones. Leave out "since" the first time, then send the "since" of the previous answer. "reset":true means replace the local copy, "has_more":true means poll again at once
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"kind":"notices", "branch":"EC", "since":"<since>"}' http://0.0.0.0:5000/api/sync
+delete notice : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"id":1}' http://0.0.0.0:5000/api/notice/delete_notice
+process requests (COE, admin, department) : "state" 1 read, 3 processing, 4 rejected, 5 completed for every id, "results" tells what happened to each
+curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"ids":[1, 2, 3], "state":5}' http://0.0.0.0:5000/api/requests/process_requests
+delete request : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"id":1}' http://0.0.0.0:5000/api/requests/delete_request
+
+subject codes (of every branch, or add "branch", "semester", or ask which semesters offer a "code"), the branch files are reread when they change
+curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "semester":3}' http://0.0.0.0:5000/api/catalog
+
+result analytics : curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "semester":3, "percentiles":[25, 75, 90], "bins":10}' http://0.0.0.0:5000/api/results/analytics
 
 view result : curl -u jiten:jiten803 -i -X POST -H "Content-Type: application/json" -d '{}' http://0.0.0.0:5000/api/results/view_result
 
@@ -832,5 +2357,13 @@ num_of_users: This should be equal to number of users created by you before remo
 
 Branch codes naming conventions : Can create 3 branches. Use only two letters.
 
-curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{}' http://0.0.0.0:5000/api/results/create_random_result
+curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"semesters":8, "seed":1}' http://0.0.0.0:5000/api/results/create_random_result
+from the command line, to the database or with --files to <semester>.txt : FLASK_APP=app.py flask generate-results --semesters 8 --seed 1
+every result of a branch (COE and above), streamed as CSV, or "format":"ndjson" for one JSON object per line, "semester" or "from" and "to"
+curl -u coe:coe -X POST -H "Content-Type: application/json" -d '{"branch":"EC", "from":1, "to":8}' http://0.0.0.0:5000/api/results/export -o results-EC.csv
+from the command line : FLASK_APP=app.py flask export-results --branch EC --semesters 1-8 --format csv --output results-EC.csv
+a large result file received from the COE (user_id,mark,... lines), parsed on every core : FLASK_APP=app.py flask import-results results.csv --semester 3 --rejects rejected.csv
+The result is generated in the background, poll it or cancel it with the returned job_id
+curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"id":"<job_id>"}' http://0.0.0.0:5000/api/jobs/status
+curl -u coe:coe -i -X POST -H "Content-Type: application/json" -d '{"id":"<job_id>"}' http://0.0.0.0:5000/api/jobs/cancel
 """
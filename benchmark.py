@@ -0,0 +1,1495 @@
+import argparse
+import base64
+import cProfile
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+from flask import jsonify
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+# keep benchmark rows out of the development database unless DATABASE_URL says otherwise
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/campus_benchmark.db')
+# a fixed key, the processes started by the benchmarks (bench_startup) must accept the tokens minted here
+os.environ.setdefault('SECRET_KEY', 'benchmark secret key')
+
+from app import app, db, User, Notice, Result, ResultMarks, SemesterRank, ApplicationRequests, credential_cache, \
+    response_cache, job_manager, password_hasher, metrics, insert_result, like_search, search_index_ready, catalog, \
+    generate_random_result, import_result_file, parse_result_lines, REQUEST_FIELDS
+from course_catalog import CourseCatalog
+from result_generator import generate_marks, generate_results, result_lines
+from response_cache import ResponseCache, MemoryBackend
+from result_import import read_records
+from serializers import json_encoder, orjson, ujson
+from migrations import pending_migrations, run_migrations
+from standings import check_standings, rebuild_standings
+import serve
+
+
+def basic_auth(username, password):
+    credentials = ('%s:%s' % (username, password)).encode('utf-8')
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+
+
+def get_bench_user(username='bench_user', password='bench_password', access_level=1, branch='EC'):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, password=password, email=username + '@bench', name=username,
+                    rollno=None, user_access_level=access_level)
+        user.branch = branch
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+def seed_users(num, prefix='bench_student', branch='EC', access_level=1):
+    # inserts users sharing one precomputed hash, hashing each password would dominate the run
+    password_hash = password_hasher.hash('bench_password')
+    existing = User.query.filter(User.username.like(prefix + '%')).count()
+    rows = [{'username': '%s%d' % (prefix, i), 'name': '%s%d' % (prefix, i), 'email': '%s%d@bench' % (prefix, i),
+             'password_hash': password_hash, 'branch': branch, 'user_access_level': access_level}
+            for i in range(existing, num)]
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+    return [user.id for user in User.query.filter(User.username.like(prefix + '%')).limit(num)]
+
+
+def seed_notices(num, created_by, branch='BN', chunk_size=10000):
+    present = Notice.query.filter_by(branch=branch).count()
+    for start in range(present, num, chunk_size):
+        db.session.execute(Notice.__table__.insert(), [
+            {'title': 'bench %d' % i, 'content': 'content ' * 20, 'branch': branch, 'created_by': created_by,
+             'date_created': datetime.datetime(2018, 1, 1) + datetime.timedelta(minutes=i)}
+            for i in range(start, min(start + chunk_size, num))])
+        db.session.commit()
+
+
+def current_rss():
+    # resident set size in bytes, from /proc on Linux and the peak from getrusage elsewhere
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class QueryCounter(object):
+    # counts and records the SQL statements sent to the database inside a with block
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def callback(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self.callback)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self.callback)
+
+
+def requests_per_second(client, method, url, headers, num, data='{}'):
+    start = time.time()
+    for _ in range(num):
+        response = client.open(url, method=method, headers=headers, data=data, content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError('%s %s returned %d' % (method, url, response.status_code))
+    return num / (time.time() - start)
+
+
+def bench_auth(num=50):
+    # requests/sec of an authenticated call without the credential cache, with it and with a token
+    user = get_bench_user()
+    client = app.test_client()
+    headers = basic_auth(user.username, 'bench_password')
+    max_size = credential_cache.max_size
+
+    credential_cache.max_size = 0
+    uncached = requests_per_second(client, 'GET', '/', headers, num)
+
+    credential_cache.max_size = max_size or 1024
+    credential_cache.clear()
+    requests_per_second(client, 'GET', '/', headers, 1)  # the first call pays the hash and fills the cache
+    cached = requests_per_second(client, 'GET', '/', headers, num)
+
+    token = json.loads(client.post('/login', headers=headers, data='{"token": true}',
+                                   content_type='application/json').data)['token']
+    tokened = requests_per_second(client, 'GET', '/', basic_auth(token, 'unused'), num)
+    credential_cache.max_size = max_size
+
+    print('auth: %d requests each' % num)
+    print('  password hash every call : %10.1f req/s' % uncached)
+    print('  credential cache         : %10.1f req/s (%.1fx)' % (cached, cached / uncached))
+    print('  signed token             : %10.1f req/s (%.1fx)' % (tokened, tokened / uncached))
+    print('  cache stats              : %s' % credential_cache.stats())
+    return {'uncached_rps': uncached, 'cached_rps': cached, 'token_rps': tokened}
+
+
+def bench_bulk_users(num=64, process_counts=None):
+    # accounts/sec of bulk_create_users hashing on the request thread and in pools of growing size
+    admin = get_bench_user('bench_admin', access_level=3, branch='admin')
+    client = app.test_client()
+    headers = basic_auth(admin.username, 'bench_password')
+    cores = multiprocessing.cpu_count()
+    process_counts = process_counts or sorted(set([0, 1, 2, cores]))
+    processes = password_hasher.processes
+    run_id = int(time.time())
+    rates = {}
+
+    print('bulk_create_users: %d accounts per call, %d cores, %s rounds' % (
+        num, cores, password_hasher.rounds or 'default'))
+    try:
+        for count in process_counts:
+            password_hasher.close()
+            password_hasher.processes = count
+            password_hasher.hash_many(['warm up'] * max(count, 1))  # starts the pool outside the timing
+            prefix = 'bulk%d_%d_' % (run_id, count)
+            users = [{'username': '%s%d' % (prefix, i), 'password': 'password %d' % i, 'name': prefix,
+                      'email': '%s%d@bench' % (prefix, i), 'branch': 'EC', 'user_access_level': 1}
+                     for i in range(num)]
+            start = time.time()
+            content = json.loads(client.post('/api/students/bulk_create_users', headers=headers,
+                                             data=json.dumps({'users': users}),
+                                             content_type='application/json').data)['content']
+            elapsed = time.time() - start
+            if len(content['created']) != num:
+                raise RuntimeError('bulk_create_users created %d of %d users' % (len(content['created']), num))
+            rates[count] = num / elapsed
+            label = '%d processes' % count if count else 'request thread'
+            print('  %-24s %10.1f accounts/s (%.1fx)' % (label, rates[count], rates[count] / rates[process_counts[0]]))
+    finally:
+        password_hasher.close()
+        password_hasher.processes = processes
+    return {'cores': cores, 'accounts_per_sec': dict((str(count), rate) for count, rate in rates.items())}
+
+
+def bench_metrics(num=500):
+    # overhead of the instrumentation, and a check that /metrics and Server-Timing report the requests
+    user = get_bench_user()
+    officer = get_bench_user('bench_officer', access_level=4)
+    seed_notices(100, officer.id)
+    client = app.test_client()
+    headers = basic_auth(user.username, 'bench_password')
+    requests_per_second(client, 'GET', '/', headers, 1)  # fills the credential cache
+    installed = metrics.enabled
+    if installed:
+        metrics.uninstall(app)
+
+    disabled = requests_per_second(client, 'GET', '/', headers, num)
+    metrics.install(app)
+    try:
+        enabled = requests_per_second(client, 'GET', '/', headers, num)
+        response = client.post('/api/notice/view_notices', headers=headers, content_type='application/json',
+                               data=json.dumps({'branch': 'BN', 'limit': 20}))
+        response.close()
+        server_timing = response.headers.get('Server-Timing', '')
+        if client.get('/metrics', headers=headers).status_code != 403:
+            raise RuntimeError('/metrics answered a student')
+        admin = get_bench_user('bench_admin', access_level=3, branch='admin')
+        exposition = client.get('/metrics', headers=basic_auth(admin.username, 'bench_password')).data.decode('utf-8')
+    finally:
+        if not installed:
+            metrics.uninstall(app)
+    if 'db;dur=' not in server_timing:
+        raise RuntimeError('no Server-Timing header on view_notices: %r' % server_timing)
+    for line in ('campus_requests_total{endpoint="index",method="GET",status="200"}',
+                 'campus_rows_serialized_total{endpoint="view_notices"}'):
+        if line not in exposition:
+            raise RuntimeError('%s missing from /metrics' % line)
+
+    print('metrics: %d requests each' % num)
+    print('  disabled                 : %10.1f req/s' % disabled)
+    print('  enabled                  : %10.1f req/s (%+.1f%%)' % (enabled, (enabled / disabled - 1) * 100))
+    print('  Server-Timing            : %s' % server_timing)
+    return {'disabled_rps': disabled, 'enabled_rps': enabled, 'server_timing': server_timing}
+
+
+def bench_view_request(sizes=(10, 100, 1000)):
+    # the number of statements run by view_request must not grow with the number of requests listed
+    officer = get_bench_user('bench_officer', access_level=4)
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+    student_ids = seed_users(50)
+    counts = []
+    timings = {}
+
+    print('view_request: statements and time per listing size')
+    for size in sizes:
+        present = ApplicationRequests.query.filter_by(access_level=4).count()
+        if present < size:
+            db.session.add_all([ApplicationRequests(student_ids[i % len(student_ids)], 4, 'bench %d' % i, 'content', None)
+                                for i in range(present, size)])
+            db.session.commit()
+        client.post('/api/requests/view_request', headers=headers, data='{}', content_type='application/json')
+        with QueryCounter() as counter:
+            start = time.time()
+            response = client.post('/api/requests/view_request', headers=headers, data='{}',
+                                   content_type='application/json')
+            elapsed = time.time() - start
+        listed = len(json.loads(response.data)['requests'])
+        counts.append(counter.count)
+        timings[size] = {'statements': counter.count, 'ms': elapsed * 1000}
+        print('  %6d requests : %3d statements %8.1f ms' % (listed, counter.count, elapsed * 1000))
+
+    if len(set(counts)) != 1:
+        raise AssertionError('view_request statement count grows with rows: %s' % counts)
+    return timings
+
+
+def bench_serialize(num=20000, fields='id,title,state,time_modified,request_from.name', page=500):
+    # microseconds per row and bytes per row of the request lists: model objects through get_json and
+    # jsonify, against the columns selected by REQUEST_FIELDS through each installed JSON library, every field
+    # and fields=
+    student_ids = seed_users(50)
+    present = ApplicationRequests.query.filter_by(access_level=4).count()
+    if present < num:
+        now = datetime.datetime.now()
+        db.session.execute(ApplicationRequests.__table__.insert(), [
+            {'request_from': student_ids[i % len(student_ids)], 'request_type': 4, 'title': 'bench %d' % i,
+             'content': 'content ' * 10, 'access_level': 4, 'state': 0, 'time_created': now, 'time_modified': now,
+             'attachment_url': 'Attachment is not present'} for i in range(present, num)])
+        db.session.commit()
+    query = ApplicationRequests.query.filter_by(access_level=4).order_by(ApplicationRequests.time_modified.desc(),
+                                                                          ApplicationRequests.id.desc())
+    encoders = ['json'] + [name for name, module in (('ujson', ujson), ('orjson', orjson)) if module is not None]
+    results = {}
+
+    def run(name, build):
+        with app.test_request_context():
+            start = time.time()
+            body = build()
+            elapsed = time.time() - start
+        rows = query.count()
+        results[name] = {'us_per_row': elapsed * 1e6 / rows, 'bytes_per_row': float(len(body)) / rows}
+        print('  %-32s : %7.1f us/row %7.1f bytes/row' % (name, results[name]['us_per_row'],
+                                                          results[name]['bytes_per_row']))
+
+    print('serialize: %d requests' % query.count())
+    run('get_json + jsonify', lambda: jsonify({'requests': [request_.get_json() for request_ in query.options(
+        joinedload(ApplicationRequests.Users))]}).get_data())
+    for name in encoders:
+        encode = json_encoder(name)
+        serialize = REQUEST_FIELDS.serializer()
+        run('serializer + %s' % name, lambda: encode({'requests': [serialize(row) for row in serialize.select(query)]}))
+        serialize = REQUEST_FIELDS.serializer(fields)
+        run('serializer + %s, fields=' % name,
+            lambda: encode({'requests': [serialize(row) for row in serialize.select(query)]}))
+
+    officer = get_bench_user('bench_officer', access_level=4)
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+    for name, data in (('page', {'limit': page}), ('page fields=', {'limit': page, 'fields': fields})):
+        response = client.post('/api/requests/view_request', headers=headers, data=json.dumps(data),
+                               content_type='application/json')
+        results[name] = {'bytes': len(response.data)}
+        print('  view_request %-19s : %7d bytes for %d requests' % (name, len(response.data), page))
+    return results
+
+
+def bench_process_requests(num=500):
+    # requests/sec moved to a new state by one process_requests call per request against one call for all
+    coe = get_bench_user('bench_coe', access_level=2, branch='COE')
+    client = app.test_client()
+    headers = basic_auth(coe.username, 'bench_password')
+    student_ids = seed_users(50)
+    present = ApplicationRequests.query.filter_by(access_level=2).count()
+    if present < num:
+        db.session.add_all([ApplicationRequests(student_ids[i % len(student_ids)], 2, 'bench %d' % i, 'content', None)
+                            for i in range(present, num)])
+        db.session.commit()
+    request_ids = [row_id for (row_id,) in db.session.query(ApplicationRequests.id)
+                   .filter_by(access_level=2).order_by(ApplicationRequests.id).limit(num)]
+
+    def process(ids, state):
+        response = json.loads(client.post('/api/requests/process_requests', headers=headers,
+                                          content_type='application/json',
+                                          data=json.dumps({'ids': ids, 'state': state})).data)
+        if response['code'] != 200 or response['content']['updated'] != len(ids):
+            raise RuntimeError('process_requests returned %r' % response)
+
+    ApplicationRequests.query.filter(ApplicationRequests.id.in_(request_ids)).update(
+        {'state': 0, 'time_completed': None}, synchronize_session=False)
+    db.session.commit()
+    start = time.time()
+    for request_id in request_ids:
+        process([request_id], 1)
+    single = len(request_ids) / (time.time() - start)
+    start = time.time()
+    process(request_ids, 5)
+    bulk = len(request_ids) / (time.time() - start)
+
+    finished = ApplicationRequests.query.filter(ApplicationRequests.id.in_(request_ids),
+                                                ApplicationRequests.state == 5,
+                                                ApplicationRequests.time_completed.isnot(None)).count()
+    if finished != len(request_ids):
+        raise AssertionError('%d of %d requests completed' % (finished, len(request_ids)))
+    print('process_requests: %d requests' % len(request_ids))
+    print('  one call per request : %10.1f requests/s' % single)
+    print('  one call for all     : %10.1f requests/s (%.1fx)' % (bulk, bulk / single))
+    return {'single_rps': single, 'bulk_rps': bulk}
+
+
+def bench_view_notices(sizes=(1000, 10000, 50000)):
+    # the first page of a branch feed should cost the same however many notices the branch has
+    officer = get_bench_user('bench_officer', access_level=4)
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+
+    timings = {}
+
+    print('view_notices: first page time per branch size')
+    for size in sizes:
+        seed_notices(size, officer.id)
+        client.post('/api/notice/view_notices', headers=headers, data='{"branch": "BN"}',
+                    content_type='application/json')
+        start = time.time()
+        response = client.post('/api/notice/view_notices', headers=headers, data='{"branch": "BN"}',
+                               content_type='application/json')
+        elapsed = time.time() - start
+        listed = len(json.loads(response.data)['notices'])
+        timings[size] = elapsed * 1000
+        print('  %6d notices : %4d listed %8.1f ms' % (size, listed, elapsed * 1000))
+    return timings
+
+
+def load_semester(student_ids, semester, chunk_size=None):
+    # writes random marks of the students to <semester>.txt and loads it with insert_result
+    Result.query.filter_by(semester=int(semester)).delete()
+    ResultMarks.query.filter_by(semester=int(semester)).delete()
+    SemesterRank.query.filter_by(semester=int(semester)).delete()
+    rebuild_standings(db.session.connection())  # the cumulative standings included the deleted semester
+    db.session.commit()
+    try:
+        with open(semester + '.txt', 'w') as f:
+            for user_id in student_ids:
+                f.write('%d,%s\n' % (user_id, ','.join(str(random.randint(1, 100)) for _ in range(10))))
+            f.write('not a user id,1,2\n')
+        return insert_result(semester, chunk_size=chunk_size)
+    finally:
+        os.remove(semester + '.txt')
+
+
+def bench_insert_result(num=20000, semester='1', chunk_sizes=(100, 1000, 5000)):
+    # rows/sec of loading a semester.txt file, once per chunk size
+    student_ids = seed_users(num)
+    rates = {}
+    print('insert_result: %d students' % len(student_ids))
+    for chunk_size in chunk_sizes:
+        report = load_semester(student_ids, semester, chunk_size=chunk_size)
+        rates[chunk_size] = report['rows_per_sec']
+        print('  chunk %5d : %6d inserted %3d rejected %10.0f rows/s' % (
+            chunk_size, report['inserted'], report['rejected_count'], report['rows_per_sec']))
+    return rates
+
+
+def file_calls(profile, names):
+    # calls of the profiled functions named in `names`, e.g. the built-in open
+    return sum(stats[0] for (filename, line, function), stats in pstats.Stats(profile).stats.items()
+               if function in names)
+
+
+def bench_catalog(num=20000, lookups=10000, semester='2'):
+    # subject code lookups per student line from the catalog against reading the branch file every time,
+    # and the branch file reads left in a profiled insert_result
+    codes_file = os.path.join(app.config['CATALOG_DIR'], 'EC')
+    start = time.time()
+    for _ in range(lookups):
+        with open(codes_file, 'r') as codes:
+            codes.readlines()[int(semester) - 1].split(',')
+    file_rate = lookups / (time.time() - start)
+    catalog.refresh(force=True)
+    start = time.time()
+    for _ in range(lookups):
+        catalog.subjects('EC', int(semester))
+    catalog_rate = lookups / (time.time() - start)
+
+    student_ids = seed_users(num)
+    loads = catalog.loads
+    profile = cProfile.Profile()
+    profile.enable()
+    report = load_semester(student_ids, semester)
+    profile.disable()
+    opens = file_calls(profile, ('open', '<open>'))  # the semester file, written and read by load_semester
+    parses = file_calls(profile, ('parse_branch_file',))
+    if catalog.loads != loads or parses:
+        raise AssertionError('insert_result read %d branch files' % (catalog.loads - loads))
+
+    directory = tempfile.mkdtemp()
+    try:  # a changed branch file is picked up by the next lookup after check_interval
+        shutil.copy(codes_file, os.path.join(directory, 'EC'))
+        reloading = CourseCatalog(directory, check_interval=0)
+        before = reloading.subjects('EC', 1)
+        with open(os.path.join(directory, 'EC'), 'a') as codes:
+            codes.write('EC901,EC902\n')
+        os.utime(os.path.join(directory, 'EC'), (time.time() + 1, time.time() + 1))
+        if reloading.subjects('EC', 1) != before or reloading.lookup('EC902') != [('EC', len(reloading.semesters('EC')))]:
+            raise AssertionError('catalog did not reload the changed branch file')
+    finally:
+        shutil.rmtree(directory)
+
+    print('catalog: subject codes of one student line')
+    print('  branch file read per line : %10.0f lookups/s' % file_rate)
+    print('  in-memory catalog         : %10.0f lookups/s (%.0fx)' % (catalog_rate, catalog_rate / file_rate))
+    print('  insert_result of %d lines : %d files opened, %d branch files parsed, %.0f rows/s' % (
+        num, opens, parses, report['rows_per_sec']))
+    return {'file_lookups_per_sec': file_rate, 'catalog_lookups_per_sec': catalog_rate,
+            'ingest_files_opened': opens, 'ingest_branch_files_parsed': parses}
+
+
+def bench_generate(students=500000, semesters=8, legacy_students=50000, database_students=20000):
+    # student semesters/sec of random results: the old one-number-at-a-time loop, whole arrays, the
+    # <semester>.txt files in 1 and in every process, and straight into the database.
+    # Target: arrays above 5M/s and files above 500k/s per core, 500k students x 8 semesters to files in under
+    # 10 s. The database is bounded by insert_result, not by the generator.
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        start = time.time()
+        with open(os.path.join(directory, 'legacy.txt'), 'w') as f:
+            for user in range(1, legacy_students + 1):
+                f.write("%d," % user)
+                for number in range(1, 10):
+                    f.write("%d," % random.randint(1, 101))
+                f.write("%d\n" % random.randint(1, 101))
+        results['legacy_file'] = legacy_students / (time.time() - start)
+
+        groups = dict((semester, [(list(range(1, students + 1)), 10)]) for semester in range(1, semesters + 1))
+        start = time.time()
+        for semester, marks in generate_results(range(1, semesters + 1), groups, seed=1):
+            pass
+        results['arrays'] = students * semesters / (time.time() - start)
+        again = dict(generate_results([1, semesters], groups, seed=1, processes=2))
+        first = dict(generate_results([1, semesters], groups, seed=1))
+        if any((again[semester][0][1] != first[semester][0][1]).any() for semester in first):
+            raise AssertionError('the same seed generated different marks')
+
+        process_counts = sorted(set([1, multiprocessing.cpu_count()]))
+        for processes in process_counts:
+            start = time.time()
+            for semester, written in generate_results(range(1, semesters + 1), groups, seed=1, processes=processes,
+                                                      path_format=os.path.join(directory, '%s.txt')):
+                pass
+            results['files_%d_processes' % processes] = students * semesters / (time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+    seed_users(database_students)
+    Result.query.delete()
+    ResultMarks.query.delete()
+    SemesterRank.query.delete()
+    rebuild_standings(db.session.connection())
+    db.session.commit()
+    start = time.time()
+    reports = generate_random_result(2, seed=1)
+    inserted = sum(report['inserted'] for report in reports)
+    results['database'] = inserted / (time.time() - start)
+
+    print('generate results: %d students x %d semesters' % (students, semesters))
+    print('  one number at a time (%d) : %10.0f student semesters/s' % (legacy_students, results['legacy_file']))
+    print('  arrays                      : %10.0f student semesters/s' % results['arrays'])
+    for processes in process_counts:
+        print('  files, %2d processes         : %10.0f student semesters/s' % (
+            processes, results['files_%d_processes' % processes]))
+    print('  database, %6d inserted    : %10.0f student semesters/s' % (inserted, results['database']))
+    return results
+
+
+def write_import_file(path, student_ids, lines, bad_every=0):
+    # `lines` result lines cycling through the students, every bad_every-th one malformed or out of range
+    with open(path, 'w') as f:
+        for start in range(0, lines, 100000):
+            num = min(100000, lines - start)
+            user_ids = [student_ids[(start + i) % len(student_ids)] for i in range(num)]
+            f.write(result_lines(user_ids, generate_marks(num, 10, start, seed=1)))
+            if bad_every:
+                f.write('x,1,2\n%d,%s\n' % (student_ids[0], ','.join(['500'] * 10)) * (num // bad_every))
+
+
+def bench_import(lines=1500000, students=20000, semester='7'):
+    # lines/sec of parsing a large result file line by line, from the memory mapped chunks on one process
+    # and on every core, the memory the parser holds, and a whole import with its reject report
+    student_ids = seed_users(students)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'results.csv')
+    results = {}
+    try:
+        write_import_file(path, student_ids, lines)
+        size_mb = os.path.getsize(path) / 1048576.0
+        start = time.time()
+        with open(path) as f:
+            parsed = sum(1 for record in parse_result_lines(f))
+        results['line_by_line'] = parsed / (time.time() - start)
+
+        process_counts = sorted(set([1, multiprocessing.cpu_count()]))
+        for processes in process_counts:
+            rss = current_rss()
+            peak = rss
+            start = time.time()
+            parsed = 0
+            for record in read_records(path, processes=processes):
+                parsed += 1
+                if parsed % 100000 == 0:
+                    peak = max(peak, current_rss())
+            results['chunks_%d_processes' % processes] = parsed / (time.time() - start)
+            results['memory_mb_%d_processes' % processes] = (peak - rss) / 1048576.0
+            if parsed != lines:
+                raise AssertionError('read %d of %d lines' % (parsed, lines))
+
+        Result.query.filter_by(semester=int(semester)).delete()
+        ResultMarks.query.filter_by(semester=int(semester)).delete()
+        SemesterRank.query.filter_by(semester=int(semester)).delete()
+        rebuild_standings(db.session.connection())
+        db.session.commit()
+        write_import_file(path, student_ids, len(student_ids), bad_every=1000)
+        report = import_result_file(path, semester, reject_path=os.path.join(directory, 'rejected.csv'))
+        with open(os.path.join(directory, 'rejected.csv')) as rejected:
+            rejected_lines = sum(1 for line in rejected)
+        bad_lines = 2 * (len(student_ids) // 1000)
+        if report['inserted'] != len(student_ids) or report['rejected_count'] != bad_lines \
+                or rejected_lines != bad_lines:
+            raise AssertionError('import inserted %d and rejected %d (%d reported), expected %d and %d' % (
+                report['inserted'], report['rejected_count'], rejected_lines, len(student_ids), bad_lines))
+        results['import_rows_per_sec'] = report['rows_per_sec']
+    finally:
+        shutil.rmtree(directory)
+
+    print('import: %d lines, %.0f MB' % (lines, size_mb))
+    print('  line by line                : %10.0f lines/s' % results['line_by_line'])
+    for processes in process_counts:
+        print('  mapped chunks, %2d processes : %10.0f lines/s, %6.1f MB more memory' % (
+            processes, results['chunks_%d_processes' % processes], results['memory_mb_%d_processes' % processes]))
+    print('  import of %d lines          : %10.0f rows/s, %d rejected lines reported' % (
+        report['lines'], report['rows_per_sec'], report['rejected_count']))
+    return results
+
+
+def seed_results(student_ids, semesters, subjects=10):
+    # results of the students for the semesters, written straight to Result (no ranks or per subject rows)
+    for semester in semesters:
+        present = set(user_id for (user_id,) in db.session.query(Result.user_id).filter_by(semester=semester))
+        missing = [user_id for user_id in student_ids if user_id not in present]
+        codes = ','.join(catalog.subjects('EC', semester) or ['S%d' % i for i in range(subjects)])
+        for start in range(0, len(missing), 10000):
+            user_ids = missing[start:start + 10000]
+            marks = generate_marks(len(user_ids), subjects, semester, seed=1)
+            db.session.execute(Result.__table__.insert(), [
+                {'user_id': user_id, 'semester': semester, 'subjects': codes,
+                 'marks': ','.join(str(mark) for mark in row), 'total': sum(row) / float(len(row))}
+                for user_id, row in zip(user_ids, marks.tolist())])
+            db.session.commit()
+
+
+def bench_export(students=100000, semesters=(5, 6)):
+    # rows/sec, bytes and memory of streaming every result of a branch, against loading them all first
+    student_ids = seed_users(students)
+    seed_results(student_ids, semesters)
+    coe = get_bench_user('bench_coe', access_level=2, branch='COE')
+    client = app.test_client()
+    headers = basic_auth(coe.username, 'bench_password')
+    expected = Result.query.join(User, User.id == Result.user_id).filter(
+        User.branch == 'EC', Result.semester.between(semesters[0], semesters[-1])).count()
+    results = {}
+
+    print('export: %d results of %d students' % (expected, len(student_ids)))
+    for export_format in ('csv', 'ndjson'):
+        rss = current_rss()
+        peak = rss
+        start = time.time()
+        response = client.post('/api/results/export', headers=headers, content_type='application/json',
+                               buffered=False, data=json.dumps({'branch': 'EC', 'from': semesters[0],
+                                                                'to': semesters[-1], 'format': export_format}))
+        received = lines = 0
+        for i, chunk in enumerate(response.response):
+            received += len(chunk)
+            lines += chunk.count(b'\n')
+            if i % 20 == 0:
+                peak = max(peak, current_rss())
+        response.close()
+        elapsed = time.time() - start
+        if lines - (export_format == 'csv') != expected:
+            raise AssertionError('%s export has %d lines for %d results' % (export_format, lines, expected))
+        results[export_format] = {'rows_per_sec': expected / elapsed, 'mb': received / 1048576.0,
+                                  'rss_growth_mb': (peak - rss) / 1048576.0}
+        print('  streamed %-6s : %10.0f rows/s %8.1f MB %6.1f MB more memory' % (
+            export_format, results[export_format]['rows_per_sec'], results[export_format]['mb'],
+            results[export_format]['rss_growth_mb']))
+
+    rss = current_rss()
+    start = time.time()
+    loaded = [result.get_json() for result in Result.query.join(User, User.id == Result.user_id).filter(
+        User.branch == 'EC', Result.semester.between(semesters[0], semesters[-1]))]
+    body = json.dumps(loaded)
+    elapsed = time.time() - start
+    results['loaded_first'] = {'rows_per_sec': len(loaded) / elapsed,
+                               'rss_growth_mb': (current_rss() - rss) / 1048576.0}
+    del loaded, body
+    print('  loaded first    : %10.0f rows/s %17s %6.1f MB more memory' % (
+        results['loaded_first']['rows_per_sec'], '', results['loaded_first']['rss_growth_mb']))
+    return results
+
+
+def bench_analytics(sizes=(1000, 10000, 100000), semester='3'):
+    # time of the per-subject statistics of one branch and semester
+    coe = get_bench_user('bench_coe', access_level=2, branch='COE').username
+    client = app.test_client()
+    headers = basic_auth(coe, 'bench_password')
+    data = json.dumps({'branch': 'EC', 'semester': int(semester)})
+
+    timings = {}
+    print('analytics: per subject statistics of one branch and semester')
+    for size in sizes:
+        load_semester(seed_users(size), semester)
+        start = time.time()
+        response = json.loads(client.post('/api/results/analytics', headers=headers, data=data,
+                                          content_type='application/json').data)
+        elapsed = time.time() - start
+        timings[size] = elapsed * 1000
+        print('  %6d students : %2d subjects %8.1f ms' % (size, len(response['subjects']), elapsed * 1000))
+    return timings
+
+
+def bench_standings(num=5000, semesters=4):
+    # rank queries answered from the rank tables against sorting every Result of the branch, and a
+    # consistency check of the tables maintained by insert_result
+    student_ids = seed_users(num)
+    student = User.query.get(student_ids[0]).username
+    coe = get_bench_user('bench_coe', access_level=2, branch='COE').username
+    client = app.test_client()
+
+    print('standings: %d students, %d semesters' % (len(student_ids), semesters))
+    for semester in range(1, semesters + 1):
+        report = load_semester(student_ids, str(semester))
+        print('  insert_result semester %d : %10.0f rows/s' % (semester, report['rows_per_sec']))
+    report = check_standings(db.session.connection())
+    db.session.commit()
+    if report['mismatches']:
+        raise RuntimeError('%d rank rows differ from Result: %s' % (report['mismatches'], report['examples'][:3]))
+
+    def timed(url, username, body):
+        client.post(url, headers=basic_auth(username, 'bench_password'), data=json.dumps(body),
+                    content_type='application/json')  # warm up
+        start = time.time()
+        response = json.loads(client.post(url, headers=basic_auth(username, 'bench_password'),
+                                          data=json.dumps(body), content_type='application/json').data)
+        if response['code'] != 200:
+            raise RuntimeError('%s returned %s' % (url, response))
+        return (time.time() - start) * 1000
+
+    start = time.time()  # what answering without the rank tables takes: every result of the branch
+    totals = {}
+    for user_id, total in db.session.query(Result.user_id, Result.total).join(User).filter(User.branch == 'EC'):
+        totals.setdefault(user_id, []).append(total)
+    sorted(((sum(values) / len(values), user_id) for user_id, values in totals.items()), reverse=True)
+    naive = (time.time() - start) * 1000
+    timings = {
+        'my_rank_ms': timed('/api/results/rank', student, {}),
+        'top_10_ms': timed('/api/results/top', coe, {'branch': 'EC', 'limit': 10}),
+        'semester_top_10_ms': timed('/api/results/top', coe, {'branch': 'EC', 'semester': 1, 'limit': 10}),
+        'rank_range_ms': timed('/api/results/rank_range', coe, {'branch': 'EC', 'from': 100, 'to': 200}),
+        'recompute_from_result_ms': naive
+    }
+    for name, value in sorted(timings.items()):
+        print('  %-24s : %8.1f ms' % (name[:-3], value))
+    print('  consistency check        : %d semester ranks, %d standings, no mismatches' % (
+        report['semester_ranks'], report['standings']))
+    return timings
+
+
+def search_vocabulary(num=5000):
+    # made up words, the same on every run
+    syllables = ['ka', 'ri', 'mo', 'te', 'su', 'la', 'ne', 'po', 'di', 'ga', 'vu', 'ze', 'ho', 'bi', 'fa', 'ju']
+    rng = random.Random(1)
+    words = set()
+    while len(words) < num:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def seed_search_notices(num, created_by, vocabulary, branches=('EC', 'CS', 'ME', 'IT'), chunk_size=10000):
+    # notices of 5 to 10 title words and 20 to 60 content words, common words much more frequent than rare ones
+    present = Notice.query.filter(Notice.title.like('search %')).count()
+    rng = random.Random(present)
+
+    def words(count):
+        return ' '.join(vocabulary[int(len(vocabulary) * rng.random() ** 3)] for _ in range(count))
+
+    for start in range(present, num, chunk_size):
+        db.session.execute(Notice.__table__.insert(), [
+            {'title': 'search %s' % words(rng.randint(5, 10)), 'content': words(rng.randint(20, 60)),
+             'branch': branches[i % len(branches)], 'created_by': created_by,
+             'date_created': datetime.datetime(2018, 1, 1) + datetime.timedelta(seconds=i)}
+            for i in range(start, min(start + chunk_size, num))])
+        db.session.commit()
+
+
+def bench_search(sizes=(10000, 100000, 1000000), runs=20):
+    # latency of /api/search on common, rare, two word and prefix queries as the number of notices grows
+    officer = get_bench_user('bench_officer', access_level=4)
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+    client.get('/', headers=headers)  # fills the credential cache
+    vocabulary = search_vocabulary()
+    queries = [
+        ('common', {'q': vocabulary[0]}),
+        ('common_branch', {'q': vocabulary[0], 'branch': 'EC'}),
+        ('rare', {'q': vocabulary[-1]}),
+        ('two_words', {'q': '%s %s' % (vocabulary[3], vocabulary[40])}),
+        ('prefix', {'q': vocabulary[200][:3] + '*'}),
+    ]
+    results = {}
+    print('search: %d runs per query, index %s' % (runs, 'FTS5' if search_index_ready() else 'none (LIKE)'))
+    print('  %-8s %-14s %8s %8s %8s %s' % ('notices', 'query', 'p50 ms', 'p95 ms', 'results', 'ranking'))
+    for size in sizes:
+        start = time.time()
+        seed_search_notices(size, officer.id, vocabulary)
+        print('  %-8d seeded in %.1f s' % (size, time.time() - start))
+        results[size] = {}
+        for name, body in queries:
+            body = dict(body, limit=20)
+            latencies = []
+            for _ in range(runs):
+                call_start = time.time()
+                response = json.loads(client.post('/api/search', headers=headers, data=json.dumps(body),
+                                                  content_type='application/json').data)
+                latencies.append(time.time() - call_start)
+                if response['code'] != 200:
+                    raise RuntimeError('search returned %s' % response)
+            results[size][name] = {'p50_ms': percentile(latencies, 50) * 1000,
+                                   'p95_ms': percentile(latencies, 95) * 1000}
+            results[size][name]['ranking'] = response['ranking']
+            print('  %-8d %-14s %8.2f %8.2f %8d %s' % (size, name, results[size][name]['p50_ms'],
+                                                       results[size][name]['p95_ms'], len(response['notices']),
+                                                       response['ranking']))
+        start = time.time()
+        like_search(Notice, [(vocabulary[-1], False)], [], 21)
+        results[size]['like_scan_ms'] = (time.time() - start) * 1000
+        print('  %-8d %-14s %8.2f' % (size, 'LIKE scan', results[size]['like_scan_ms']))
+    return results
+
+
+def bench_notice_cache(num=200, size=1000):
+    # requests/sec of a branch feed page built every time, served from the response cache and revalidated
+    officer = get_bench_user('bench_officer', access_level=4)
+    seed_notices(size, officer.id, branch='NC')
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+    data = '{"branch": "NC"}'
+    requests_per_second(client, 'POST', '/api/notice/view_notices', headers, 1, data)
+
+    response_cache.enabled = False
+    uncached = requests_per_second(client, 'POST', '/api/notice/view_notices', headers, num, data)
+    response_cache.enabled = True
+    response_cache.invalidate('notices:NC')
+    cached = requests_per_second(client, 'POST', '/api/notice/view_notices', headers, num, data)
+    etag = client.post('/api/notice/view_notices', headers=headers, data=data,
+                       content_type='application/json').headers['ETag']
+    start = time.time()
+    for _ in range(num):
+        response = client.post('/api/notice/view_notices', headers=dict(headers, **{'If-None-Match': etag}),
+                               data=data, content_type='application/json')
+        if response.status_code != 304:
+            raise RuntimeError('view_notices returned %d for a current ETag' % response.status_code)
+    revalidated = num / (time.time() - start)
+
+    print('notice cache: %d requests each' % num)
+    print('  page built every call : %10.1f req/s' % uncached)
+    print('  response cache        : %10.1f req/s (%.1fx)' % (cached, cached / uncached))
+    print('  304 not modified      : %10.1f req/s (%.1fx)' % (revalidated, revalidated / uncached))
+    print('  cache stats           : %s' % response_cache.stats())
+    check_cache_invalidation()
+    return {'uncached_rps': uncached, 'cached_rps': cached, 'not_modified_rps': revalidated}
+
+
+def check_cache_invalidation():
+    # a page whose tag is invalidated while it is being built (a notice committed meanwhile) must not be
+    # stored, else the old page would be served until the TTL
+    cache = ResponseCache(MemoryBackend())
+
+    def build():
+        cache.invalidate('notices:NC')
+        return b'old page'
+
+    cache.get_or_build('page', 'notices:NC', build)
+    body, etag = cache.get_or_build('page', 'notices:NC', lambda: b'new page')
+    if body != b'new page':
+        raise AssertionError('response cache stored a page invalidated while it was built')
+    if cache.get_or_build('page', 'notices:NC', lambda: b'newer page')[0] != b'new page':
+        raise AssertionError('response cache did not store a page built without an invalidation')
+    print('  invalidate during build : page not cached')
+
+
+def sync_all(client, headers, data):
+    # polls /api/sync until has_more is false, returns (answers, bytes received, last answer with the rows
+    # and deleted ids of every page)
+    answers, received, rows, deleted = 0, 0, [], []
+    while True:
+        response = client.post('/api/sync', headers=headers, data=json.dumps(data), content_type='application/json')
+        answer = json.loads(response.data)
+        if answer['code'] != 200:
+            raise RuntimeError('sync returned %r' % answer)
+        if len(answer[data['kind']]) > data['limit'] or len(answer['deleted']) > data['limit']:
+            raise AssertionError('sync sent more than %d rows or deleted ids in one page' % data['limit'])
+        answers += 1
+        received += len(response.data)
+        rows.extend(answer[data['kind']])
+        deleted.extend(answer['deleted'])
+        data['since'] = answer['since']
+        if not answer['has_more']:
+            answer.update({data['kind']: rows, 'deleted': deleted})
+            return answers, received, answer
+
+
+def bench_sync(size=5000, changed=5, deleted=2, limit=500, bulk_deleted=1200):
+    # bytes and time of a full download of a branch against a poll after a few notices changed, and the
+    # pages of a poll after a bulk delete
+    officer = get_bench_user('bench_officer', access_level=4)
+    seed_notices(size, officer.id, branch='SY')
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+    overlap = app.config['SYNC_OVERLAP_SECONDS']
+    app.config['SYNC_OVERLAP_SECONDS'] = 0  # every change below comes after the full sync
+    try:
+        data = {'kind': 'notices', 'branch': 'SY', 'limit': limit}
+        start = time.time()
+        full_pages, full_bytes, answer = sync_all(client, headers, data)
+        full_ms = (time.time() - start) * 1000
+
+        notices = Notice.query.filter_by(branch='SY').order_by(Notice.id).limit(changed + deleted).all()
+        changed_ids = set(notice.id for notice in notices[:changed])
+        deleted_ids = set(notice.id for notice in notices[changed:])
+        for notice_id in changed_ids:
+            client.post('/api/notice/update_notice', headers=headers, content_type='application/json',
+                        data=json.dumps({'id': notice_id, 'title': 'changed', 'content': 'changed'}))
+        for notice_id in deleted_ids:
+            client.post('/api/notice/delete_notice', headers=headers, content_type='application/json',
+                        data=json.dumps({'id': notice_id}))
+
+        start = time.time()
+        delta_pages, delta_bytes, answer = sync_all(client, headers, {'kind': 'notices', 'branch': 'SY',
+                                                                      'since': data['since'], 'limit': limit})
+        delta_ms = (time.time() - start) * 1000
+        received = set(notice['id'] for notice in answer['notices'])
+        if received != changed_ids or set(answer['deleted']) != deleted_ids or answer['reset']:
+            raise RuntimeError('sync sent %s and deleted %s, expected %s and %s' % (
+                sorted(received), answer['deleted'], sorted(changed_ids), sorted(deleted_ids)))
+
+        since = answer['since']
+        notices = Notice.query.filter_by(branch='SY').order_by(Notice.id).limit(bulk_deleted).all()
+        deleted_ids = set(notice.id for notice in notices)
+        for notice in notices:  # ORM deletes, so that the tombstones are written
+            db.session.delete(notice)
+        db.session.commit()
+        bulk_pages, bulk_bytes, answer = sync_all(client, headers, {'kind': 'notices', 'branch': 'SY',
+                                                                    'since': since, 'limit': limit})
+        if set(answer['deleted']) != deleted_ids or len(answer['deleted']) != len(deleted_ids):
+            raise RuntimeError('sync deleted %d ids after a bulk delete of %d' % (len(answer['deleted']),
+                                                                                 len(deleted_ids)))
+    finally:
+        app.config['SYNC_OVERLAP_SECONDS'] = overlap
+
+    print('sync: %d notices, %d changed and %d deleted' % (size, changed, deleted))
+    print('  full download : %3d pages %10d bytes %8.1f ms' % (full_pages, full_bytes, full_ms))
+    print('  delta poll    : %3d pages %10d bytes %8.1f ms' % (delta_pages, delta_bytes, delta_ms))
+    print('  bulk delete   : %3d pages %10d bytes for %d deleted' % (bulk_pages, bulk_bytes, len(deleted_ids)))
+    return {'full_bytes': full_bytes, 'full_ms': full_ms, 'delta_bytes': delta_bytes, 'delta_ms': delta_ms}
+
+
+def mixed_load(headers, seconds, readers, writers):
+    # readers list a branch feed while writers create notices in it, returns (reads, writes, errors)
+    counts = {'read': 0, 'write': 0, 'error': 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def work(kind, url, data):
+        client = app.test_client()
+        while time.time() < deadline:
+            response = json.loads(client.post(url, headers=headers, data=data, content_type='application/json').data)
+            with lock:
+                counts[kind if response['code'] in (200, 201) else 'error'] += 1
+
+    threads = [threading.Thread(target=work, args=('read', '/api/notice/view_notices', '{"branch": "MX"}'))
+               for _ in range(readers)]
+    threads += [threading.Thread(target=work, args=('write', '/api/notice/create_notice',
+                                                    '{"title": "t", "content": "c", "branch": "MX"}'))
+                for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['read'], counts['write'], counts['error']
+
+
+def bench_concurrency(seconds=5, readers=6, writers=2):
+    # mixed read/write throughput with the rollback journal and with the configured pragmas (WAL)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        print('concurrency: only compares SQLite journal modes')
+        return {}
+    officer = get_bench_user('bench_officer', access_level=4)
+    seed_notices(1000, officer.id, branch='MX')
+    headers = basic_auth(officer.username, 'bench_password')
+    app.test_client().get('/', headers=headers)
+    configured = app.config['SQLITE_PRAGMAS']
+    response_cache.enabled = False
+
+    rates = {}
+    print('concurrency: %d readers and %d writers for %ds' % (readers, writers, seconds))
+    for name, pragmas in (('rollback journal', [('journal_mode', 'DELETE'), ('synchronous', 'FULL')]),
+                          ('configured', configured)):
+        app.config['SQLITE_PRAGMAS'] = pragmas
+        db.session.remove()
+        db.engine.dispose()
+        reads, writes, errors = mixed_load(headers, seconds, readers, writers)
+        rates[name] = {'reads_per_sec': reads / float(seconds), 'writes_per_sec': writes / float(seconds),
+                       'errors': errors}
+        print('  %-16s : %8.1f reads/s %8.1f writes/s %5d errors' % (
+            name, reads / float(seconds), writes / float(seconds), errors))
+    app.config['SQLITE_PRAGMAS'] = configured
+    response_cache.enabled = True
+    return rates
+
+
+def bench_stream(sizes=(10000, 100000)):
+    # peak RSS growth while streaming a whole branch feed, next to building the same list in memory
+    officer = get_bench_user('bench_officer', access_level=4)
+    client = app.test_client()
+    headers = basic_auth(officer.username, 'bench_password')
+
+    growth = {}
+    print('stream: RSS growth over the baseline while listing a whole branch')
+    for size in sizes:
+        seed_notices(size, officer.id, branch='ST')
+        for stream in ('ndjson', 'json'):
+            baseline = peak = current_rss()
+            start = time.time()
+            response = client.post('/api/notice/view_notices', headers=headers, buffered=False,
+                                   data=json.dumps({'branch': 'ST', 'stream': stream}),
+                                   content_type='application/json')
+            received = 0
+            for i, chunk in enumerate(response.response):
+                received += len(chunk)
+                if i % 10 == 0:
+                    peak = max(peak, current_rss())
+            response.close()
+            growth['%d %s' % (size, stream)] = {'mb_sent': received / 1e6, 'rss_growth_mb': (peak - baseline) / 1e6}
+            print('  %6d notices %-6s : %6.1f MB sent %6.1f MB RSS growth %8.1f ms' % (
+                size, stream, received / 1e6, (peak - baseline) / 1e6, (time.time() - start) * 1000))
+
+        baseline = current_rss()
+        start = time.time()
+        with app.test_request_context():
+            body = app.json_encoder().encode([notice.get_json() for notice in Notice.query.filter_by(branch='ST')])
+        growth['%d list' % size] = {'mb_sent': len(body) / 1e6, 'rss_growth_mb': (current_rss() - baseline) / 1e6}
+        print('  %6d notices list   : %6.1f MB built %5.1f MB RSS growth %8.1f ms' % (
+            size, len(body) / 1e6, (current_rss() - baseline) / 1e6, (time.time() - start) * 1000))
+        del body
+    return growth
+
+
+def check_query_plans():
+    # runs every list endpoint and fails unless SQLite answers its query from the matching index
+    officer = get_bench_user('bench_officer', access_level=4).username
+    student = get_bench_user('bench_student', access_level=1).username
+    client = app.test_client()
+    calls = [
+        ('/api/notice/view_notices', officer, '{"branch": "EC"}', 'Notices', 'ix_notices_branch_date_created'),
+        ('/api/requests/view_request', officer, '{}', 'Requests', 'ix_requests_access_level_time_modified'),
+        ('/api/requests/view_request', student, '{}', 'Requests', 'ix_requests_request_from_time_modified'),
+        ('/api/results/view_result', student, '{}', 'Result', 'ux_result_user_id_semester'),
+    ]
+
+    plans = {}
+    print('query plans:')
+    for url, username, data, table, index in calls:
+        headers = basic_auth(username, 'bench_password')
+        client.post(url, headers=headers, data=data, content_type='application/json')
+        response_cache.enabled = False  # a cached page would answer without the query
+        try:
+            with QueryCounter() as counter:
+                client.post(url, headers=headers, data=data, content_type='application/json')
+        finally:
+            response_cache.enabled = True
+        statement, parameters = [(statement, parameters) for statement, parameters in counter.statements
+                                 if 'FROM "%s"' % table in statement][0]
+        rows = db.engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        plan = ' / '.join(row[-1] for row in rows)
+        plans[index] = plan
+        print('  %-28s %s' % (url, plan))
+        if index not in plan or 'TEMP B-TREE' in plan:
+            raise AssertionError('%s does not use %s: %s' % (url, index, plan))
+    return plans
+
+
+BRANCHES = ('CS', 'EC', 'ME')
+
+
+def generate_campus(students=100, notices=200, requests=500, semesters=8):
+    # `students` per branch, `notices` per branch, `requests` spread over the students and results of
+    # every student for `semesters` semesters. Rows already present from an earlier run are kept.
+    staff = {
+        'coe': get_bench_user('bench_coe', access_level=2, branch='COE'),
+        'admin': get_bench_user('bench_admin', access_level=3, branch='admin'),
+        'officer': get_bench_user('bench_officer', access_level=4, branch='EC'),
+        'student': get_bench_user('bench_student', access_level=1, branch='EC'),
+    }
+    student_ids = []
+    for branch in BRANCHES:
+        student_ids += seed_users(students, prefix='bench_%s_' % branch.lower(), branch=branch)
+        seed_notices(notices, staff['officer'].id, branch=branch)
+    present = ApplicationRequests.query.filter(ApplicationRequests.title.like('campus %')).count()
+    if present < requests:
+        now = datetime.datetime.now()
+        db.session.execute(ApplicationRequests.__table__.insert(), [
+            {'request_from': student_ids[i % len(student_ids)], 'request_type': 4, 'access_level': 4,
+             'title': 'campus %d' % i, 'content': 'content', 'state': 0,
+             'time_created': now, 'time_modified': now - datetime.timedelta(minutes=i)}
+            for i in range(present, requests)])
+        db.session.commit()
+    student_ids.append(staff['student'].id)
+    for semester in range(1, semesters + 1):
+        if Result.query.filter_by(semester=semester).count() < len(student_ids):
+            load_semester(student_ids, str(semester))
+    usernames = dict((name, user.username) for name, user in staff.items())
+    db.session.remove()
+    return usernames
+
+
+class ClientTransport(object):
+    # calls the app in-process through the Flask test client
+
+    name = 'client'
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, url, headers, body):
+        response = self.client.open(url, method=method, headers=headers, data=body,
+                                    content_type='application/json')
+        return response.status_code, response.data
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+
+class SocketTransport(object):
+    # calls the app over a local TCP socket, served by a threaded werkzeug server of this process
+
+    name = 'socket'
+
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, method, url, headers, body):
+        connection = httplib.HTTPConnection('127.0.0.1', self.server.server_port)
+        connection.request(method, url, body, dict(headers, **{'Content-Type': 'application/json'}))
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        return response.status, data
+
+    def close(self):
+        self.server.shutdown()
+
+
+def bench_serving(clients=200, requests_per_client=5, students=5000, semesters=8, threads=32):
+    # clients listing notices at once over the serve.py server, alone and while create_random_result
+    # ingests a campus of results. Each client also checks that / answers with its own user, i.e. that
+    # g.user stays per request with many requests in flight.
+    usernames = ['bench_serving%d' % i for i in range(20)]
+    for username in usernames:
+        get_bench_user(username)
+    coe = get_bench_user('bench_coe', access_level=2, branch='COE').username
+    seed_notices(1000, get_bench_user('bench_officer', access_level=4).id)
+    seed_users(students)
+    db.session.remove()
+    server = serve.make_server('127.0.0.1', 0, threads, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def call(method, url, username, body):
+        connection = httplib.HTTPConnection('127.0.0.1', server.server_port, timeout=600)
+        headers = dict(basic_auth(username, 'bench_password'), **{'Content-Type': 'application/json'})
+        connection.request(method, url, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        return response.status, data
+
+    def run_clients():
+        # (latencies, finish times, errors, users answered wrongly)
+        latencies, finished = [], []
+        problems = {'errors': 0, 'wrong_user': 0}
+        lock = threading.Lock()
+
+        def client(i):
+            username = usernames[i % len(usernames)]
+            for _ in range(requests_per_client):
+                start = time.time()
+                status, data = call('POST', '/api/notice/view_notices', username, '{"branch": "BN", "limit": 20}')
+                with lock:
+                    latencies.append(time.time() - start)
+                    finished.append(time.time())
+                    if status != 200:
+                        problems['errors'] += 1
+            status, data = call('GET', '/', username, None)
+            with lock:
+                if status != 200 or json.loads(data)['name'] != username:
+                    problems['wrong_user'] += 1
+
+        workers = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return latencies, finished, problems['errors'], problems['wrong_user']
+
+    response_cache.enabled = False  # every view_notices reads the database
+    results = {}
+    try:
+        for username in usernames:  # the first call of each user pays the password hash
+            call('GET', '/', username, None)
+        print('serving: %d clients x %d view_notices, %d server threads, %d students' % (
+            clients, requests_per_client, threads, students))
+        for name in ('alone', 'during_ingest'):
+            job = None
+            if name == 'during_ingest':
+                status, data = call('POST', '/api/results/create_random_result', coe,
+                                    json.dumps({'semesters': semesters}))
+                job = job_manager.get(json.loads(data)['job_id'])
+            start = time.time()
+            latencies, finished, errors, wrong_user = run_clients()
+            elapsed = time.time() - start
+            results[name] = {
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'max_ms': max(latencies) * 1000,
+                'requests_per_sec': len(latencies) / elapsed,
+                'errors': errors,
+                'wrong_user': wrong_user
+            }
+            if job is not None:
+                job_manager.wait(job.id, timeout=600)
+                results[name]['job_seconds'] = job.finished_at - job.started_at
+                results[name]['during_job'] = len([end for end in finished if end < job.finished_at])
+            print('  %-14s : p50 %7.1f ms  p95 %7.1f ms  max %7.1f ms %8.1f req/s %d errors %d wrong users%s' % (
+                name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['max_ms'],
+                results[name]['requests_per_sec'], errors, wrong_user,
+                '' if job is None else '  (%d of %d answered during the %.1f s job)' % (
+                    results[name]['during_job'], len(latencies), results[name]['job_seconds'])))
+    finally:
+        response_cache.enabled = True
+        server.shutdown()
+        for semester in range(1, semesters + 1):
+            if os.path.exists('%d.txt' % semester):
+                os.remove('%d.txt' % semester)
+
+    for name, result in results.items():
+        if result['errors'] or result['wrong_user']:
+            raise RuntimeError('%s: %d errors, %d answers for the wrong user' % (
+                name, result['errors'], result['wrong_user']))
+    ingest = results['during_ingest']
+    if ingest['during_job'] < len(latencies) and ingest['max_ms'] / 1000 >= ingest['job_seconds']:
+        raise RuntimeError('view_notices waited for the whole create_random_result job')
+    return results
+
+
+def percentile(values, p):  # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))]
+
+
+def endpoint_calls(users, run_id):
+    # (route, method, url, username, password, body of call i, iterations or None for the default, codes
+    # accepted in the JSON body). Routes that hash a password get a few iterations only.
+    password = 'bench_password'
+
+    def changed_password(i):
+        return password if i % 2 == 0 else password + '2'
+
+    def create_notice(i):
+        return json.dumps({'title': 'run %d notice %d' % (run_id, i), 'content': 'content', 'branch': 'EC'})
+
+    return [
+        ('index', 'GET', '/', users['student'], password, lambda i: '', None),
+        ('login', 'POST', '/login', users['student'], password, lambda i: '{}', None),
+        ('login_token', 'POST', '/login', users['student'], password, lambda i: '{"token": true}', None),
+        ('view_notices', 'POST', '/api/notice/view_notices', users['student'], password,
+         lambda i: '{"branch": "EC"}', None),
+        ('view_notices_revalidate', 'POST', '/api/notice/view_notices', users['student'], password,
+         lambda i: '{"branch": "CS", "limit": 20}', None),
+        ('create_notice', 'POST', '/api/notice/create_notice', users['officer'], password, create_notice, None),
+        ('update_notice', 'POST', '/api/notice/update_notice', users['officer'], password,
+         lambda i: json.dumps({'id': users['notice_id'], 'title': 'updated %d' % i, 'content': 'content'}), None),
+        ('create_request', 'POST', '/api/requests/create_request', users['student'], password,
+         lambda i: json.dumps({'title': 'run %d request %d' % (run_id, i), 'content': 'c', 'request_type': 4}),
+         None),
+        ('view_request_officer', 'POST', '/api/requests/view_request', users['officer'], password,
+         lambda i: '{}', None),
+        ('view_request_student', 'POST', '/api/requests/view_request', users['student'], password,
+         lambda i: '{}', None),
+        ('update_requests', 'POST', '/api/requests/update_requests', users['student'], password,
+         lambda i: json.dumps({'id': users['request_id'], 'title': 'updated', 'content': 'c', 'type': 4}), None),
+        ('view_result', 'POST', '/api/results/view_result', users['student'], password, lambda i: '{}', None),
+        ('analytics', 'POST', '/api/results/analytics', users['coe'], password,
+         lambda i: '{"branch": "EC", "semester": 3}', None),
+        ('update_profile', 'POST', '/api/students/update_profile', users['student'], password,
+         lambda i: '{"name": "bench_student"}', None),
+        ('cache_stats', 'POST', '/api/auth/cache_stats', users['admin'], password, lambda i: '{}', None),
+        ('job_status', 'POST', '/api/jobs/status', users['coe'], password,
+         lambda i: json.dumps({'id': users['job_id']}), None),
+        ('create_users', 'POST', '/api/students/create_users', None, None,
+         lambda i: json.dumps({'username': 'run%d_user%d' % (run_id, i), 'password': password,
+                               'email': 'run%d_user%d@bench' % (run_id, i), 'name': 'new user',
+                               'user_access_level': '1', 'branch': 'CS'}), 5),
+        ('change_password', 'POST', '/api/students/change_password', 'bench_password_user', changed_password,
+         lambda i: json.dumps({'old_password': changed_password(i), 'new_password': changed_password(i + 1),
+                               'confirm_password': changed_password(i + 1)}), 4),
+    ]
+
+
+def run_job_route(transport, coe):
+    # create_random_result only starts a job, the job's own throughput is reported next to the request
+    headers = basic_auth(coe, 'bench_password')
+    start = time.time()
+    status, body = transport.request('POST', '/api/results/create_random_result', headers, '{"semesters": 2}')
+    latency = time.time() - start
+    job_id = json.loads(body).get('job_id')
+    job = job_manager.wait(job_id, timeout=600)
+    for semester in ('1', '2'):
+        if os.path.exists(semester + '.txt'):
+            os.remove(semester + '.txt')
+    return job_id, {
+        'requests': 1,
+        'errors': 0 if status == 200 and job is not None else 1,
+        'p50_ms': latency * 1000, 'p95_ms': latency * 1000, 'p99_ms': latency * 1000,
+        'job': job.get_json() if job is not None else None
+    }
+
+
+def bench_endpoints(students=100, iterations=50, transport='client'):
+    # latency percentiles, throughput, SQL statements and memory of every route of app.py
+    users = generate_campus(students=students)
+    users['notice_id'] = Notice.query.filter_by(created_by=User.query.filter_by(
+        username=users['officer']).first().id).order_by(Notice.id.desc()).first().id
+    student = User.query.filter_by(username=users['student']).first()
+    request_row = ApplicationRequests(student.id, 4, 'bench update', 'content', None)
+    db.session.add(request_row)
+    db.session.commit()
+    users['request_id'] = request_row.id
+    get_bench_user('bench_password_user')
+    db.session.remove()
+    transport = SocketTransport() if transport == 'socket' else ClientTransport()
+    run_id = int(time.time())
+    routes = {}
+
+    print('endpoints over %s: %d students per branch, %d calls per route' % (transport.name, students, iterations))
+    print('  %-24s %8s %8s %8s %9s %6s %6s %8s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'SQL',
+                                                   'errors', 'RSS MB'))
+    try:
+        users['job_id'], routes['create_random_result'] = run_job_route(transport, users['coe'])
+        for name, method, url, username, password, body, num in endpoint_calls(users, run_id):
+            num = num or iterations
+            latencies = []
+            errors = 0
+            baseline = current_rss()
+            with QueryCounter() as counter:
+                start = time.time()
+                for i in range(num):
+                    headers = {}
+                    if username is not None:
+                        headers = basic_auth(username, password(i) if callable(password) else password)
+                    if name == 'view_notices_revalidate' and i > 0:
+                        headers['If-None-Match'] = etag
+                    call_start = time.time()
+                    status, data = transport.request(method, url, headers, body(i))
+                    latencies.append(time.time() - call_start)
+                    if name == 'view_notices_revalidate' and i == 0:
+                        etag = '"%s"' % response_cache.etag(data)
+                    if status >= 400 or (status == 200 and json.loads(data).get('code', 200) >= 400):
+                        errors += 1
+                elapsed = time.time() - start
+            routes[name] = {
+                'requests': num,
+                'errors': errors,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'requests_per_sec': num / elapsed,
+                'statements_per_request': counter.count / float(num),
+                'rss_growth_mb': (current_rss() - baseline) / 1e6
+            }
+            route = routes[name]
+            print('  %-24s %8.2f %8.2f %8.2f %9.1f %6.1f %6d %8.1f' % (
+                name, route['p50_ms'], route['p95_ms'], route['p99_ms'], route['requests_per_sec'],
+                route['statements_per_request'], errors, route['rss_growth_mb']))
+    finally:
+        transport.close()
+    return {
+        'transport': transport.name,
+        'students_per_branch': students,
+        'routes': routes,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }
+
+
+def bench_endpoints_socket(students=100, iterations=50):
+    return bench_endpoints(students=students, iterations=iterations, transport='socket')
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.time()
+import app
+imported = time.time()
+response = app.app.test_client().post('/api/notice/view_notices', data='{"branch": "BN"}',
+                                      content_type='application/json', headers={'Authorization': sys.argv[1]})
+print(json.dumps({'status': response.status_code, 'import_ms': (imported - start) * 1000,
+                  'first_request_ms': (time.time() - imported) * 1000}))
+"""
+
+
+def bench_startup(runs=5):
+    # import time of app.py and latency of the first request of a fresh process, in `runs` new interpreters.
+    # Startup mustn't depend on the size of the database: no schema work or table scans at import.
+    officer = get_bench_user('bench_officer', access_level=4)
+    authorization = basic_auth(officer.generate_auth_token(), 'unused')['Authorization']
+    directory = os.path.dirname(os.path.abspath(__file__))
+    samples = {'import': [], 'first_request': []}
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, authorization], cwd=directory)
+        run = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        if run['status'] != 200:
+            raise RuntimeError('first request returned %d' % run['status'])
+        samples['import'].append(run['import_ms'])
+        samples['first_request'].append(run['first_request_ms'])
+
+    start = time.time()
+    pending_migrations(db)
+    check_ms = (time.time() - start) * 1000
+    start = time.time()
+    run_migrations(db)
+    migrate_ms = (time.time() - start) * 1000
+    start = time.time()
+    rows = len(User.query.all()) + len(Notice.query.all()) + len(Result.query.all())
+    dump_ms = (time.time() - start) * 1000
+
+    routes = {}
+    print('startup: %d fresh processes' % runs)
+    for name in ('import', 'first_request'):
+        routes[name] = {'p50_ms': percentile(samples[name], 50), 'p95_ms': percentile(samples[name], 95)}
+        print('  %-20s : p50 %8.1f ms p95 %8.1f ms' % (name, routes[name]['p50_ms'], routes[name]['p95_ms']))
+    print('  schema check         : %8.1f ms (run by the servers at startup)' % check_ms)
+    print('  migrate, up to date  : %8.1f ms (flask migrate, no longer run at import)' % migrate_ms)
+    print('  --dump of %7d rows: %8.1f ms (no longer run by python app.py)' % (rows, dump_ms))
+    return {'routes': routes, 'schema_check_ms': check_ms, 'migrate_ms': migrate_ms, 'dump_ms': dump_ms}
+
+
+def compare(previous, current, tolerance):
+    # prints the p95 change of every route measured in both runs, returns the routes that got slower
+    regressions = []
+    print('compared with the previous run (p95, tolerance %d%%):' % (tolerance * 100))
+    for name in sorted(current['results']):
+        if name not in previous['results'] or not isinstance(current['results'][name], dict):
+            continue
+        old_routes = previous['results'][name].get('routes', {}) if isinstance(previous['results'][name], dict) else {}
+        for route, stats in sorted(current['results'][name].get('routes', {}).items()):
+            if route not in old_routes or not old_routes[route].get('p95_ms'):
+                continue
+            change = stats['p95_ms'] / old_routes[route]['p95_ms'] - 1
+            marker = ''
+            if change > tolerance:
+                regressions.append('%s/%s' % (name, route))
+                marker = '  REGRESSION'
+            print('  %-40s %8.2f -> %8.2f ms %+6.1f%%%s' % (
+                '%s/%s' % (name, route), old_routes[route]['p95_ms'], stats['p95_ms'], change * 100, marker))
+    return regressions
+
+
+BENCHMARKS = {
+    'analytics': bench_analytics,
+    'auth': bench_auth,
+    'bulk_users': bench_bulk_users,
+    'catalog': bench_catalog,
+    'concurrency': bench_concurrency,
+    'endpoints': bench_endpoints,
+    'endpoints_socket': bench_endpoints_socket,
+    'export': bench_export,
+    'generate': bench_generate,
+    'import': bench_import,
+    'insert_result': bench_insert_result,
+    'metrics': bench_metrics,
+    'notice_cache': bench_notice_cache,
+    'process_requests': bench_process_requests,
+    'query_plans': check_query_plans,
+    'standings': bench_standings,
+    'search': bench_search,
+    'serialize': bench_serialize,
+    'serving': bench_serving,
+    'startup': bench_startup,
+    'stream': bench_stream,
+    'sync': bench_sync,
+    'view_notices': bench_view_notices,
+    'view_request': bench_view_request,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the campus management API. The database is '
+                                                 'DATABASE_URL, by default sqlite:////tmp/campus_benchmark.db')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all of them by default: %s' %
+                                                 ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON file of an earlier run, exits with 1 when a route got slower')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown, default 0.2')
+    args = parser.parse_args()
+
+    run = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI']
+        },
+        'results': {}
+    }
+    run_migrations(db)
+    for name in args.names or sorted(BENCHMARKS):
+        run['results'][name] = BENCHMARKS[name]()
+    run['meta']['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(run, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as previous:
+            if compare(json.load(previous), run, args.tolerance):
+                sys.exit(1)
@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+import time
+
+# Subject codes of every branch, read from the branch files (CS, EC, ME, ...): one file per branch named
+# after it, one line per semester with the codes of that semester separated by commas.
+# The files are parsed once and kept as
+#   branch -> [codes of semester 1, codes of semester 2, ...]
+#   code   -> [(branch, semester), ...]   first year codes are shared by every branch
+# A file is read again only when its modification time or size changes, checked at most every
+# `check_interval` seconds, so a new curriculum is picked up without a restart. Lookups read an
+# immutable snapshot and never block on a reload.
+
+BRANCH_FILE = re.compile(r'^[A-Z]{2,10}$')
+SUBJECT_CODE = re.compile(r'^[A-Z]+[0-9]+$')
+
+
+def parse_branch_file(path):
+    # the semesters of a branch file, None for a file that isn't a list of subject codes
+    semesters = []
+    with open(path, 'r') as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            codes = tuple(code.strip() for code in line.strip().split(','))
+            if not all(SUBJECT_CODE.match(code) for code in codes):
+                return None
+            semesters.append(codes)
+    return semesters or None
+
+
+class CourseCatalog(object):
+
+    def __init__(self, directory='.', check_interval=2.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.files = {}  # branch -> (mtime, size) of the file the snapshot was read from
+        self.branches = {}
+        self.codes = {}
+        self.checked_at = None
+        self.loads = 0  # branch files parsed, for the benchmarks
+        self.lock = threading.Lock()
+
+    def refresh(self, force=False):
+        # rereads the branch files that changed, returns True when the catalog changed
+        if not force and self.checked_at is not None and time.time() - self.checked_at < self.check_interval:
+            return False
+        with self.lock:
+            self.checked_at = time.time()
+            files = {}
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if BRANCH_FILE.match(name) and os.path.isfile(path):
+                    stat = os.stat(path)
+                    files[name] = (stat.st_mtime, stat.st_size)
+            if files == self.files:
+                return False
+            branches = {}
+            for branch, version in files.items():
+                if self.files.get(branch) == version and branch in self.branches:
+                    branches[branch] = self.branches[branch]
+                    continue
+                semesters = parse_branch_file(os.path.join(self.directory, branch))
+                self.loads += 1
+                if semesters is not None:
+                    branches[branch] = semesters
+            codes = {}
+            for branch, semesters in sorted(branches.items()):
+                for semester, subjects in enumerate(semesters, 1):
+                    for code in subjects:
+                        codes.setdefault(code, []).append((branch, semester))
+            # replaced together, a reader holding the old dicts still sees one consistent version
+            self.branches, self.codes, self.files = branches, codes, files
+            return True
+
+    def semesters(self, branch):
+        # the codes of every semester of the branch, or None
+        self.refresh()
+        return self.branches.get(branch)
+
+    def subjects(self, branch, semester):
+        # the codes of one semester (counted from 1) of the branch, or None
+        semesters = self.semesters(branch)
+        if semesters is None or not 0 < semester <= len(semesters):
+            return None
+        return semesters[semester - 1]
+
+    def lookup(self, code):
+        # [(branch, semester)] offering the subject
+        self.refresh()
+        return list(self.codes.get(code, ()))
+
+    def get_json(self, branch=None):
+        self.refresh()
+        branches = self.branches
+        if branch is not None:
+            branches = {branch: branches[branch]} if branch in branches else {}
+        return dict((name, [list(codes) for codes in semesters]) for name, semesters in branches.items())
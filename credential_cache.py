@@ -0,0 +1,86 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+
+class CredentialCache(object):
+    # Remembers (username, password) pairs that already passed pwd_context.verify so that
+    # repeat calls skip the slow hash. Keys are HMAC digests, the plain password is never stored.
+    # Entries expire after `ttl` seconds and the least recently used entry is dropped when full.
+    # Only the hash is skipped: a hit still loads the user by id, the cached hash is compared with it.
+
+    def __init__(self, secret_key, max_size=1024, ttl=300):
+        if not isinstance(secret_key, bytes):
+            secret_key = secret_key.encode('utf-8')
+        self.secret_key = secret_key
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # digest -> (username, user_id, password_hash, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def digest(self, username, password):
+        message = u'%s\0%s' % (username, password)
+        return hmac.new(self.secret_key, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, username, password):
+        # returns (user_id, password_hash) of a previously verified login or None
+        if self.max_size <= 0:
+            return None
+        key = self.digest(username, password)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[3] < time.time():
+                del self.entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            # move to the end so that it is evicted last
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, username, password, user_id, password_hash):
+        if self.max_size <= 0:
+            return
+        key = self.digest(username, password)
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            self.entries[key] = (username, user_id, password_hash, time.time() + self.ttl)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username):
+        # drops every cached credential of the user, used when the password or profile changes
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry[0] == username]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+            }
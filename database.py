@@ -0,0 +1,62 @@
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Engine settings read from the environment:
+#   DATABASE_URL          database URI, default sqlite:////tmp/test.db
+#   DB_POOL_SIZE          connections kept open in the pool
+#   DB_MAX_OVERFLOW       connections opened above the pool size under load
+#   DB_POOL_TIMEOUT       seconds to wait for a free connection
+#   DB_POOL_RECYCLE       seconds after which a connection is replaced
+#   SQLITE_JOURNAL_MODE   default WAL, readers and one writer don't block each other
+#   SQLITE_SYNCHRONOUS    default NORMAL, safe with WAL and fsyncs only at checkpoints
+#   SQLITE_BUSY_TIMEOUT   milliseconds a writer waits for the lock before "database is locked", default 5000
+
+DEFAULT_DATABASE_URI = 'sqlite:////tmp/test.db'
+POOL_SETTINGS = [
+    ('pool_size', 'DB_POOL_SIZE', int),
+    ('max_overflow', 'DB_MAX_OVERFLOW', int),
+    ('pool_timeout', 'DB_POOL_TIMEOUT', float),
+    ('pool_recycle', 'DB_POOL_RECYCLE', int),
+]
+
+
+def database_uri(environ):
+    return environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+
+
+def engine_options(uri, environ):
+    options = {}
+    for option, name, cast in POOL_SETTINGS:
+        if environ.get(name):
+            options[option] = cast(environ[name])
+    if uri.startswith('sqlite'):
+        if options:  # SQLAlchemy doesn't pool file based SQLite connections unless asked to
+            options['poolclass'] = QueuePool
+            options['connect_args'] = {'check_same_thread': False}
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+
+def sqlite_pragmas(environ):
+    return [
+        ('journal_mode', environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', int(environ.get('SQLITE_BUSY_TIMEOUT', 5000))),
+    ]
+
+
+def apply_sqlite_pragmas(engine, config):
+    # runs the pragmas in config['SQLITE_PRAGMAS'] on every new connection of this engine, other engines
+    # and databases are left alone
+    if engine.dialect.name != 'sqlite':
+        return None
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in config['SQLITE_PRAGMAS']:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    return set_sqlite_pragmas
@@ -0,0 +1,170 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request timings, kept per endpoint and exported in the Prometheus text format. The Flask and SQLAlchemy
+# hooks are registered once by register(), before the app serves a request (Flask refuses new hooks after
+# that), and return at once unless the instance is enabled; install() and uninstall() only switch it, so a
+# disabled instance costs one attribute lookup per hook, timed() or add_*() call.
+# Every request records its wall time, SQL statements and their duration, time spent hashing passwords,
+# rows serialized and response bytes, and answers with a Server-Timing header of the first three.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNTERS = [
+    # (metric, record field, help)
+    ('campus_sql_statements_total', 'sql_count', 'SQL statements executed'),
+    ('campus_sql_seconds_total', 'sql_seconds', 'Time spent executing SQL statements'),
+    ('campus_password_seconds_total', 'password_seconds', 'Time spent hashing and verifying passwords'),
+    ('campus_rows_serialized_total', 'rows', 'Database rows serialized into responses'),
+    ('campus_response_bytes_total', 'bytes', 'Response body bytes sent'),
+]
+
+
+class RequestRecord(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.sql_started = None
+        self.password_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+
+class Metrics(object):
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self.local = threading.local()  # the RequestRecord of the request handled by the thread
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.durations = {}  # endpoint -> [count per bucket..., count, sum]
+        self.totals = {}  # (metric, endpoint) -> value
+        self.lock = threading.Lock()
+        self.registered = False
+
+    def register(self, app):
+        # hooks into the app and every engine, called when the app is set up
+        if self.registered:
+            return
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        self.registered = True
+
+    def install(self, app):
+        self.register(app)
+        self.enabled = True
+
+    def uninstall(self, app):
+        self.enabled = False
+
+    def current(self):
+        return getattr(self.local, 'record', None) if self.enabled else None
+
+    def start_request(self):
+        self.local.record = RequestRecord() if self.enabled else None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = self.current()  # None in background jobs
+        if record is not None:
+            record.sql_started = time.time()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = self.current()
+        if record is not None and record.sql_started is not None:
+            record.sql_count += 1
+            record.sql_seconds += time.time() - record.sql_started
+            record.sql_started = None
+
+    @contextmanager
+    def timed(self, field):
+        record = self.current()
+        if record is None:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            setattr(record, field, getattr(record, field) + time.time() - start)
+
+    def add_rows(self, num):
+        record = self.current()
+        if record is not None:
+            record.rows += num
+
+    def add_bytes(self, num):
+        record = self.current()
+        if record is not None:
+            record.bytes += num
+
+    def finish_request(self, response):
+        record = self.current()
+        if record is None:
+            return response
+        response.headers['Server-Timing'] = 'db;dur=%.1f;desc="%d statements", password;dur=%.1f, total;dur=%.1f' % (
+            record.sql_seconds * 1000, record.sql_count, record.password_seconds * 1000,
+            (time.time() - record.start) * 1000)
+        endpoint, method, status = request.endpoint or 'unknown', request.method, response.status_code
+        if not response.is_streamed:
+            record.bytes += response.content_length or 0
+            self.local.record = None
+            self.observe(endpoint, method, status, record)
+            return response
+
+        def close():  # streamed bodies are only complete once the server closes the response
+            self.local.record = None
+            self.observe(endpoint, method, status, record)
+
+        response.call_on_close(close)
+        return response
+
+    def observe(self, endpoint, method, status, record):
+        seconds = time.time() - record.start
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(endpoint, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            for metric, field, description in COUNTERS:
+                key = (metric, endpoint)
+                self.totals[key] = self.totals.get(key, 0) + getattr(record, field)
+
+    def render(self):
+        # the Prometheus text exposition format, version 0.0.4
+        lines = []
+        with self.lock:
+            lines.append('# HELP campus_requests_total Requests handled')
+            lines.append('# TYPE campus_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('campus_requests_total{endpoint="%s",method="%s",status="%d"} %d' % (
+                    endpoint, method, status, count))
+            lines.append('# HELP campus_request_duration_seconds Wall time of a request')
+            lines.append('# TYPE campus_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append('campus_request_duration_seconds_bucket{endpoint="%s",le="%g"} %d' % (
+                        endpoint, bound, count))
+                lines.append('campus_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %d' % (
+                    endpoint, histogram[-2]))
+                lines.append('campus_request_duration_seconds_count{endpoint="%s"} %d' % (endpoint, histogram[-2]))
+                lines.append('campus_request_duration_seconds_sum{endpoint="%s"} %r' % (
+                    endpoint, float(histogram[-1])))
+            for metric, field, description in COUNTERS:
+                lines.append('# HELP %s %s' % (metric, description))
+                lines.append('# TYPE %s counter' % metric)
+                for (name, endpoint), value in sorted(self.totals.items()):
+                    if name == metric:
+                        lines.append('%s{endpoint="%s"} %r' % (metric, endpoint, float(value)))
+        return '\n'.join(lines) + '\n'
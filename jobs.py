@@ -0,0 +1,167 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(object):
+    # Progress of one background job. The worker updates it, HTTP handlers read get_json() concurrently.
+
+    def __init__(self, name, owner, steps_total):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.owner = owner
+        self.state = 'queued'  # queued, running, completed, failed, cancelled
+        self.steps_total = steps_total
+        self.steps_done = 0
+        self.rows = 0
+        self.rejected = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def step(self):
+        with self.lock:
+            self.steps_done += 1
+
+    def add_rows(self, num):
+        with self.lock:
+            self.rows += num
+
+    def add_errors(self, errors, keep=100):
+        # counts every error but only remembers the first `keep` messages
+        with self.lock:
+            self.rejected += len(errors)
+            self.errors.extend(errors[:max(0, keep - len(self.errors))])
+
+    def check_cancelled(self):
+        # called by the job between units of work
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def get_json(self):
+        with self.lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                'id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'steps_done': self.steps_done,
+                'steps_total': self.steps_total,
+                'rows': self.rows,
+                'rows_per_sec': self.rows / elapsed if elapsed else 0.0,
+                'rejected': self.rejected,
+                'errors': list(self.errors),
+                'elapsed': elapsed,
+                'cancel_requested': self.cancel_requested
+            }
+
+
+class JobManager(object):
+    # Runs jobs on a fixed number of daemon threads of this process and keeps the last `keep` jobs for polling.
+
+    def __init__(self, workers=2, keep=100):
+        self.workers = workers
+        self.keep = keep
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, name, owner, steps_total, func, *args):
+        # func(job, *args) runs on a worker thread
+        job = Job(name, owner, steps_total)
+        with self.lock:
+            self.add(job)
+        self.queue.put((job, func, args))
+        return job
+
+    def submit_unique(self, name, owner, steps_total, func, *args):
+        # (job, True) like submit, or (the queued or running job with this name, False) without starting
+        # another, checked and added under one lock so two callers can't both start one
+        with self.lock:
+            job = self.find_active(name)
+            if job is not None:
+                return job, False
+            job = Job(name, owner, steps_total)
+            self.add(job)
+        self.queue.put((job, func, args))
+        return job, True
+
+    def add(self, job):  # the caller holds the lock
+        self.jobs[job.id] = job
+        self.prune()
+        if not self.threads:
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished.is_set()]
+        while len(self.jobs) > self.keep and finished:
+            del self.jobs[finished.pop(0)]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active(self, name):
+        # the queued or running job with this name, if any
+        with self.lock:
+            return self.find_active(name)
+
+    def find_active(self, name):  # the caller holds the lock
+        for job in self.jobs.values():
+            if job.name == name and not job.finished.is_set():
+                return job
+        return None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished.is_set():
+            return False
+        with job.lock:
+            job.cancel_requested = True
+        return True
+
+    def wait(self, job_id, timeout=None):
+        job = self.get(job_id)
+        if job is not None:
+            job.finished.wait(timeout)
+        return job
+
+    def work(self):
+        while True:
+            job, func, args = self.queue.get()
+            with job.lock:
+                job.state = 'running'
+                job.started_at = time.time()
+            state = 'completed'
+            try:
+                job.check_cancelled()
+                func(job, *args)
+            except JobCancelled:
+                state = 'cancelled'
+            except Exception as e:
+                job.add_errors([e.__str__()])
+                state = 'failed'
+            with job.lock:
+                job.state = state
+                job.finished_at = time.time()
+            job.finished.set()
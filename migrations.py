@@ -0,0 +1,94 @@
+import datetime
+import logging
+
+from sqlalchemy import text
+
+from search import create_search_indexes
+from standings import rebuild_standings
+
+logger = logging.getLogger(__name__)
+
+# Schema changes for databases created by an older version of app.py. db.create_all() only creates
+# missing tables, so anything added to an existing table (indexes, columns) goes here.
+# A migration step is either an SQL statement or a function called with the connection.
+# Append new migrations at the end with the next version number, never edit an applied one.
+
+
+def backfill_result_marks(connection, batch_size=5000):
+    # splits the comma joined marks of every Result into one ResultMarks row per subject
+    last_id = 0
+    while True:
+        results = connection.execute(text(
+            'SELECT r.id, r.user_id, r.semester, COALESCE(u.branch, \'\'), r.subjects, r.marks FROM "Result" r '
+            'JOIN "Users" u ON u.id = r.user_id WHERE r.id > :last_id ORDER BY r.id LIMIT :batch_size'),
+            last_id=last_id, batch_size=batch_size).fetchall()
+        if not results:
+            return
+        rows = []
+        for result_id, user_id, semester, branch, subjects, marks in results:
+            rows.extend({'user_id': user_id, 'semester': semester, 'branch': branch, 'subject': subject,
+                         'marks': float(mark)} for subject, mark in zip(subjects.split(','), marks.split(',')))
+        if rows:
+            connection.execute(text('INSERT INTO "ResultMarks" (user_id, semester, branch, subject, marks) '
+                                    'VALUES (:user_id, :semester, :branch, :subject, :marks)'), rows)
+        last_id = results[-1][0]
+
+
+MIGRATIONS = [
+    (1, 'indexes for the hot filter columns', [
+        'CREATE INDEX IF NOT EXISTS ix_notices_branch_date_created ON "Notices" (branch, date_created)',
+        'CREATE INDEX IF NOT EXISTS ix_requests_access_level_time_modified ON "Requests" (access_level, time_modified)',
+        'CREATE INDEX IF NOT EXISTS ix_requests_request_from_time_modified ON "Requests" (request_from, time_modified)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_result_user_id_semester ON "Result" (user_id, semester)',
+    ]),
+    (2, 'per subject marks of existing results', [
+        backfill_result_marks,
+    ]),
+    (3, 'semester ranks and cumulative standings of existing results', [
+        rebuild_standings,
+    ]),
+    (4, 'full text search indexes of notices and requests', [
+        create_search_indexes,
+    ]),
+    (5, 'index for notice delta sync', [
+        'CREATE INDEX IF NOT EXISTS ix_notices_branch_date_modified ON "Notices" (branch, date_modified)',
+    ]),
+]
+
+
+def applied_versions(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS schema_migrations '
+                       '(version INTEGER PRIMARY KEY, name VARCHAR(250), applied_at DATETIME)')
+    return set(row[0] for row in connection.execute('SELECT version FROM schema_migrations'))
+
+
+def pending_migrations(db):
+    # versions of MIGRATIONS not applied yet, read without changing the database
+    with db.engine.connect() as connection:
+        if not db.engine.dialect.has_table(connection, 'schema_migrations'):
+            return [version for version, name, statements in MIGRATIONS]
+        done = set(row[0] for row in connection.execute('SELECT version FROM schema_migrations'))
+    return [version for version, name, statements in MIGRATIONS if version not in done]
+
+
+def run_migrations(db):
+    # creates missing tables, then applies every migration not yet recorded in schema_migrations
+    db.create_all()
+    with db.engine.begin() as connection:
+        done = applied_versions(connection)
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as connection:  # one transaction per migration
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+            connection.execute(text('INSERT INTO schema_migrations (version, name, applied_at) '
+                                    'VALUES (:version, :name, :applied_at)'),
+                               version=version, name=name, applied_at=datetime.datetime.now())
+        applied.append(version)
+        logger.info('Applied migration %d %s', version, name)
+    return applied
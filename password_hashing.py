@@ -0,0 +1,73 @@
+import multiprocessing
+import threading
+
+from passlib.apps import custom_app_context
+
+# Password hashing and verification. A hash takes a few hundred milliseconds of pure CPU, a login or a
+# password change hashes once on the request thread: sending it to another process costs a pickle and
+# a round trip and frees nothing, the request waits for the answer either way. Bulk account creation
+# hashes many passwords in one request and spreads them over a pool of worker processes instead.
+#   PASSWORD_HASH_PROCESSES   worker processes of hash_many, 0 hashes on the calling thread, default all cores
+#   PASSWORD_HASH_ROUNDS      work factor of new hashes, default the passlib default of 656000
+#   PASSWORD_HASH_PENDING     single hashes running at a time before callers block, default 4 per core
+
+contexts = {}  # rounds -> CryptContext, one per process
+
+
+def crypt_context(rounds=None):
+    if rounds is None:
+        return custom_app_context
+    if rounds not in contexts:
+        contexts[rounds] = custom_app_context.copy(
+            sha512_crypt__default_rounds=rounds, sha512_crypt__min_rounds=rounds,
+            sha256_crypt__default_rounds=rounds, sha256_crypt__min_rounds=rounds,
+            admin__sha512_crypt__min_rounds=rounds, admin__sha256_crypt__min_rounds=rounds)
+    return contexts[rounds]
+
+
+def hash_password(args):  # runs in the worker processes of hash_many
+    password, rounds = args
+    return crypt_context(rounds).hash(password)
+
+
+def verify_password(args):
+    password, password_hash = args
+    return custom_app_context.verify(password, password_hash)
+
+
+class PasswordHasher(object):
+
+    def __init__(self, processes=None, rounds=None, max_pending=None):
+        self.processes = multiprocessing.cpu_count() if processes is None else processes
+        self.rounds = rounds
+        self.pending = threading.BoundedSemaphore(max_pending or multiprocessing.cpu_count() * 4)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:  # started on first use, after the app and its threads are set up
+                self.pool = multiprocessing.Pool(self.processes)
+            return self.pool
+
+    def hash(self, password):
+        with self.pending:
+            return hash_password((password, self.rounds))
+
+    def verify(self, password, password_hash):
+        with self.pending:
+            return verify_password((password, password_hash))
+
+    def hash_many(self, passwords):
+        # spread over every worker at once, the pending bound doesn't apply to one call
+        args = [(password, self.rounds) for password in passwords]
+        if self.processes <= 0 or len(args) < 2:
+            return [hash_password(arg) for arg in args]
+        return self.get_pool().map(hash_password, args, chunksize=max(1, len(args) // (self.processes * 4)))
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
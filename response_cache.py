@@ -0,0 +1,125 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend(object):
+    # In-process LRU store bounded by the total size of the cached bodies. Entries carry a tag so that
+    # every entry of a tag can be dropped at once. Another store, e.g. a local cache server, can be
+    # plugged into ResponseCache by implementing get, set, invalidate and stats the same way.
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (body, etag, tag, expires_at)
+        self.tags = {}  # tag -> set of keys
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] is not None and entry[3] < time.time():
+                self.remove(key)
+                return None
+            del self.entries[key]
+            self.entries[key] = entry
+            return entry[0], entry[1]
+
+    def set(self, key, body, etag, tag, ttl=None):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (body, etag, tag, time.time() + ttl if ttl else None)
+            self.tags.setdefault(tag, set()).add(key)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):  # the caller holds the lock
+        body, etag, tag, expires_at = self.entries.pop(key)
+        self.bytes -= len(body)
+        keys = self.tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def invalidate(self, tag):
+        with self.lock:
+            keys = list(self.tags.get(tag, ()))
+            for key in keys:
+                self.remove(key)
+        return len(keys)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
+
+
+class ResponseCache(object):
+    # Read-through cache of serialized response bodies with their ETag. Every tag has a generation bumped
+    # by invalidate: a body whose tag was invalidated while it was being built is returned but not stored,
+    # it may have been read before the change that invalidated it.
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.generations = {}  # tag -> number of invalidations
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def etag(body):
+        return hashlib.md5(body).hexdigest()
+
+    def get_or_build(self, key, tag, build):
+        # returns (body, etag) from the cache, or from build() which returns the body or None when
+        # the response must not be cached
+        entry = self.backend.get(key) if self.enabled else None
+        with self.lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            generation = self.generations.get(tag, 0)
+        if entry is not None:
+            return entry
+        body = build()
+        if body is None:
+            return None
+        etag = self.etag(body)
+        with self.lock:  # checked and stored together, an invalidate either comes before or removes the entry
+            if self.enabled and self.generations.get(tag, 0) == generation:
+                self.backend.set(key, body, etag, tag, self.ttl)
+        return body, etag
+
+    def invalidate(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            return self.backend.invalidate(tag)
+
+    def stats(self):
+        stats = self.backend.stats()
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats.update({
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'ttl': self.ttl
+            })
+        return stats
@@ -0,0 +1,85 @@
+import json
+
+from sqlalchemy import text
+
+# Results of a branch for a range of semesters as CSV or NDJSON, one line per student and semester,
+# student by student. Rows are read from a server side cursor `batch_size` at a time and every batch
+# is encoded and handed on before the next is read, so memory doesn't grow with the number of students.
+# The query walks the users in id order and finds their results through the (user_id, semester)
+# index, the database doesn't have to sort the export either.
+#   CSV     user_id, roll_number, name, semester, total, one column per subject code of the
+#           semesters (the catalog's order), other_subjects for codes no longer in the catalog
+#   NDJSON  {"user_id", "roll_number", "name", "semester", "total", "marks": {code: mark}}
+
+COLUMNS = ('user_id', 'roll_number', 'name', 'semester', 'total')
+
+
+def export_rows(connection, branch, first, last, batch_size=1000):
+    # lists of (user_id, roll_number, name, semester, total, subjects, marks) rows
+    result = connection.execution_options(stream_results=True).execute(text(
+        'SELECT u.id, u.roll_number, u.name, r.semester, r.total, r.subjects, r.marks FROM "Users" u '
+        'JOIN "Result" r ON r.user_id = u.id WHERE u.branch = :branch AND r.semester BETWEEN :first AND :last '
+        'ORDER BY u.id, r.semester'), branch=branch, first=first, last=last)
+    try:
+        while True:
+            rows = result.cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        result.close()
+
+
+def csv_field(value):
+    if value is None:
+        return ''
+    value = u'%s' % value
+    if any(character in value for character in ',"\r\n'):
+        return u'"%s"' % value.replace('"', '""')
+    return value
+
+
+def csv_chunks(batches, subject_columns):
+    # (text, number of rows) of the header and of every batch
+    subject_columns = list(subject_columns)
+    position = dict((code, i) for i, code in enumerate(subject_columns))
+    yield u','.join(list(COLUMNS) + subject_columns + ['other_subjects']) + u'\n', 0
+    for rows in batches:
+        lines = []
+        for user_id, roll_number, name, semester, total, subjects, marks in rows:
+            cells = [u''] * len(subject_columns)
+            other = []
+            for code, mark in zip(subjects.split(','), marks.split(',')):
+                i = position.get(code)
+                if i is None:
+                    other.append(u'%s:%s' % (code, mark))
+                else:
+                    cells[i] = mark
+            lines.append(u','.join([u'%d' % user_id, csv_field(roll_number), csv_field(name), u'%d' % semester,
+                                    csv_field(total)] + cells + [u';'.join(other)]))
+        yield u'\n'.join(lines) + u'\n', len(rows)
+
+
+def ndjson_chunks(batches):
+    # the lines are put together from pieces encoded once: the subject names of a semester are the same
+    # for every student, and an OrderedDict per row makes json.dumps several times slower
+    keys = {}  # subjects as stored -> their JSON strings
+    for rows in batches:
+        lines = []
+        for user_id, roll_number, name, semester, total, subjects, marks in rows:
+            if subjects not in keys:
+                keys[subjects] = [json.dumps(code) for code in subjects.split(',')]
+            lines.append(u'{"user_id": %d, "roll_number": %s, "name": %s, "semester": %d, "total": %s, '
+                         u'"marks": {%s}}' % (
+                             user_id, json.dumps(roll_number), json.dumps(name), semester, json.dumps(total),
+                             u', '.join(u'%s: %r' % (key, float(mark))
+                                        for key, mark in zip(keys[subjects], marks.split(',')))))
+        yield u'\n'.join(lines) + u'\n', len(rows)
+
+
+def export_chunks(connection, branch, first, last, export_format, subject_columns=(), batch_size=1000):
+    # (text, number of rows) of the whole export
+    batches = export_rows(connection, branch, first, last, batch_size)
+    if export_format == 'csv':
+        return csv_chunks(batches, subject_columns)
+    return ndjson_chunks(batches)
@@ -0,0 +1,66 @@
+import multiprocessing
+
+try:
+    import numpy as np
+except ImportError:  # random results can only be generated with NumPy
+    np = None
+
+# Random results for test campuses. The marks of a semester are drawn as one (students x subjects)
+# array instead of one number at a time, from a generator seeded with (seed, semester): the same seed
+# gives the same results however many processes share the work and in whatever order they finish.
+# Semesters are generated in parallel by `processes` worker processes, 0 or 1 generates them on the calling thread.
+# The marks go to <semester>.txt in the format read by insert_result, or are returned as arrays for
+# insert_result_records to write to the database without a file.
+
+LOW_MARK = 1
+HIGH_MARK = 100
+
+
+def generate_marks(num, subjects, semester, seed=None):
+    # (num x subjects) integer marks of one semester
+    if np is None:
+        raise RuntimeError('NumPy is required to generate results')
+    state = np.random.RandomState(None if seed is None else [seed, semester])
+    return state.randint(LOW_MARK, HIGH_MARK + 1, size=(num, subjects))
+
+
+def result_lines(user_ids, marks):
+    # 'user_id,mark,...' text of the rows. Marks are small integers, so their strings are looked up in
+    # a table and only joined per row, formatting every number is the slow part of writing the file.
+    if not len(user_ids):
+        return ''
+    strings = np.array([str(mark) for mark in range(HIGH_MARK + 1)], dtype=object)
+    ids = np.asarray(user_ids, dtype=np.int64).astype(str).astype(object)
+    return '\n'.join(map(','.join, np.column_stack((ids, strings[marks])).tolist())) + '\n'
+
+
+def generate_semester(args):  # runs in the worker processes
+    # the marks of the students of every branch group of one semester, written to `path` when given
+    semester, groups, seed, path = args
+    marks = [(user_ids, generate_marks(len(user_ids), subjects, semester, seed)) for user_ids, subjects in groups]
+    if path is None:
+        return semester, marks
+    with open(path, 'w') as f:
+        for user_ids, semester_marks in marks:
+            for start in range(0, len(user_ids), 100000):  # the text of 100000 students at a time
+                f.write(result_lines(user_ids[start:start + 100000], semester_marks[start:start + 100000]))
+    return semester, sum(len(user_ids) for user_ids, semester_marks in marks)
+
+
+def generate_results(semesters, groups, seed=None, processes=0, path_format=None):
+    # Yields (semester, result) for every semester as it is generated. groups is
+    # {semester: [(student ids, number of subjects)]}, students with the same number of subjects share
+    # one array. With path_format ('%s.txt') the result is the number of lines written, else the arrays.
+    args = [(semester, groups[semester], seed, path_format % semester if path_format else None)
+            for semester in semesters]
+    if processes <= 1 or len(args) < 2:
+        for arg in args:
+            yield generate_semester(arg)
+        return
+    pool = multiprocessing.Pool(min(processes, len(args)))
+    try:
+        for result in pool.imap(generate_semester, args):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
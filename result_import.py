@@ -0,0 +1,116 @@
+import collections
+import mmap
+import multiprocessing
+import os
+
+# Reads large result files ('user_id,mark,...' lines) for insert_result_records. The file is memory
+# mapped and cut into chunks of about `chunk_bytes` at line ends; the chunks are parsed by a pool of
+# worker processes, each mapping the file itself, so only offsets travel to the workers. At most
+# `max_pending` chunks are being parsed or waiting for the writer at a time: the parser never runs
+# further ahead of the database than that, and memory stays flat however large the file is.
+# Records come out in file order with their line numbers.
+
+MAX_MARK = 100
+
+
+def parse_line(line, max_mark=MAX_MARK):
+    # (user id, marks as written, [marks]) of one line, or the reason it can't be read
+    x = line.rstrip('\r').split(',')
+    try:
+        user_id = int(x[0])
+        marks = [float(mark) for mark in x[1:]]
+    except ValueError:
+        return 'Malformed line'
+    if not marks:
+        return 'Malformed line'
+    if not all(0 <= mark <= max_mark for mark in marks):
+        return 'Marks must be between 0 and %g' % max_mark
+    return user_id, ','.join(x[1:]), marks
+
+
+def parse_lines(lines, first_line_number=1, max_mark=MAX_MARK):
+    # the records of insert_result_records: (line number, user id, marks as written, [marks]),
+    # or (line number, None, reason, None)
+    for line_number, line in enumerate(lines, first_line_number):
+        parsed = parse_line(line, max_mark)
+        if isinstance(parsed, tuple):
+            yield (line_number,) + parsed
+        else:
+            yield line_number, None, parsed, None
+
+
+def chunk_offsets(path, chunk_bytes):
+    # [(start, end)] byte ranges of the file, every range ends after a newline or at the end of the file
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    offsets = []
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = mapped.find(b'\n', min(start + chunk_bytes, size) - 1)
+                end = size if end == -1 else end + 1
+                offsets.append((start, end))
+                start = end
+        finally:
+            mapped.close()
+    return offsets
+
+
+def chunk_lines(path, start, end):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            text = mapped[start:end]
+        finally:
+            mapped.close()
+    if not isinstance(text, str):  # Python 3
+        text = text.decode('utf-8', 'replace')
+    lines = text.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()  # the chunk ends with a newline
+    return lines
+
+
+def parse_chunk(args):  # runs in the worker processes
+    # (number of lines, records with line numbers counted from 1 within the chunk) of one byte range
+    path, start, end, max_mark = args
+    lines = chunk_lines(path, start, end)
+    return len(lines), list(parse_lines(lines, max_mark=max_mark))
+
+
+def read_records(path, processes=None, chunk_bytes=1024 * 1024, max_pending=None, max_mark=MAX_MARK,
+                 stats=None):
+    # Yields the records of the file in order. `stats`, a dict, receives the lines and bytes read.
+    processes = multiprocessing.cpu_count() if processes is None else processes
+    max_pending = max_pending or max(2, processes * 2)
+    chunks = collections.deque((path, start, end, max_mark) for start, end in chunk_offsets(path, chunk_bytes))
+    if stats is not None:
+        stats.update({'lines': 0, 'bytes': sum(chunk[2] - chunk[1] for chunk in chunks), 'chunks': len(chunks)})
+    line_number = 0
+    if processes <= 1 or len(chunks) < 2:  # parsed on this thread as the writer asks for the records
+        for path, start, end, max_mark in chunks:
+            lines = chunk_lines(path, start, end)
+            for record in parse_lines(lines, line_number + 1, max_mark):
+                yield record
+            line_number += len(lines)
+            if stats is not None:
+                stats['lines'] = line_number
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        while chunks or pending:
+            while chunks and len(pending) < max_pending:
+                pending.append(pool.apply_async(parse_chunk, (chunks.popleft(),)))
+            lines, records = pending.popleft().get()
+            for record in records:
+                yield (line_number + record[0],) + record[1:]
+            line_number += lines
+            if stats is not None:
+                stats['lines'] = line_number
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,14 +1,175 @@
-import subprocess
+import argparse
+import csv
+import json
+import multiprocessing
+import shlex
+import time
 
+from app import app, db, User, Notice, ApplicationRequests, check_schema
+from password_hashing import PasswordHasher
 
-def insert_sample_data():
-    f = open('sample_data', 'r')
+# Loads users, notices and requests straight into the database instead of calling the API once per row.
+# The manifest is one of
+#   - a JSON file: {"users": [...], "notices": [...], "requests": [...]}
+#   - a CSV file with a "kind" column (user, notice or request) and one column per field
+#   - a file of create_users, create_notice and create_request curl commands like sample_data
+# Users take the fields of /api/students/create_users. Notices take title, content, branch,
+# attachment_url and created_by (a username), requests take title, content, request_type,
+# attachment_url and request_from (a username). Rows already in the database are skipped, so the
+# loader can be run again with the same manifest.
+
+
+def read_manifest(path):
+    manifest = {'users': [], 'notices': [], 'requests': []}
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+        for kind in manifest:
+            manifest[kind] = data.get(kind, [])
+    elif path.endswith('.csv'):
+        kinds = {'user': 'users', 'notice': 'notices', 'request': 'requests'}
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                kind = kinds.get(row.pop('kind', None))
+                if kind is not None:
+                    manifest[kind].append(dict((key, value) for key, value in row.items() if value != ''))
+    else:
+        endpoints = {'/api/students/create_users': ('users', None),
+                     '/api/notice/create_notice': ('notices', 'created_by'),
+                     '/api/requests/create_request': ('requests', 'request_from')}
+        with open(path) as f:
+            for line in f:
+                args = shlex.split(line)
+                for endpoint, (kind, user_field) in endpoints.items():
+                    if '-d' in args and args[-1].endswith(endpoint):
+                        row = json.loads(args[args.index('-d') + 1])
+                        if user_field is not None and '-u' in args:  # the user making the call
+                            row[user_field] = args[args.index('-u') + 1].split(':')[0]
+                        manifest[kind].append(row)
+    return manifest
+
+
+def batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def save(objects, batch_size):  # one transaction per batch
+    for batch in batches(objects, batch_size):
+        db.session.bulk_save_objects(batch)
+        db.session.commit()
+
+
+def load_users(rows, batch_size, processes):
+    report = {'inserted': 0, 'skipped': 0, 'rejected': 0}
+    usernames = set(username for (username,) in db.session.query(User.username))
+    emails = set(email for (email,) in db.session.query(User.email))
+    new_rows = []
+    for row in rows:
+        try:
+            access_level = int(row.get('user_access_level', 1))
+        except (TypeError, ValueError):  # blank in a CSV file, null in a JSON one
+            access_level = 0
+        if not row.get('username') or not row.get('password') or not row.get('name') or not row.get('email') \
+                or access_level > 5 or access_level < 1:
+            report['rejected'] += 1
+            continue
+        if row['username'] in usernames or row['email'] in emails:
+            report['skipped'] += 1
+            continue
+        usernames.add(row['username'])
+        emails.add(row['email'])
+        new_rows.append((row, access_level))
+
+    hasher = PasswordHasher(processes=processes if processes > 1 else 0, rounds=app.config['PASSWORD_HASH_ROUNDS'])
+    try:
+        hashes = hasher.hash_many([row['password'] for row, access_level in new_rows])
+    finally:
+        hasher.close()
+
+    users = []
+    for (row, access_level), password_hash in zip(new_rows, hashes):
+        user = User(username=row['username'], password=None, email=row['email'], name=row['name'],
+                    rollno=row.get('roll_number'), user_access_level=access_level,
+                    password_hash=password_hash)
+        user.branch = row.get('branch')
+        users.append(user)
+    save(users, batch_size)
+    report['inserted'] = len(users)
+    return report
+
+
+def load_notices(rows, batch_size):
+    report = {'inserted': 0, 'skipped': 0, 'rejected': 0}
+    creators = dict((user.username, user) for user in
+                    User.query.filter(User.username.in_(set(row.get('created_by') for row in rows))))
+    present = set(db.session.query(Notice.title, Notice.branch, Notice.created_by))
+    notices = []
+    for row in rows:
+        user = creators.get(row.get('created_by'))
+        if user is None or not row.get('title') or not row.get('branch') or not row.get('content'):
+            report['rejected'] += 1
+            continue
+        key = (row['title'], row['branch'], user.id)
+        if key in present:
+            report['skipped'] += 1
+            continue
+        present.add(key)
+        notices.append(Notice(title=row['title'], content=row['content'], branch=row['branch'], user=user,
+                              attachment_url=row.get('attachment_url')))
+    save(notices, batch_size)
+    report['inserted'] = len(notices)
+    return report
+
+
+def load_requests(rows, batch_size):
+    report = {'inserted': 0, 'skipped': 0, 'rejected': 0}
+    senders = dict(db.session.query(User.username, User.id)
+                   .filter(User.username.in_(set(row.get('request_from') for row in rows))))
+    present = set(db.session.query(ApplicationRequests.request_from, ApplicationRequests.title))
+    requests = []
+    for row in rows:
+        user_id = senders.get(row.get('request_from'))
+        try:
+            request_type = int(row.get('request_type'))
+        except (TypeError, ValueError):  # missing, blank or not a number
+            request_type = None
+        if user_id is None or not row.get('title') or request_type is None:
+            report['rejected'] += 1
+            continue
+        if (user_id, row['title']) in present:
+            report['skipped'] += 1
+            continue
+        present.add((user_id, row['title']))
+        requests.append(ApplicationRequests(user_id, request_type, row['title'], row.get('content'),
+                                            row.get('attachment_url')))
+    save(requests, batch_size)
+    report['inserted'] = len(requests)
+    return report
+
+
+def insert_sample_data(path='sample_data', batch_size=1000, processes=None):
+    processes = processes or multiprocessing.cpu_count()
+    manifest = read_manifest(path)
+    reports = {}
+    for kind, load in (('users', lambda rows: load_users(rows, batch_size, processes)),
+                       ('notices', lambda rows: load_notices(rows, batch_size)),
+                       ('requests', lambda rows: load_requests(rows, batch_size))):
+        start = time.time()
+        report = load(manifest[kind])
+        elapsed = time.time() - start
+        report['rows_per_sec'] = report['inserted'] / elapsed if elapsed else 0.0
+        reports[kind] = report
+        print('%-8s: %6d inserted %6d skipped %4d rejected %10.1f rows/sec' % (
+            kind, report['inserted'], report['skipped'], report['rejected'], report['rows_per_sec']))
+    return reports
 
-    i = 1
-    for line in f:
-        returned_value = subprocess.call(line, shell=True)
-        print("Line number: "+str(i)+" Returned Value: "+str(returned_value)+"\n")
-        i += 1
 
 if __name__ == '__main__':
-    insert_sample_data()
+    parser = argparse.ArgumentParser(description='Bulk load users, notices and requests into the database')
+    parser.add_argument('manifest', nargs='?', default='sample_data', help='JSON, CSV or curl file, default sample_data')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per transaction')
+    parser.add_argument('--processes', type=int, default=None, help='password hashing processes, default all cores')
+    args = parser.parse_args()
+    check_schema()
+    insert_sample_data(args.manifest, batch_size=args.batch_size, processes=args.processes)
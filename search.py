@@ -0,0 +1,98 @@
+import re
+
+from sqlalchemy import text
+
+# Full text search over notices and requests with SQLite FTS5. The indexes are external content
+# tables over "Notices" and "Requests": they store only the inverted index and read the text from
+# the tables, and triggers keep them in step with every INSERT, UPDATE and DELETE, including the
+# bulk loaders that bypass the ORM. The filter columns (branch, request_from, access_level) are
+# indexed too so that filtering happens inside the MATCH, before ranking.
+# Search needs SQLite built with FTS5; on other databases search_ids isn't used and search falls back to LIKE.
+
+SEARCH_INDEXES = {
+    # name: (table, text columns, filter columns)
+    'notices_fts': ('Notices', ('title', 'content'), ('branch',)),
+    'requests_fts': ('Requests', ('title', 'content'), ('request_from', 'access_level')),
+}
+TITLE_WEIGHT = 10.0  # a term in the title counts as much as ten in the content
+
+
+def search_supported(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    return any(option == 'ENABLE_FTS5' for (option,) in connection.execute('PRAGMA compile_options'))
+
+
+def has_search_index(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    return connection.execute(text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN "
+                                   "('notices_fts', 'requests_fts')")).scalar() == len(SEARCH_INDEXES)
+
+
+def create_search_indexes(connection):
+    # the index tables, their triggers and the index of the rows already present
+    if not search_supported(connection):
+        return
+    for name, (table, text_columns, filter_columns) in sorted(SEARCH_INDEXES.items()):
+        columns = text_columns + filter_columns
+        names = ', '.join(columns)
+        new = ', '.join('new.' + column for column in columns)
+        old = ', '.join('old.' + column for column in columns)
+        connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content=\'%s\', content_rowid=\'id\')'
+                           % (name, names, table))
+        connection.execute('CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON "%s" BEGIN '
+                           'INSERT INTO %s (rowid, %s) VALUES (new.id, %s); END' % (name, table, name, names, new))
+        connection.execute('CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON "%s" BEGIN '
+                           'INSERT INTO %s (%s, rowid, %s) VALUES (\'delete\', old.id, %s); END'
+                           % (name, table, name, name, names, old))
+        connection.execute('CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF %s ON "%s" BEGIN '
+                           'INSERT INTO %s (%s, rowid, %s) VALUES (\'delete\', old.id, %s); '
+                           'INSERT INTO %s (rowid, %s) VALUES (new.id, %s); END'
+                           % (name, names, table, name, name, names, old, name, names, new))
+        connection.execute('INSERT INTO %s (%s) VALUES (\'rebuild\')' % (name, name))
+
+
+def search_terms(query):
+    # the words of a user query, at most 20, as (word, prefix) where prefix is True for a word ending in *
+    return [(word, star == '*') for word, star in re.findall(r'(\w+)(\*?)', query, re.UNICODE)[:20]]
+
+
+def match_expression(terms, filters):
+    # every term must appear in a text column, filters are (column, value) pairs matched exactly.
+    # Prefix terms merge the row lists of every word they match, so they are only used when asked for.
+    quoted = ['"%s"%s' % (word, '*' if prefix else '') for word, prefix in terms]
+    expression = '{title content} : (%s)' % ' AND '.join(quoted)
+    for column, value in filters:
+        expression += ' AND %s : "%s"' % (column, (u'%s' % value).replace('"', '""'))
+    return expression
+
+
+def search_ids(connection, index, terms, filters, limit, after=None, max_ranked=10000):
+    # ([(row id, score)], ranking). bm25 has to score every match before the first page is known, so a
+    # query matching more than max_ranked rows (a very common word) is answered newest first instead,
+    # which reads the index in row id order and stops after the page. A lower bm25 score is a better match.
+    # after, (ranking, score, row id) of the last row of the previous page, continues that page's order
+    # from that row on without an OFFSET: rows added or deleted meanwhile don't shift the pages. (bm25 scores
+    # do move a little with the number of rows containing a term, a row near a page boundary can still be
+    # sent twice or skipped while relevance pages are read during writes.)
+    match = match_expression(terms, filters)
+    if after is not None:
+        ranking, after_score, after_id = after
+    else:
+        matches = connection.execute(text('SELECT COUNT(*) FROM (SELECT rowid FROM %s WHERE %s MATCH :match '
+                                          'LIMIT :cap)' % (index, index)), match=match, cap=max_ranked + 1).scalar()
+        ranking, after_score, after_id = 'newest' if matches > max_ranked else 'relevance', None, None
+    if ranking == 'newest':
+        rows = connection.execute(text('SELECT rowid, 0.0 FROM %s WHERE %s MATCH :match%s ORDER BY rowid DESC '
+                                       'LIMIT :limit' % (index, index, '' if after_id is None else
+                                                         ' AND rowid < :after_id')),
+                                  match=match, limit=limit, after_id=after_id)
+        return [(row_id, score) for row_id, score in rows], ranking
+    weights = ', '.join(['%r' % TITLE_WEIGHT, '1.0'] + ['0.0'] * len(SEARCH_INDEXES[index][2]))
+    rows = connection.execute(text('SELECT rowid, score FROM (SELECT rowid, bm25(%s, %s) AS score FROM %s WHERE %s '
+                                   'MATCH :match)%s ORDER BY score, rowid LIMIT :limit' % (
+                                       index, weights, index, index, '' if after_id is None else
+                                       ' WHERE score > :after_score OR (score = :after_score AND rowid > :after_id)')),
+                              match=match, limit=limit, after_score=after_score, after_id=after_id)
+    return [(row_id, score) for row_id, score in rows], ranking
@@ -0,0 +1,152 @@
+import json
+import operator
+
+from sqlalchemy import DateTime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Serializers of the list endpoints. A ModelFields names the fields of a model's get_json and the column
+# each is read from; a request's fields= picks some of them. Only the columns of the picked fields (and
+# the columns the list is paged by) are selected in SQL, the rows come back as plain tuples instead of
+# ORM objects and are turned into dicts by a function built once per field list. Dates are written the
+# way Flask's JSON encoder writes them (HTTP dates), so the payloads are the ones of get_json and need
+# no encoder hook: the JSON library is picked with JSON_ENCODER (orjson, ujson, json, auto).
+#   fields  a list or a comma separated string, "request_from.name" picks one field of a nested object
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    # werkzeug's http_date of a naive datetime, as flask.jsonify writes it
+    if value is None:
+        return None
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1],
+                                                  value.year, value.hour, value.minute, value.second)
+
+
+def json_encoder(name='auto'):
+    # a function writing a value as compact JSON text, with the fastest installed library for 'auto'
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise ImportError('orjson is not installed')
+        return lambda value: orjson.dumps(value).decode('utf-8')
+    if name == 'ujson':
+        if ujson is None:
+            raise ImportError('ujson is not installed')
+        return lambda value: ujson.dumps(value, escape_forward_slashes=False)
+    if name == 'json':
+        return json.JSONEncoder(separators=(',', ':')).encode
+    raise ValueError('Unknown JSON encoder %s' % name)
+
+
+def parse_fields(fields):
+    # the field names of a fields= value, None for every field
+    if fields is None:
+        return None
+    if not isinstance(fields, list):
+        fields = str(fields).split(',')
+    names = [str(name).strip() for name in fields if str(name).strip()]
+    if not names:
+        raise ValueError('fields is empty')
+    return names
+
+
+class ModelFields(object):
+
+    def __init__(self, fields, keys=(), nested=None):
+        # fields: [(name, column)] in the order of get_json, keys: the columns always selected to page the
+        # list by, nested: {name: (ModelFields, model, join condition)} of objects sent inside a row
+        self.fields = list(fields)
+        self.columns = dict(self.fields)
+        self.keys = keys
+        self.nested = nested or {}
+        self.names = [name for name, column in self.fields] + [name for name in self.nested]
+        self.serializers = {}  # tuple of field names -> Serializer, built on first use
+
+    def serializer(self, fields=None):
+        names = parse_fields(fields)
+        key = None if names is None else tuple(names)
+        serializer = self.serializers.get(key)
+        if serializer is None:
+            serializer = Serializer(self, names)
+            if len(self.serializers) < 256:  # clients choose the lists, don't keep every one of them
+                self.serializers[key] = serializer
+        return serializer
+
+
+class Serializer(object):
+    # the columns and the row -> dict function of one field list
+
+    def __init__(self, model_fields, names=None):
+        self.names = list(names or model_fields.names)
+        picked = {}  # name -> None for the whole field, or the names picked from a nested object
+        for name in self.names:
+            name, _, subfield = name.partition('.')
+            if name not in model_fields.names or (subfield and name not in model_fields.nested):
+                raise ValueError('Unknown field %s' % name)
+            if subfield:
+                if picked.get(name, ()) is not None:
+                    picked.setdefault(name, []).append(subfield)
+            else:
+                picked[name] = None
+        self.columns = []  # labelled columns of the SELECT
+        self.joins = []
+        labels = {}
+
+        def select(column, label):
+            if label not in labels:
+                labels[label] = len(self.columns)
+                self.columns.append(column.label(label))
+            return labels[label]
+
+        for column in model_fields.keys:
+            select(column, column.key)
+        flat = [(name, select(column, column.key), isinstance(column.type, DateTime))
+                for name, column in model_fields.fields if name in picked]
+        nested = []
+        for name, (fields, model, condition) in model_fields.nested.items():
+            if name not in picked:
+                continue
+            subnames = picked[name] or fields.names
+            for subname in subnames:
+                if subname not in fields.columns:
+                    raise ValueError('Unknown field %s.%s' % (name, subname))
+            nested.append((name, [(subname, select(fields.columns[subname], name + '_' + fields.columns[subname].key))
+                                  for subname in subnames]))
+            self.joins.append((model, condition))
+        self.keys = [name for name, index, date in flat]
+        self.pick = operator.itemgetter(*[index for name, index, date in flat]) if flat else None
+        self.dates = [name for name, index, date in flat if date]
+        self.nested = [(name, [subname for subname, index in subfields],
+                        operator.itemgetter(*[index for subname, index in subfields]))
+                       for name, subfields in nested]
+
+    def select(self, query):
+        # the query with only the columns of the fields selected
+        query = query.with_entities(*self.columns)
+        for model, condition in self.joins:
+            query = query.outerjoin(model, condition)
+        return query
+
+    def __call__(self, row):
+        if self.pick is None:
+            data = {}
+        elif len(self.keys) == 1:
+            data = {self.keys[0]: self.pick(row)}
+        else:
+            data = dict(zip(self.keys, self.pick(row)))
+        for name in self.dates:
+            data[name] = http_date(data[name])
+        for name, keys, pick in self.nested:
+            data[name] = dict(zip(keys, pick(row))) if len(keys) > 1 else {keys[0]: pick(row)}
+        return data
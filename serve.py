@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import threading
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from app import app, db, check_schema
+
+# Production entry point, `python serve.py`, instead of the development server of `python app.py`.
+# Served by gunicorn with threaded workers when it is installed, else by werkzeug answering requests
+# on a fixed pool of threads. Settings read from the environment:
+#   HOST          default 0.0.0.0
+#   PORT          default 5000
+#   WEB_WORKERS   processes, default 1. Background jobs, the credential cache and the response cache
+#                 live in one process, so with more than one worker a job can only be followed
+#                 (/api/jobs/status) through the worker that started it. Needs gunicorn.
+#   WEB_THREADS   threads per process, default 16. Password hashing runs in the hashing processes
+#                 (see password_hashing.py) and SQLite releases the interpreter lock while it works,
+#                 so one slow request doesn't hold up the other threads.
+#   WEB_TIMEOUT   seconds gunicorn lets a request run before restarting the worker, default 120
+# Every request gets its own database session (Flask-SQLAlchemy scopes sessions to the application
+# context, removed at the end of the request) and its own flask.g, so g.user is per request.
+
+
+def settings(environ):
+    return {
+        'host': environ.get('HOST', '0.0.0.0'),
+        'port': int(environ.get('PORT', 5000)),
+        'workers': int(environ.get('WEB_WORKERS', 1)),
+        'threads': int(environ.get('WEB_THREADS', 16)),
+        'timeout': int(environ.get('WEB_TIMEOUT', 120))
+    }
+
+
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    # werkzeug's server answering on a fixed number of threads, requests wait in a queue when all are busy
+
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads=16, **kwargs):
+        BaseWSGIServer.__init__(self, host, port, wsgi_app, **kwargs)
+        self.requests = Queue()
+        for _ in range(threads):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):  # called by the accepting thread
+        self.requests.put((request, client_address))
+
+    def work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def make_server(host, port, threads, request_handler=WSGIRequestHandler):
+    return ThreadPoolWSGIServer(host, port, app, threads=threads, handler=request_handler)
+
+
+def post_fork(server, worker):
+    # connections opened by the master (check_schema) must not be shared by workers
+    with app.app_context():
+        db.engine.dispose()
+
+
+def run_gunicorn(config):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '%s:%d' % (config['host'], config['port']))
+            self.cfg.set('workers', config['workers'])
+            self.cfg.set('threads', config['threads'])
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', config['timeout'])
+            # app.py is imported and the schema checked once, in the master; the workers share the imported
+            # modules and the SECRET_KEY drawn when none is set
+            self.cfg.set('preload_app', True)
+            self.cfg.set('post_fork', post_fork)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def main():
+    config = settings(os.environ)
+    check_schema()  # the schema is migrated by `flask migrate`, not by starting a server
+    try:
+        import gunicorn
+    except ImportError:
+        gunicorn = None
+    if gunicorn is not None:
+        run_gunicorn(config)
+        return
+    if config['workers'] > 1:
+        print('gunicorn is not installed, serving from 1 process instead of %d' % config['workers'])
+    print('Serving on http://%s:%d with %d threads (%d cores)' % (
+        config['host'], config['port'], config['threads'], multiprocessing.cpu_count()))
+    make_server(config['host'], config['port'], config['threads']).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+from sqlalchemy import bindparam, text
+
+# Precomputed ranks, so rank questions are answered with an index lookup instead of loading every Result.
+#   SemesterRanks     one row per Result: the student's branch, the semester total and its rank among
+#                     the students of the branch in that semester
+#   StudentStandings  one row per student: the cumulative average of their semester totals and its rank
+#                     in the branch
+# insert_result calls add_results() in the transaction of every chunk it writes and rerank() once per
+# touched branch and semester at the end. Equal scores share a rank (1, 2, 2, 4).
+# check_standings() recomputes both tables from Result and reports the rows that differ,
+# rebuild_standings() replaces them with the recomputed rows.
+
+IN_BATCH_SIZE = 500  # ids per IN list, SQLite allows 999 parameters per statement
+
+
+def competition_ranks(scores):
+    # ranks of scores sorted from highest to lowest, equal scores share the better rank
+    ranks = []
+    for i, score in enumerate(scores):
+        if i and score == scores[i - 1]:
+            ranks.append(ranks[-1])
+        else:
+            ranks.append(i + 1)
+    return ranks
+
+
+def cumulative_average(total_sum, semesters):
+    # rounded so that sums added in a different order compare and rank the same
+    return round(total_sum / semesters, 6)
+
+
+def add_results(connection, rows):
+    # rows of {'user_id', 'semester', 'branch', 'total'} just written to Result, ranks are set by rerank()
+    if not rows:
+        return
+    connection.execute(text('INSERT INTO "SemesterRanks" (user_id, branch, semester, total) '
+                            'VALUES (:user_id, :branch, :semester, :total)'), rows)
+    user_ids = list(set(row['user_id'] for row in rows))
+    existing = {}
+    select = text('SELECT user_id, semesters, total_sum FROM "StudentStandings" WHERE user_id IN :user_ids') \
+        .bindparams(bindparam('user_ids', expanding=True))
+    for start in range(0, len(user_ids), IN_BATCH_SIZE):
+        batch = user_ids[start:start + IN_BATCH_SIZE]
+        for user_id, semesters, total_sum in connection.execute(select, user_ids=batch):
+            existing[user_id] = {'user_id': user_id, 'semesters': semesters, 'total_sum': total_sum}
+    added = {}
+    for row in rows:
+        standing = existing.get(row['user_id']) or added.setdefault(row['user_id'], {
+            'user_id': row['user_id'], 'branch': row['branch'], 'semesters': 0, 'total_sum': 0.0})
+        standing['semesters'] += 1
+        standing['total_sum'] += row['total']
+    for standing in list(existing.values()) + list(added.values()):
+        standing['cumulative_average'] = cumulative_average(standing['total_sum'], standing['semesters'])
+    if existing:
+        connection.execute(text('UPDATE "StudentStandings" SET semesters = :semesters, total_sum = :total_sum, '
+                                'cumulative_average = :cumulative_average WHERE user_id = :user_id'),
+                           list(existing.values()))
+    if added:
+        connection.execute(text('INSERT INTO "StudentStandings" (user_id, branch, semesters, total_sum, '
+                                'cumulative_average) VALUES (:user_id, :branch, :semesters, :total_sum, '
+                                ':cumulative_average)'), list(added.values()))
+
+
+def rerank(connection, branch, semester=None):
+    # ranks of one branch and semester, or the cumulative ranks of a branch without a semester.
+    # Only the rows whose rank changed are written, returns their number.
+    if semester is None:
+        rows = connection.execute(text('SELECT user_id, cumulative_average, class_rank FROM "StudentStandings" '
+                                       'WHERE branch = :branch ORDER BY cumulative_average DESC, user_id'),
+                                  branch=branch).fetchall()
+        update = 'UPDATE "StudentStandings" SET class_rank = :class_rank WHERE user_id = :key'
+    else:
+        rows = connection.execute(text('SELECT id, total, class_rank FROM "SemesterRanks" WHERE branch = :branch '
+                                       'AND semester = :semester ORDER BY total DESC, user_id'),
+                                  branch=branch, semester=semester).fetchall()
+        update = 'UPDATE "SemesterRanks" SET class_rank = :class_rank WHERE id = :key'
+    ranks = competition_ranks([row[1] for row in rows])
+    changes = [{'key': row[0], 'class_rank': rank} for row, rank in zip(rows, ranks) if row[2] != rank]
+    if changes:
+        connection.execute(text(update), changes)
+    return len(changes)
+
+
+def compute_standings(connection):
+    # both tables recomputed from Result: {(user_id, semester): row} and {user_id: row}
+    groups = {}
+    students = {}
+    for user_id, semester, branch, total in connection.execute(text(
+            'SELECT r.user_id, r.semester, COALESCE(u.branch, \'\'), r.total FROM "Result" r '
+            'JOIN "Users" u ON u.id = r.user_id')):
+        groups.setdefault((branch, semester), []).append((total, user_id))
+        student = students.setdefault(user_id, {'user_id': user_id, 'branch': branch, 'semesters': 0,
+                                                'total_sum': 0.0})
+        student['semesters'] += 1
+        student['total_sum'] += total
+
+    semester_ranks = {}
+    for (branch, semester), totals in groups.items():
+        totals.sort(key=lambda row: (-row[0], row[1]))
+        for (total, user_id), rank in zip(totals, competition_ranks([row[0] for row in totals])):
+            semester_ranks[(user_id, semester)] = {'user_id': user_id, 'branch': branch, 'semester': semester,
+                                                   'total': total, 'class_rank': rank}
+
+    branches = {}
+    for student in students.values():
+        student['cumulative_average'] = cumulative_average(student['total_sum'], student['semesters'])
+        branches.setdefault(student['branch'], []).append(student)
+    for members in branches.values():
+        members.sort(key=lambda row: (-row['cumulative_average'], row['user_id']))
+        for student, rank in zip(members, competition_ranks([row['cumulative_average'] for row in members])):
+            student['class_rank'] = rank
+    return semester_ranks, students
+
+
+def check_standings(connection, max_mismatches=100):
+    # compares the stored tables with a recomputation, floats within 1e-6
+    semester_ranks, students = compute_standings(connection)
+    mismatches = []
+    count = [0]
+
+    def compare(table, key, expected, found, fields):
+        differs = found is None or expected is None or any(
+            abs(expected[field] - found[field]) > 1e-6 if isinstance(expected[field], float)
+            else expected[field] != found[field] for field in fields)
+        if differs:
+            count[0] += 1
+            if len(mismatches) < max_mismatches:
+                mismatches.append({'table': table, 'key': key, 'expected': expected, 'found': found})
+
+    stored = {}
+    for row in connection.execute(text('SELECT user_id, branch, semester, total, class_rank FROM "SemesterRanks"')):
+        stored[(row[0], row[2])] = dict(zip(('user_id', 'branch', 'semester', 'total', 'class_rank'), row))
+    for key in set(semester_ranks) | set(stored):
+        compare('SemesterRanks', list(key), semester_ranks.get(key), stored.get(key),
+                ('branch', 'total', 'class_rank'))
+
+    stored = {}
+    for row in connection.execute(text('SELECT user_id, branch, semesters, total_sum, cumulative_average, '
+                                       'class_rank FROM "StudentStandings"')):
+        stored[row[0]] = dict(zip(('user_id', 'branch', 'semesters', 'total_sum', 'cumulative_average',
+                                   'class_rank'), row))
+    for key in set(students) | set(stored):
+        compare('StudentStandings', key, students.get(key), stored.get(key),
+                ('branch', 'semesters', 'cumulative_average', 'class_rank'))
+
+    return {
+        'semester_ranks': len(semester_ranks),
+        'standings': len(students),
+        'mismatches': count[0],
+        'examples': mismatches
+    }
+
+
+def rebuild_standings(connection):
+    semester_ranks, students = compute_standings(connection)
+    connection.execute(text('DELETE FROM "SemesterRanks"'))
+    connection.execute(text('DELETE FROM "StudentStandings"'))
+    if semester_ranks:
+        connection.execute(text('INSERT INTO "SemesterRanks" (user_id, branch, semester, total, class_rank) '
+                                'VALUES (:user_id, :branch, :semester, :total, :class_rank)'),
+                           list(semester_ranks.values()))
+    if students:
+        connection.execute(text('INSERT INTO "StudentStandings" (user_id, branch, semesters, total_sum, '
+                                'cumulative_average, class_rank) VALUES (:user_id, :branch, :semesters, '
+                                ':total_sum, :cumulative_average, :class_rank)'), list(students.values()))
+    return {'semester_ranks': len(semester_ranks), 'standings': len(students)}